@@ -3,13 +3,19 @@ from desiutil.iers import freeze_iers
 freeze_iers()
 from LSS.SV3.altmtltools import writeBitweights
 from desiutil.log import get_logger
-from LSS.bitweights import pack_bitweights
+from LSS.bitweights import or_bitweights
 from sys import argv
+import sys
+import desitarget.io
+from astropy.table import Table
 import numpy as np
 import argparse
+import hashlib
 import os
+from time import time
 import multiprocessing as mp
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import logging
 import atexit
 log = get_logger()
@@ -26,6 +32,8 @@ parser.add_argument('-ow', '--overwrite', dest = 'overwrite', default=False, act
 parser.add_argument('-v', '--verbose', dest = 'verbose', default=False, action='store_true', help = 'set flag to enter verbose mode')
 parser.add_argument('-d', '--debug', dest = 'debug', default=False, action='store_true', help = 'set flag to enter debug mode.')
 parser.add_argument('-prof', '--profile', dest = 'profile', default=False, action='store_true', help = 'set flag to profile code time usage.')
+parser.add_argument('-pr', '--parallelRead', dest = 'parallelRead', default=False, action='store_true', help = 'set flag to read the ledgers of all realizations with a pool of ProcPerNode workers and build the bitweights of each healpixel in one pass, instead of calling writeBitweights once per healpixel.')
+parser.add_argument('-rp', '--readPool', dest='readPool', default='process', choices = ['process', 'thread'], help = 'type of worker pool used to read the ledgers with --parallelRead.', required = False, type = str)
 
 '''
 survey = argv[1]
@@ -49,11 +57,94 @@ def procFunc(nproc):
     for hp in thisHPList:
         writeBitweights(mtlBaseDir, ndirs = args.ndir, hplist = [hp], debug = args.debug, verbose = args.verbose, outdir = args.outdir, survey = args.survey, obscon = args.obscon.lower(), allFiles = False, overwrite = args.overwrite)
 
+def bitweightFileName(hp):
+    """Name of the bitweight file of healpixel hp, as written by writeBitweights."""
+    return args.outdir + '/BitweightFiles/' + args.survey + '/' + args.obscon.lower() + '/{0}bw-{1}-hp-{2}.fits'.format(args.survey.lower(), args.obscon.lower(), hp)
+
+def readObsFlags(task):
+    """Read the ledger of realization r in healpixel hp.
+
+    Returns a SHA-1 hash of its TARGETIDs (in ledger order), the TARGETIDs
+    themselves if returntids is True (None otherwise) and the observed flags.
+    """
+    r, hp, returntids = task
+    mtldir = mtlBaseDir.format(r) + '/' + args.survey + '/' + args.obscon.lower()
+    MTL = desitarget.io.read_mtl_in_hp(mtldir, 32, [hp], unique=True, isodate=None, returnfn=False, initial=False, leq=False, columns=['TARGETID', 'NUMOBS'])
+    TIDs = MTL['TARGETID'].astype(np.int64)
+    TIDHash = hashlib.sha1(TIDs.tobytes()).hexdigest()
+    return TIDHash, (TIDs if returntids else None), MTL['NUMOBS'] > 0.5
+
+def parallelReadBitweights(hplist, nworkers):
+    """Build and write the bitweight files of the healpixels in hplist.
+
+    Each (realization, healpixel) ledger is read exactly once by a pool of
+    nworkers. The TARGETID ordering of each healpixel is computed once from
+    realization 0, and the other realizations are checked against it by
+    comparing a hash of their TARGETIDs (ledgers read with unique=True come
+    in a deterministic order), so no ledger is sorted more than once. The
+    observed flags of each ledger are ORed into packed int64 bitweights as
+    they are read (see :func:`LSS.bitweights.or_bitweights`), along with a
+    running count of observations for PROB_OBS, so the memory held per
+    healpixel is ceil(ndir/64) words per target rather than ndir flags.
+    """
+    hplist = [hp for hp in hplist if args.overwrite or not os.path.exists(bitweightFileName(hp))]
+    if len(hplist) == 0:
+        log.info('all bitweight files already exist, pass --overwrite to regenerate them')
+        return
+    os.makedirs(args.outdir + '/BitweightFiles/' + args.survey + '/' + args.obscon.lower(), exist_ok = True)
+    PoolType = ThreadPool if args.readPool == 'thread' else Pool
+    timings = {}
+    with PoolType(nworkers) as p:
+        # ADM realization 0 sets the (shared) TARGETID ordering of each healpixel.
+        start = time()
+        TIDHashes, TIDs, orders, bitweights, ObsArr = {}, {}, {}, {}, {}
+        for hp, (TIDHash, hpTIDs, flags) in zip(hplist, p.map(readObsFlags, [(0, hp, True) for hp in hplist])):
+            TIDHashes[hp] = TIDHash
+            orders[hp] = np.argsort(hpTIDs, kind = 'stable')
+            TIDs[hp] = hpTIDs[orders[hp]]
+            bitweights[hp] = np.zeros((len(hpTIDs), (args.ndir + 63)//64), dtype = np.int64)
+            ObsArr[hp] = np.zeros(len(hpTIDs), dtype = np.int64)
+            flags = flags[orders[hp]]
+            or_bitweights(bitweights[hp], flags, 0)
+            ObsArr[hp] += flags
+        timings['reference read'] = time() - start
+
+        start = time()
+        tasks = [(r, hp, False) for r in range(1, args.ndir) for hp in hplist]
+        for (r, hp, _), (TIDHash, _, flags) in zip(tasks, p.imap(readObsFlags, tasks)):
+            if TIDHash != TIDHashes[hp]:
+                raise ValueError('TARGETIDs of realization {0:d} differ from those of realization 0 in healpixel {1}'.format(r, hp))
+            flags = flags[orders[hp]]
+            or_bitweights(bitweights[hp], flags, r)
+            ObsArr[hp] += flags
+        timings['ledger reads'] = time() - start
+
+    start = time()
+    for hp in hplist:
+        data = Table({'TARGETID': TIDs[hp], 'BITWEIGHTS': bitweights[hp], 'PROB_OBS': ObsArr[hp]/args.ndir},
+              names=['TARGETID', 'BITWEIGHTS', 'PROB_OBS'])
+        data.write(bitweightFileName(hp), overwrite = args.overwrite)
+        del bitweights[hp], ObsArr[hp]
+    timings['writing'] = time() - start
+    for stage, t in timings.items():
+        log.info('{0}: {1:.2f} s'.format(stage, t))
+
 try:
     NNodes = int(os.getenv('SLURM_JOB_NUM_NODES'))
 except:
     log.warning('no SLURM_JOB_NUM_NODES env set. You may not be on a compute node.')
     NNodes = 1
+
+if args.parallelRead:
+    # ADM each node takes a contiguous chunk of healpixels and reads all
+    # ADM realizations of them with a pool of ProcPerNode workers.
+    NodeID = int(os.getenv('SLURM_NODEID', 0))
+    nworkers = args.ProcPerNode if args.ProcPerNode is not None else mp.cpu_count()
+    thisHPList = np.array_split(HPList, NNodes)[NodeID]
+    log.info('node {0:d} building bitweights for {1:d} healpixels with {2:d} {3} workers'.format(NodeID, len(thisHPList), nworkers, args.readPool))
+    parallelReadBitweights(thisHPList, nworkers)
+    sys.exit(0)
+
 NodeID = int(os.getenv('SLURM_NODEID'))
 SlurmNProcs = int(os.getenv('SLURM_NPROCS'))
 NProc = int(NNodes*args.ProcPerNode)
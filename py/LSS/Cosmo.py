@@ -6,6 +6,7 @@
 from math import *
 #from scipy.integrate import romberg
 from LSS.romberg import rom
+import numpy as np
 #from scipy.special import gamma as gamfunc
 #from gamma import gamfunc
 #from scipy import interpolate
@@ -86,6 +87,12 @@ def alphtheta(z,omf,hf,obhhf,om,h,obhh):
 
 
 
+# tabulated integral of the evolution function (i.e., comoving distance in units of c/H0), shared between all
+# instances with the same (omega, lamda, w); keys are (om,ol,fa), values are (z grid, integral, evolution on grid)
+_dc_tables = {}
+_dc_dz = 1e-3 # grid spacing; with cubic Hermite interpolation, errors are << the 1e-8 romberg tolerance
+_dc_zmax = 10. # default extent of the grid, extended as needed
+
 class distance:
 # I know I spelled lambda wrong but do YOU know WHY?
 	def __init__(self,omega=0.3,lamda=0.7,h=1,w=-1.,gam=.557,obhh=.0224):
@@ -126,13 +133,58 @@ class distance:
 	def olz(self,z): # Omega_Lamda (as a function of z FLAT COSMO!)
 		return self.ol/(self.om*(1.+z)**3.+self.ol*(1.+z)**self.fa)*(1.+z)**self.fa
 	def Hz(self,z):  # Hubble parameter h(z) (FLAT COSMOLOGY!!!!).
-		return self.h0*sqrt(self.om*(1.+z)**3.+self.ol*(1.+z)**self.fa)
+		return self.h0*np.sqrt(self.om*(1.+z)**3.+self.ol*(1.+z)**self.fa)
 
 	def cHz(self,z):  # speed of light divided by Hubble parameter h(z) (FLAT COSMOLOGY!!!!).
 		return self.c/self.Hz(z)
 
 	def evolution(self, z):
-		return 1./(sqrt(self.om*(1.+z)**3.+self.ol*(1.+z)**self.fa))
+		return 1./(np.sqrt(self.om*(1.+z)**3.+self.ol*(1.+z)**self.fa))
+
+	def _dctab(self,zmax=_dc_zmax,neg=False):
+# Grid of the integral of the evolution function from 0 to z, and of its derivative, cached per cosmology.
+# Each step is integrated with Simpson's rule; the grid is extended if zmax is beyond it.
+# If neg, the grid is in u = -z, from 0 to 1-_dc_dz (i.e., down to z just above -1)
+		key = (self.om,self.ol,self.fa,neg)
+		if neg:
+			zmax = 1.-_dc_dz
+		if key in _dc_tables and _dc_tables[key][0][-1] >= zmax:
+			return _dc_tables[key]
+		if not neg:
+			zmax = max(_dc_zmax,zmax)
+			if key in _dc_tables:
+				zmax = max(zmax,2.*_dc_tables[key][0][-1])
+		sgn = -1. if neg else 1.
+		nz = int(round(zmax/_dc_dz))+1 if neg else int(np.ceil(zmax/_dc_dz))+1
+		zt = np.arange(nz)*_dc_dz
+		ev = self.evolution(sgn*zt)
+		evmid = self.evolution(sgn*(zt[:-1]+_dc_dz/2.))
+		chit = np.zeros(nz)
+		chit[1:] = sgn*np.cumsum(_dc_dz/6.*(ev[:-1]+4.*evmid+ev[1:]))
+		_dc_tables[key] = (zt,chit,sgn*ev)
+		return _dc_tables[key]
+
+	def _chi(self,z):
+# Comoving distance in units of c/H0 for scalar or array z, by cubic Hermite interpolation of the tabulated
+# integral (the derivative is the evolution function); -1 < z < 0 uses the table in -z, other z (including nan and inf) give nan
+		z = np.asarray(z,dtype=float)
+		zf = np.atleast_1d(z)
+		out = np.full(zf.shape,np.nan)
+		with np.errstate(invalid='ignore'):
+			pos = np.isfinite(zf) & (zf >= 0)
+			neg = (zf < 0) & (zf > -1)
+		for sel,u,isneg in ((pos,zf[pos],False),(neg,-zf[neg],True)):
+			if len(u) == 0:
+				continue
+			zt,chit,dchit = self._dctab(np.max(u),neg=isneg)
+			i = np.minimum((u/_dc_dz).astype(int),len(zt)-2)
+			t = (u-zt[i])/_dc_dz
+			t2 = t*t
+			t3 = t2*t
+			out[sel] = (2.*t3-3.*t2+1.)*chit[i]+(t3-2.*t2+t)*_dc_dz*dchit[i]+(-2.*t3+3.*t2)*chit[i+1]+(t3-t2)*_dc_dz*dchit[i+1]
+		if z.ndim == 0:
+			return float(out[0])
+		return out.reshape(z.shape)
 
 	def dV(self,z):
 		#spherically averaged distance quantity
@@ -141,33 +193,23 @@ class distance:
 		return self.dc(z)/(1.+z)
 	def dl(self, z):   # Luminosity distance from now to z
 		return self.dc(z)*(1.+z)
-	def dc(self, z): # Comoving distance from now to z
-		return ((self.c/self.h0)*rom(0,z,self.evolution))    
+	def dc(self, z): # Comoving distance from now to z; z can be a scalar or an array
+		return (self.c/self.h0)*self._chi(z)
 #        
 	def dc2z(self,x):
-		zup = 1.
-		zdown = .001
-		xup = self.dc(zup)
-		xdown = self.dc(zdown)
-		zt = (zup+zdown)/2.
-		xt = self.dc(zt)
-		while abs(xt - x) > .001:
-			while xdown > x:
-				zdown = zdown - .1
-				xdown = self.dc(zdown)
-				print( zdown,xdown,x)
-			if abs(x - xdown) < abs(xup - x):
-				zup = zt
-				xup = xt
-				zt = (zdown+zt)/2.
-				xt = self.dc(zt)
-			else:
-				zdown = zt
-				xdown = xt
-				zt = (zup+zt)/2.
-				xt = self.dc(zt)
-			print( xt,zt,zdown,zup,xdown,xup)
-		return zt
+# Redshift for comoving distance(s) x, inverting the tabulated relation and refining with Newton steps
+		x = np.asarray(x,dtype=float)
+		chi = x/(self.c/self.h0)
+		zt,chit,ev = self._dctab()
+		chimax = np.max(chi[np.isfinite(chi)],initial=0.)
+		while chit[-1] < chimax:
+			zt,chit,ev = self._dctab(2.*zt[-1])
+		zt_ = np.interp(chi,chit,zt)
+		for it in range(0,3):
+			zt_ = zt_-(self._chi(zt_)-chi)/self.evolution(zt_)
+		if x.ndim == 0:
+			return float(zt_)
+		return zt_
 
 	def mkD(self,zb=.01):
 		Dl = []
@@ -201,7 +243,8 @@ class distance:
 		return ans
     
 	def covol(self,z1,z2): #full-sky comoving volume in shell between z1 and z2
-		return rom(z1,z2,self.covolfunc)
+		#this is the integral of covolfunc, which is the derivative of 4pi/3 dc^3; z1 and z2 can be arrays
+		return 4.*pi/3.*(self.dc(z2)**3.-self.dc(z1)**3.)
 
 		
 		
@@ -332,7 +375,7 @@ class distance:
 
 	def dm(self,z):
 # Distance Modulus by redshift in a given cosmology
-		return 5.*log10(self.dl(z)) + 25.
+		return 5.*np.log10(self.dl(z)) + 25.
 
 	def Kcorr(self,z,alph=0):
 # Simple k-correction in given cosmology for given spectral slope
@@ -51,6 +51,7 @@ from numpy import random as rand
 import numpy.lib.recfunctions as rfn
 
 import os
+import socket
 import pickle
 import subprocess
 import sys
@@ -364,44 +365,116 @@ def createFAmap(FAReal, FAAlt, TargAlt = None, changeFiberOpt = None, debug = Fa
 
 
 def makeAlternateZCat(zcat, real2AltMap, alt2RealMap, debug = False, verbose = False):
-    from collections import Counter
     zcatids = zcat['TARGETID']
     altZCat = Table(zcat)
-    if debug:
-        failures = 0
-        negativeIDs = 0
-    for n, i in zip(zcatids, range(len(zcatids))):
-        cond = (n == zcatids)
-        if debug and (n < 0):
-            negativeIDs +=1   
-        altid = real2AltMap[n]
-
-        altZCat['TARGETID'][i] = altid
     if debug:
         log.info('negIDs')
-        log.info(negativeIDs)
-        log.info('failures')
-        log.info(failures)
-        log.info('testctr')
-    d =  Counter(altZCat['TARGETID'])  
-    res = [ k for k, v in d.items() if v > 1]
+        log.info(np.sum(zcatids < 0))
+    # the maps can be legacy dictionaries or (keys, values) arrays, see readFAmap
+    altZCat['TARGETID'] = famapRemap(famapToArrays(real2AltMap), zcatids)
+    altids, counts = np.unique(altZCat['TARGETID'], return_counts = True)
+    res = altids[counts > 1]
     if debug:
         log.info('res')
         log.info(res)
     if len(res):
         log.info('how many pre dup cuts')
         log.info(zcatids.shape)
-        cond2 = np.ones(zcatids.shape, dtype=bool)
-        for i in res:
-            log.info('test')
-            log.info(np.sum(zcatids == i))
-            cond2 = cond2 & (altcatids != i)
+        cond2 = np.invert(np.isin(altZCat['TARGETID'], res))
         log.info("how many post dup cuts")
         log.info(np.sum(cond2))
     else:
         log.info("supposedly, no duplicates")
     return altZCat
 
+def famapToArrays(famap):
+    """Convert a fiber assignment TARGETID map to sorted arrays.
+
+    Parameters
+    ----------
+    famap : :class:`dict` or :class:`tuple`
+        Either a legacy dictionary (as made by :func:`createFAmap()`) or a
+        (keys, values) tuple of arrays.
+
+    Returns
+    -------
+    :class:`tuple`
+        (keys, values) int64 arrays, sorted by keys.
+    """
+    if isinstance(famap, dict):
+        keys = np.fromiter(famap.keys(), dtype=np.int64, count=len(famap))
+        vals = np.fromiter(famap.values(), dtype=np.int64, count=len(famap))
+    else:
+        keys, vals = np.asarray(famap[0], dtype=np.int64), np.asarray(famap[1], dtype=np.int64)
+    ii = np.argsort(keys, kind='stable')
+    return keys[ii], vals[ii]
+
+def famapRemap(famap, tids):
+    """Map TARGETIDs through a fiber assignment map with a searchsorted lookup.
+
+    Parameters
+    ----------
+    famap : :class:`tuple`
+        (keys, values) sorted arrays as returned by :func:`famapToArrays()`.
+    tids : :class:`~numpy.array`
+        TARGETIDs to remap. All must be keys of the map.
+
+    Returns
+    -------
+    :class:`~numpy.array`
+        The remapped TARGETIDs.
+    """
+    keys, vals = famap
+    tids = np.asarray(tids)
+    if len(keys) == 0:
+        ii = np.zeros(len(tids), dtype=int)
+        missing = np.ones(len(tids), dtype=bool)
+    else:
+        ii = np.clip(np.searchsorted(keys, tids), 0, len(keys) - 1)
+        missing = keys[ii] != tids
+    if np.any(missing):
+        raise KeyError('{0} TARGETIDs not in the fiber assignment map, e.g. {1}'.format(np.sum(missing), tids[missing][0]))
+    return vals[ii]
+
+def writeFAmap(FAMapName, A2RMap, R2AMap):
+    """Write a fiber assignment map as sorted int64 TARGETID arrays in a FITS file
+    with REAL2ALT and ALT2REAL extensions (replacing the legacy pickle files)."""
+    realtid, alttid = famapToArrays(R2AMap)
+    r2a = np.zeros(len(realtid), dtype=[('TARGETID', '>i8'), ('ALTTARGETID', '>i8')])
+    r2a['TARGETID'], r2a['ALTTARGETID'] = realtid, alttid
+    alttid, realtid = famapToArrays(A2RMap)
+    a2r = np.zeros(len(alttid), dtype=[('ALTTARGETID', '>i8'), ('TARGETID', '>i8')])
+    a2r['ALTTARGETID'], a2r['TARGETID'] = alttid, realtid
+    tmpfn = FAMapName + '.tmp'
+    fitsio.write(tmpfn, r2a, extname='REAL2ALT', clobber=True)
+    fitsio.write(tmpfn, a2r, extname='ALT2REAL')
+    os.rename(tmpfn, FAMapName)
+
+def readFAmap(FAMapName):
+    """Read a fiber assignment map written by :func:`writeFAmap()`.
+
+    Parameters
+    ----------
+    FAMapName : :class:`str`
+        Name of the map file. If it ends in .pickle, or the FITS file does
+        not exist but a legacy .pickle file of the same name does, the legacy
+        pickled dictionaries are read instead.
+
+    Returns
+    -------
+    :class:`tuple`
+        (A2RMap, R2AMap), each a (keys, values) tuple of sorted int64 arrays.
+    """
+    base = FAMapName[:-len('.fits')] if FAMapName.endswith('.fits') else FAMapName
+    if FAMapName.endswith('.pickle') or ((not os.path.isfile(FAMapName)) and os.path.isfile(base + '.pickle')):
+        fn = FAMapName if FAMapName.endswith('.pickle') else base + '.pickle'
+        with open(fn,'rb') as fl:
+            (A2RMap, R2AMap) = pickle.load(fl,fix_imports = True)
+        return famapToArrays(A2RMap), famapToArrays(R2AMap)
+    r2a = fitsio.read(FAMapName, ext='REAL2ALT')
+    a2r = fitsio.read(FAMapName, ext='ALT2REAL')
+    return (a2r['ALTTARGETID'].astype(np.int64), a2r['TARGETID'].astype(np.int64)), (r2a['TARGETID'].astype(np.int64), r2a['ALTTARGETID'].astype(np.int64))
+
 def checkMTLChanged(MTLFile1, MTLFile2):
     MTL1 = desitarget.io.read_mtl_ledger(MTLFile1, unique = True)
     MTL2 = desitarget.io.read_mtl_ledger(MTLFile2, unique = True)
@@ -427,6 +500,44 @@ def checkMTLChanged(MTLFile1, MTLFile2):
     print('Number targets with different SUBPRIORITY')
     print(NDiff3)
 
+def checkLedgersMatch(hpdirname1, hpdirname2, ignorecols = ['TIMESTAMP']):
+    """Check that two directories of HEALPixel-split ledgers hold the same
+    entries, in the same order, apart from the columns in `ignorecols`.
+
+    Parameters
+    ----------
+    hpdirname1, hpdirname2 : :class:`str`
+        Full paths to directories containing MTL ledgers partitioned by HEALPixel.
+    ignorecols : :class:`list`, optional, defaults to ``['TIMESTAMP']``
+        Columns not compared.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if all ledgers match.
+    """
+    ender = get_mtl_ledger_format()
+    fns1 = sorted([os.path.basename(fn) for fn in glob.glob(os.path.join(hpdirname1, '*.' + ender))])
+    fns2 = sorted([os.path.basename(fn) for fn in glob.glob(os.path.join(hpdirname2, '*.' + ender))])
+    if fns1 != fns2:
+        log.info('ledger files differ: {0}'.format(set(fns1) ^ set(fns2)))
+        return False
+    match = True
+    for fn in fns1:
+        MTL1 = desitarget.io.read_mtl_ledger(os.path.join(hpdirname1, fn), unique = False)
+        MTL2 = desitarget.io.read_mtl_ledger(os.path.join(hpdirname2, fn), unique = False)
+        if len(MTL1) != len(MTL2):
+            log.info('{0}: {1} vs {2} entries'.format(fn, len(MTL1), len(MTL2)))
+            match = False
+            continue
+        for col in MTL1.dtype.names:
+            if col in ignorecols:
+                continue
+            if not np.array_equal(MTL1[col], MTL2[col]):
+                log.info('{0}: column {1} differs'.format(fn, col))
+                match = False
+    return match
+
 def makeTileTrackerFN(dirName, survey, obscon):
     return dirName + '/{0}survey-{1}obscon-TileTracker.ecsv'.format(survey, obscon.upper())
 def makeTileTracker(altmtldir, survey = 'main', obscon = 'DARK', startDate = None,
@@ -1149,12 +1260,12 @@ def make_fibermaps(altmtldir, OrigFAs, AltFAs, AltFAs2, TSs, fadates, tiles, sur
         fbadirbase = altmtldir + '/fa/' + survey.upper() +  '/' + fadate + '/'
         if getosubp:
             FAAltName = altmtldir + '/fa/' + survey.upper() +  '/' + fadate + '/orig/fba-' + ts+ '.fits'
-            FAMapName = fbadirbase + '/orig/famap-' + ts + '.pickle'
+            FAMapName = fbadirbase + '/orig/famap-' + ts + '.fits'
             fbadir = altmtldir + '/fa/' + survey.upper() +  '/' + fadate + '/orig/'
         else:
 
             FAAltName = altmtldir + '/fa/' + survey.upper() +  '/' + fadate + '/fba-' + ts+ '.fits'
-            FAMapName = fbadirbase + '/famap-' + ts + '.pickle'
+            FAMapName = fbadirbase + '/famap-' + ts + '.fits'
             fbadir = fbadirbase
 
 
@@ -1165,9 +1276,8 @@ def make_fibermaps(altmtldir, OrigFAs, AltFAs, AltFAs2, TSs, fadates, tiles, sur
         
         if redoFA or (not (os.path.isfile(FAMapName))):
             if verbose:
-                log.info('dumping out fiber map to pickle file')
-            with open(FAMapName, 'wb') as handle:
-                pickle.dump((A2RMap, R2AMap), handle, protocol=pickle.HIGHEST_PROTOCOL)
+                log.info('writing out fiber map to {0}'.format(FAMapName))
+            writeFAmap(FAMapName, A2RMap, R2AMap)
         #thisUTCDate = get_utc_date(survey=survey)
         if verbose:
             log.info('---')
@@ -1182,8 +1292,161 @@ def make_fibermaps(altmtldir, OrigFAs, AltFAs, AltFAs2, TSs, fadates, tiles, sur
         log.info('write_amtl_tile_tracker retval = {0}'.format(retval))
 
     return A2RMap, R2AMap
+
+def _zcat_lock_is_stale(lockfn, timeout):
+    """Whether the zcat cache lock `lockfn` (see :func:`make_zcat_cached()`)
+    was left behind by a process that died, or is older than `timeout` seconds."""
+    try:
+        if time() - os.path.getmtime(lockfn) > timeout:
+            return True
+        with open(lockfn) as f:
+            host, pid = f.read().split()
+    except (OSError, ValueError):
+        # ADM the lock was removed, or its owner is still writing it.
+        return False
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+def make_zcat_cached(zcatdir, t, obscon, survey, cachedir = None, timeout = 1800):
+    """Wrapper on :func:`~desitarget.mtl.make_zcat()` for a single tile action
+    that caches the real zcat on disk, so it is built only once for all realizations.
+
+    Parameters
+    ----------
+    zcatdir : :class:`str`
+        Full path to the "daily" directory that hosts redshift catalogs.
+    t : :class:`~astropy.table.Row`
+        Tile action (from the alt MTL tile tracker) to build the zcat for.
+    obscon, survey : :class:`str`
+        As for :func:`~desitarget.mtl.make_zcat()`.
+    cachedir : :class:`str`, optional, defaults to ``None``
+        Directory (ideally on local disk or /dev/shm) shared by the processes
+        running the different realizations. If ``None``, no caching is done.
+    timeout : :class:`float`, optional, defaults to 1800
+        Seconds to wait for another process building the same zcat before
+        building it independently. A lock older than this is considered stale.
+
+    Returns
+    -------
+    :class:`~astropy.table.Table`
+        The zcat, identical to the output of :func:`~desitarget.mtl.make_zcat()`.
+
+    Notes
+    -----
+    - The first process to request a tile takes a lock file (holding its
+      host name and PID), builds the zcat and writes it atomically as a .npy
+      file; the others wait for that file and then read it through a memory
+      map, which the returned table shares rather than copies.
+    - A lock left by a process that died (same host and no such PID, or a
+      lock older than `timeout`) is removed, so later realizations do not
+      wait for it.
+    """
+    if cachedir is None:
+        return make_zcat(zcatdir, [t], obscon, survey)
+    key = '-'.join([str(t[col]) for col in ['TILEID', 'ZDATE', 'ARCHIVEDATE'] if col in t.dtype.names])
+    fn = os.path.join(cachedir, 'zcat-{0}-{1}-{2}.npy'.format(survey.lower(), obscon.lower(), key))
+    lockfn = fn + '.lock'
+    lockid = '{0} {1:d}'.format(socket.gethostname(), os.getpid())
+    start = time()
+    while not os.path.isfile(fn):
+        try:
+            os.makedirs(cachedir, exist_ok = True)
+            fd = os.open(lockfn, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _zcat_lock_is_stale(lockfn, timeout):
+                log.warning('removing stale lock {0}'.format(lockfn))
+                try:
+                    os.remove(lockfn)
+                except FileNotFoundError:
+                    pass
+                continue
+            if time() - start > timeout:
+                log.warning('timed out waiting for {0}, building zcat without the cache'.format(lockfn))
+                return make_zcat(zcatdir, [t], obscon, survey)
+            sleep(0.5)
+            continue
+        try:
+            os.write(fd, lockid.encode())
+            # another process may have finished between the check and the lock
+            if os.path.isfile(fn):
+                break
+            zcat = make_zcat(zcatdir, [t], obscon, survey)
+            tmpfn = fn[:-len('.npy')] + '.tmp{0:d}.npy'.format(os.getpid())
+            np.save(tmpfn, zcat.as_array().astype(zcat.dtype))
+            os.replace(tmpfn, fn)
+            log.info('cached zcat for tile {0} in {1}'.format(t['TILEID'], fn))
+            return zcat
+        finally:
+            os.close(fd)
+            # ADM only remove the lock if it is still ours (it may have
+            # ADM been broken as stale and taken by another process).
+            try:
+                with open(lockfn) as f:
+                    if f.read() == lockid:
+                        os.remove(lockfn)
+            except FileNotFoundError:
+                pass
+    return Table(np.load(fn, mmap_mode = 'r'), copy = False)
+
+def make_alt_zcat_for_tile(altmtldir, t, survey = 'sv3', obscon = 'dark', getosubp = False, zcatdir = None,
+    zcatcachedir = None, verbose = False, debug = False):
+    """Build the real zcat for tile action `t` and its alternate version, using the
+    fiber assignment map of the realization in `altmtldir`. Returns (zcat, altZCat)."""
+    ts = str(t['TILEID']).zfill(6)
+
+    FAOrigName = '/global/cfs/cdirs/desi/target/fiberassign/tiles/trunk/'+ts[:3]+'/fiberassign-'+ts+'.fits.gz'
+    fhtOrig = fitsio.read_header(FAOrigName)
+    fadate = fhtOrig['RUNDATE']
+    fadate = ''.join(fadate.split('T')[0].split('-'))
+    fbadirbase = altmtldir + '/fa/' + survey.upper() +  '/' + fadate + '/'
+    log.info('t = {0}'.format(t))
+    log.info('fbadirbase = {0}'.format(fbadirbase))
+    log.info('ts = {0}'.format(ts))
+
+    if getosubp:
+        FAMapName = fbadirbase + '/orig/famap-' + ts + '.fits'
+    else:
+        FAMapName = fbadirbase + '/famap-' + ts + '.fits'
+
+    log.info('FAMapName = {0}'.format(FAMapName))
+    (A2RMap, R2AMap) = readFAmap(FAMapName)
+
+    # ADM create the catalog of updated redshifts.
+    log.info('making zcats')
+    log.info('zcatdir = {0}'.format(zcatdir))
+    log.info('t = {0}'.format(t))
+    zcat = make_zcat_cached(zcatdir, t, obscon, survey, cachedir = zcatcachedir)
+
+    altZCat = makeAlternateZCat(zcat, R2AMap, A2RMap, debug = debug, verbose = verbose)
+    # ADM insist that for an MTL loop with real observations, the zcat
+    # ADM must conform to the data model. In particular, it must include
+    # ADM ZTILEID, and other columns addes for the Main Survey. These
+    # ADM columns may not be needed for non-ledger simulations.
+    # ADM Note that the data model differs with survey type.
+    zcatdm = survey_data_model(zcatdatamodel, survey=survey)
+    if zcat.dtype.descr != zcatdm.dtype.descr:
+        msg = "zcat data model must be {} not {}!".format(
+            zcatdm.dtype.descr, zcat.dtype.descr)
+        log.critical(msg)
+        raise ValueError(msg)
+    # ADM useful to know how many targets were updated.
+    _, _, _, _, sky, _ = decode_targetid(zcat["TARGETID"])
+    ntargs, nsky = np.sum(sky == 0), np.sum(sky)
+    msg = "Update state for {} targets".format(ntargs)
+    msg += " (the zcats also contain {} skies with +ve TARGETIDs)".format(nsky)
+    log.info(msg)
+    return zcat, altZCat
+
 def update_alt_ledger(altmtldir,althpdirname, altmtltilefn,  actions, survey = 'sv3', obscon = 'dark', today = None, 
-    getosubp = False, zcatdir = None, mock = False, numobs_from_ledger = True, targets = None, verbose = False, debug = False):
+    getosubp = False, zcatdir = None, mock = False, numobs_from_ledger = True, targets = None, verbose = False, debug = False,
+    zcatcachedir = None):
     if verbose or debug:
         log.info('today = {0}'.format(today))
         log.info('obscon = {0}'.format(obscon))
@@ -1207,50 +1470,8 @@ def update_alt_ledger(altmtldir,althpdirname, altmtltilefn,  actions, survey = '
         if t['ACTIONTYPE'].lower() == 'reproc':
             raise ValueError('Reprocessing should be handled elsewhere.')
             #raise ValueError('Make sure backup is made and reprocessing logic is correct before beginning reprocessing.')
-        ts = str(t['TILEID']).zfill(6)
-
-        FAOrigName = '/global/cfs/cdirs/desi/target/fiberassign/tiles/trunk/'+ts[:3]+'/fiberassign-'+ts+'.fits.gz'
-        fhtOrig = fitsio.read_header(FAOrigName)
-        fadate = fhtOrig['RUNDATE']
-        fadate = ''.join(fadate.split('T')[0].split('-'))
-        fbadirbase = altmtldir + '/fa/' + survey.upper() +  '/' + fadate + '/'
-        log.info('t = {0}'.format(t))
-        log.info('fbadirbase = {0}'.format(fbadirbase))
-        log.info('ts = {0}'.format(ts))
-
-        if getosubp:
-            FAMapName = fbadirbase + '/orig/famap-' + ts + '.pickle'
-        else:
-            FAMapName = fbadirbase + '/famap-' + ts + '.pickle'
-
-        log.info('FAMapName = {0}'.format(FAMapName))
-        with open(FAMapName,'rb') as fl:
-            (A2RMap, R2AMap) = pickle.load(fl,fix_imports = True)
-
-        # ADM create the catalog of updated redshifts.
-        log.info('making zcats')
-        log.info('zcatdir = {0}'.format(zcatdir))
-        log.info('t = {0}'.format(t))
-        zcat = make_zcat(zcatdir, [t], obscon, survey)
-
-        altZCat = makeAlternateZCat(zcat, R2AMap, A2RMap, debug = debug, verbose = verbose)
-        # ADM insist that for an MTL loop with real observations, the zcat
-        # ADM must conform to the data model. In particular, it must include
-        # ADM ZTILEID, and other columns addes for the Main Survey. These
-        # ADM columns may not be needed for non-ledger simulations.
-        # ADM Note that the data model differs with survey type.
-        zcatdm = survey_data_model(zcatdatamodel, survey=survey)
-        if zcat.dtype.descr != zcatdm.dtype.descr:
-            msg = "zcat data model must be {} not {}!".format(
-                zcatdm.dtype.descr, zcat.dtype.descr)
-            log.critical(msg)
-            raise ValueError(msg)
-        # ADM useful to know how many targets were updated.
-        _, _, _, _, sky, _ = decode_targetid(zcat["TARGETID"])
-        ntargs, nsky = np.sum(sky == 0), np.sum(sky)
-        msg = "Update state for {} targets".format(ntargs)
-        msg += " (the zcats also contain {} skies with +ve TARGETIDs)".format(nsky)
-        log.info(msg)
+        zcat, altZCat = make_alt_zcat_for_tile(altmtldir, t, survey = survey, obscon = obscon, getosubp = getosubp,
+            zcatdir = zcatdir, zcatcachedir = zcatcachedir, verbose = verbose, debug = debug)
         didUpdateHappen = False
         # ADM update the appropriate ledger.
         if mock:
@@ -1296,6 +1517,141 @@ def update_alt_ledger(altmtldir,althpdirname, altmtltilefn,  actions, survey = '
             log.info('has written to amtl_tile_tracker')
 
     return althpdirname, altmtltilefn, ztilefn, actions
+
+def update_alt_ledger_batch(altmtldir, althpdirname, altmtltilefn, actions, survey = 'sv3', obscon = 'dark',
+    getosubp = False, zcatdir = None, mock = False, numobs_from_ledger = True, targets = None, verbose = False, debug = False,
+    zcatcachedir = None):
+    """Batched version of :func:`update_alt_ledger()`.
+
+    Applies a list of tile update actions (e.g. all of a night's tiles) to
+    the HEALPixel-split ledgers in one pass: ledgers are read once, the tiles
+    are pushed through MTL in order in memory, each ledger file is written once
+    and the tile tracker is written once.
+
+    Parameters
+    ----------
+    As for :func:`update_alt_ledger()`, with `actions` the full list of
+    (``'update'``) tile actions to process, in order.
+
+    Returns
+    -------
+    As for :func:`update_alt_ledger()`, plus
+    :class:`dict`
+        A dictionary where the keys are the integer TILEIDs and the values
+        are the TIMESTAMP given to the ledger entries of that tile.
+
+    Notes
+    -----
+    - Rather than sleeping one second between tiles to keep their TIMESTAMPs
+      distinct, the TIMESTAMPs are mocked up in advance as one second apart,
+      starting after both now and the latest TIMESTAMP in the ledgers read.
+    - Apart from TIMESTAMP, the ledger entries are identical to those written
+      by calling :func:`update_alt_ledger()` on each action in turn (see
+      :func:`checkLedgersMatch()`).
+    """
+    zcatdir = get_zcat_dir(zcatdir)
+    ztilefn = os.path.join(zcatdir, get_ztile_file_name())
+    if not isinstance(actions['TILEID'], (collections.abc.Sequence, np.ndarray)):
+        actions = [actions]
+    if np.any([t['ACTIONTYPE'].lower() != 'update' for t in actions]):
+        raise ValueError('Only update actions can be batched.')
+    if mock and (targets is None):
+        raise ValueError('If processing mocks, you MUST specify a target file')
+    t0 = time()
+    log.info('Batch updating ledgers for {0} tiles...t={1:.1f}s'.format(len(actions), time()-t0))
+
+    # ADM find the general format for the ledger files in `hpdirname`.
+    fileform, oc = desitarget.io.find_mtl_file_format_from_header(althpdirname, returnoc=True)
+    overrideff = desitarget.io.find_mtl_file_format_from_header(althpdirname, forceoverride=True)
+    if obscon.upper() != oc:
+        msg = "File is type {} but requested behavior is {}".format(oc, obscon.upper())
+        log.critical(msg)
+        raise RuntimeError(msg)
+
+    altZCats = []
+    for t in actions:
+        zcat, altZCat = make_alt_zcat_for_tile(altmtldir, t, survey = survey, obscon = obscon, getosubp = getosubp,
+            zcatdir = zcatdir, zcatcachedir = zcatcachedir, verbose = verbose, debug = debug)
+        altZCats.append(altZCat)
+
+    nside = desitarget.mtl._get_mtl_nside()
+    # ADM as in update_ledger, if targets wasn't sent, the current state of
+    # ADM the targets is read from the ledger, here just once for all tiles.
+    readledger = mock or (targets is None)
+    if readledger:
+        ra = np.concatenate([altZCat["RA"] for altZCat in altZCats])
+        dec = np.concatenate([altZCat["DEC"] for altZCat in altZCats])
+        pixnum = list(set(hp.ang2pix(nside, np.radians(90-dec), np.radians(ra), nest=True)))
+        targets = desitarget.io.read_mtl_in_hp(althpdirname, nside, pixnum, unique=True)
+    log.info('Read {0} targets...t={1:.1f}s'.format(len(targets), time()-t0))
+
+    # ADM mock up a dictionary of timestamps in advance. This is faster
+    # ADM as no delays need to be built into the code.
+    now = get_utc_date(survey=survey)
+    if readledger and len(targets):
+        latest = np.sort(targets["TIMESTAMP"])[-1]
+        if isinstance(latest, bytes):
+            latest = latest.decode()
+        if latest >= now:
+            now = desitarget.mtl.add_to_iso_date(latest, 1)
+    timestamps = {t['TILEID']: desitarget.mtl.add_to_iso_date(now, s) for s, t in enumerate(actions)}
+
+    # ADM per pixel, the list of blocks to append to the ledger, in order.
+    pixblocks = {}
+    for t, altZCat in zip(actions, altZCats):
+        tileid = t['TILEID']
+        if numobs_from_ledger:
+            tii, zii = desitarget.geomask.match(targets["TARGETID"], altZCat["TARGETID"])
+            altZCat["NUMOBS"][zii] = targets["NUMOBS"][tii] + 1
+        zmtl = desitarget.mtl.make_mtl(targets, oc, zcat=altZCat, trimtozcat=True, trimcols=True)
+        zmtl["TIMESTAMP"][:] = timestamps[tileid]
+        log.info('Tile {0}: {1} targets updated...t={2:.1f}s'.format(tileid, len(zmtl), time()-t0))
+
+        pixnum = hp.ang2pix(nside, np.radians(90-zmtl["DEC"]), np.radians(zmtl["RA"]), nest=True)
+        updates = []
+        for pix in set(pixnum):
+            mtlpix = zmtl[pixnum == pix]
+            mtlpix = mtlpix[np.argsort(mtlpix["TARGETID"])]
+            # ADM as in update_ledger, process the override ledger (if any)
+            # ADM each time its pixel is updated.
+            overfn = overrideff.format(pix)
+            if os.path.exists(overfn):
+                overmtl = desitarget.mtl.process_overrides(overfn)
+                mtlpix = vstack([mtlpix, overmtl])
+            pixblocks.setdefault(pix, []).append(mtlpix)
+            updates.append(mtlpix)
+
+        # ADM the next tile sees the updated (last) state of each target,
+        # ADM as it would when re-reading the ledger.
+        if readledger and len(updates):
+            updates = vstack(updates)
+            _, ii = np.unique(np.flip(np.array(updates["TARGETID"])), return_index=True)
+            updates = updates[len(updates) - 1 - ii]
+            tii, uii = desitarget.geomask.match(targets["TARGETID"], updates["TARGETID"])
+            for col in targets.dtype.names:
+                if col in updates.colnames:
+                    targets[col][tii] = updates[col][uii]
+
+    # ADM write each ledger once.
+    ender = get_mtl_ledger_format()
+    for pix in pixblocks:
+        fn = fileform.format(pix)
+        mtlpix = vstack(pixblocks[pix])
+        if ender == 'ecsv':
+            f = open(fn, "a")
+            astropy.io.ascii.write(mtlpix, f, format='no_header', formats=mtlformatdict)
+            f.close()
+        else:
+            ledger, hd = fitsio.read(fn, extname="MTL", header=True)
+            done = np.concatenate([ledger, mtlpix.as_array()])
+            fitsio.write(fn+'.tmp', done, extname='MTL', header=hd, clobber=True)
+            os.rename(fn+'.tmp', fn)
+    log.info('Wrote {0} ledgers...t={1:.1f}s'.format(len(pixblocks), time()-t0))
+
+    retval = write_amtl_tile_tracker(altmtldir, actions, obscon = obscon, survey = survey)
+    log.info('write_amtl_tile_tracker retval = {0}'.format(retval))
+
+    return althpdirname, altmtltilefn, ztilefn, actions, timestamps
 #@profile
 def loop_alt_ledger(obscon, survey='sv3', zcatdir=None, mtldir=None,
                 altmtlbasedir=None, ndirs = 3, numobs_from_ledger=True, 
@@ -1303,7 +1659,7 @@ def loop_alt_ledger(obscon, survey='sv3', zcatdir=None, mtldir=None,
                     getosubp = False, quickRestart = False, redoFA = False,
                     multiproc = False, nproc = None, testDoubleDate = False, 
                     changeFiberOpt = None, targets = None, mock = False,
-                    debug = False, verbose = False, reproducing = False):
+                    debug = False, verbose = False, reproducing = False, zcatcachedir = None, batchupdates = False):
     """Execute full MTL loop, including reading files, updating ledgers.
 
     Parameters
@@ -1350,6 +1706,14 @@ def loop_alt_ledger(obscon, survey='sv3', zcatdir=None, mtldir=None,
     nproc : :class:`int`, optional, defaults to None
         If multiproc is ``True`` this must be specified. Integer determines 
         directory of alternate MTLs to update.
+    zcatcachedir : :class:`str`, optional, defaults to ``None``
+        Directory in which to cache the real zcat of each tile, so that it
+        is built once and shared by all realizations (see
+        :func:`make_zcat_cached()`). If ``None``, no caching is done.
+    batchupdates : :class:`bool`, optional, defaults to ``False``
+        If ``True`` then consecutive update actions (e.g. all tiles of a
+        night) are applied together with :func:`update_alt_ledger_batch()`,
+        without sleeping between tiles and with a single tile tracker write.
 
     Returns
     -------
@@ -1456,15 +1820,28 @@ def loop_alt_ledger(obscon, survey='sv3', zcatdir=None, mtldir=None,
 
         #for ots,famtlt,reprocFlag in datepairs:
         #while int(today) <= int(endDate):
-        for action in actionList:
+        # ADM (start, end) indices of the groups of actions processed together.
+        actionSlices = []
+        i = 0
+        while i < len(actionList):
+            j = i + 1
+            if batchupdates and actionList[i]['ACTIONTYPE'] == 'update':
+                while (j < len(actionList)) and (actionList[j]['ACTIONTYPE'] == 'update'):
+                    j += 1
+            actionSlices.append((i, j))
+            i = j
+        for i, j in actionSlices:
+            action = actionList[i]
 
             if action['ACTIONTYPE'] == 'fa':
 
                 OrigFAs, AltFAs, AltFAs2, TSs, fadates, tiles = do_fiberassignment(altmtldir, [action], survey = survey, obscon = obscon ,verbose = verbose, debug = debug, getosubp = getosubp, redoFA = redoFA, mock = mock, reproducing = reproducing)
                 assert(len(OrigFAs))
                 A2RMap, R2AMap = make_fibermaps(altmtldir, OrigFAs, AltFAs, AltFAs2, TSs, fadates, tiles, changeFiberOpt = changeFiberOpt, verbose = verbose, debug = debug, survey = survey , obscon = obscon, getosubp = getosubp, redoFA = redoFA )
+            elif (action['ACTIONTYPE'] == 'update') and batchupdates:
+                althpdirname, altmtltilefn, ztilefn, tiles, timedict = update_alt_ledger_batch(altmtldir,althpdirname, altmtltilefn, actionList[i:j], survey = survey, obscon = obscon ,getosubp = getosubp, zcatdir = zcatdir, mock = mock, numobs_from_ledger = numobs_from_ledger, targets = targets, verbose = verbose, debug = debug, zcatcachedir = zcatcachedir)
             elif action['ACTIONTYPE'] == 'update':
-                althpdirname, altmtltilefn, ztilefn, tiles = update_alt_ledger(altmtldir,althpdirname, altmtltilefn, action, survey = survey, obscon = obscon ,getosubp = getosubp, zcatdir = zcatdir, mock = mock, numobs_from_ledger = numobs_from_ledger, targets = targets, verbose = verbose, debug = debug)
+                althpdirname, altmtltilefn, ztilefn, tiles = update_alt_ledger(altmtldir,althpdirname, altmtltilefn, action, survey = survey, obscon = obscon ,getosubp = getosubp, zcatdir = zcatdir, mock = mock, numobs_from_ledger = numobs_from_ledger, targets = targets, verbose = verbose, debug = debug, zcatcachedir = zcatcachedir)
             elif action['ACTIONTYPE'] == 'reproc':
                 #returns timedict
 
@@ -1940,9 +2317,8 @@ def reprocess_alt_ledger(altmtldir, action, obscon="dark", survey = 'main', zcat
     #if getosubp:
     #    FAMapName = fbadirbase + '/orig/famap-' + ts + '.pickle'
     #else:
-    FAMapName = fbadirbase + '/famap-' + ts + '.pickle'
-    with open(FAMapName,'rb') as fl:
-        (A2RMap, R2AMap) = pickle.load(fl,fix_imports = True)
+    FAMapName = fbadirbase + '/famap-' + ts + '.fits'
+    (A2RMap, R2AMap) = readFAmap(FAMapName)
 
     #zcat = make_zcat(zcatdir, dateTiles, obscon, survey)
     zcatdir = get_zcat_dir(zcatdir)
@@ -403,8 +403,7 @@ def gettarinfo_type(faf,tars,goodloc,pdict,tp='SV3_DESI_TARGET'):
     
 def count_tiles_better(fs,dr,pd,rann=0,specrel='daily',fibcol='COADD_FIBERSTATUS'):
     '''
-    from files with duplicates that have already been sorted by targetid, quickly go 
-    through and get the multi-tile information
+    from files with duplicates, quickly go through and get the multi-tile information
     dr is either 'dat' or 'ran'
     returns file with TARGETID,NTILE,TILES,TILELOCIDS
     '''
@@ -416,48 +415,15 @@ def count_tiles_better(fs,dr,pd,rann=0,specrel='daily',fibcol='COADD_FIBERSTATUS
     gtl = np.unique(stlid[wf])
     
     if dr == 'dat':
-        fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/'+specrel+'/datcomb_'+pd+'_tarspecwdup_Alltiles.fits')
+        fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/'+specrel+'/datcomb_'+pd+'_tarspecwdup_Alltiles.fits',columns=['TARGETID','TILEID','TILELOCID'])
         #outf = '/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/datcomb_'+pd+'ntileinfo.fits' 
     if dr == 'ran':
-        fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/'+specrel+'/rancomb_'+str(rann)+pd+'wdupspec_Alltiles.fits')
+        fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/'+specrel+'/rancomb_'+str(rann)+pd+'wdupspec_Alltiles.fits',columns=['TARGETID','TILEID','TILELOCID'])
         #outf = '/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/random'+str(rann)+'/rancomb_'+pd+'ntileinfo.fits'
     wg = np.isin(fj['TILELOCID'],gtl)  
     fjg = fj[wg]  
 
-    tids = np.unique(fjg['TARGETID'])
-    nloc = []#np.zeros(len(np.unique(f['TARGETID'])))
-    nt = []
-    tl = []
-    tli = []
-    ti = 0
-    i = 0
-    while i < len(fjg):
-        tls  = []
-        tlis = []
-        nli = 0
-    
-        while fjg[i]['TARGETID'] == tids[ti]:
-            nli += 1
-            tls.append(fjg[i]['TILEID'])
-            tlis.append(fjg[i]['TILELOCID'])
-            i += 1
-            if i == len(fjg):
-                break
-        nloc.append(nli)
-        tlsu = np.unique(tls)
-        tlisu = np.unique(tlis)
-        nt.append(len(tlsu))
-        tl.append("-".join(tlsu.astype(str)))
-        tli.append("-".join(tlisu.astype(str)))
-      
-        if ti%100000 == 0:
-            print(ti)
-        ti += 1 
-    tc = Table()
-    tc['TARGETID'] = tids
-    tc['NTILE'] = nt
-    tc['TILES'] = tl
-    tc['TILELOCIDS'] = tli
+    tc = common.count_tiles_arrays(fjg['TARGETID'],fjg['TILEID'],fjg['TILELOCID'])
     
     return tc
     
@@ -1541,11 +1507,8 @@ def mkfulldat(zf,imbits,tdir,tp,bit,outf,ftiles,azf='',azfm='cumul',desitarg='SV
 #             print('why is len(loclz[w]) > 1?') #this should never happen
 #         pd.append((loc,nz/nt))  
     loco,fzo = common.comp_tileloc(dz)
-    pd = dict(zip(loco,fzo))
-    probl = np.zeros(len(dz))
-    for i in range(0,len(dz)):
-        probl[i] = pd[dz['TILELOCID'][i]]
-    dz['FRACZ_TILELOCID'] = probl
+    #loco is sorted and contains every TILELOCID in dz
+    dz['FRACZ_TILELOCID'] = fzo[np.searchsorted(loco,dz['TILELOCID'])]
 
     #write out FRACZ_TILELOCID info
     #loco = np.array(loco).astype(dz['TILELOCID'].dtype)
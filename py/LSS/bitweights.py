@@ -111,53 +111,90 @@ def update_bitweights(realization, asgn, tileids, tg_ids, tg_ids2idx, bitweights
 
     return bitweights
 
-def pack_bitweights(array):
+def pack_bitweights(array, chunksize=2**20):
     """
     Creates an array of bitwise weights stored as 64-bit signed integers
     Input: a 2D boolean array of shape (Ngal, Nreal), where Ngal is the total number 
            of target galaxies, and Nreal is the number of fibre assignment realizations.
-    Output: returns a 2D array of 64-bit signed integers. 
+           chunksize: number of targets packed at a time, to bound the intermediate memory
+    Output: returns a 2D array of 64-bit signed integers, shape (Ngal, (Nreal+63)//64);
+            realization i is bit i%64 of column i//64.
     """
     Nbits = 64
     dtype = np.int64
     Ngal, Nreal = array.shape           # total number of realizations and number of target galaxies
     Nout = (Nreal + Nbits - 1) // Nbits # number of output columns
-    # intermediate arrays
-    bitw8 = np.zeros((Ngal, 8), dtype="i")   # array of individual bits of 8 realizations
-    bitweights = np.zeros(Ngal, dtype=dtype) # array of 64-bit integers
-    # array to store final output
+    Nbytes = (Nreal + 7) // 8           # number of bytes actually filled by the realizations
     output_array = np.zeros((Ngal, Nout), dtype=dtype)
-    idx_out = 0 # initial column in output_array
-    # loop through realizations to build bitwise weights
-    for i in range(Nreal):
-        bitw8[array[:,i], i%8] = 1
-        arr = np.array(np.packbits(bitw8[:,::-1]), dtype=dtype)
-        bitweights = np.bitwise_or(bitweights, np.left_shift(arr, 8*((i%Nbits)//8)))
-        if (i+1)%Nbits == 0 or i+1 == Nreal:
-            output_array[:,idx_out] = bitweights
-            bitweights[:] = 0
-            idx_out += 1
-        if (i+1)%8 == 0:
-            bitw8[:] = 0
+    if chunksize is None:
+        chunksize = max(Ngal, 1)
+    # intermediate array of little-endian bytes, padded to whole 64-bit words
+    buf = np.zeros((min(chunksize, Ngal), Nout*8), dtype=np.uint8)
+    for start in range(0, Ngal, chunksize):
+        stop = min(start + chunksize, Ngal)
+        chunk = buf[:stop-start]
+        # bitorder='little' puts realization i in bit i%8 of byte i//8, i.e. bit i%64 of word i//64
+        chunk[:, :Nbytes] = np.packbits(array[start:stop], axis=1, bitorder='little')
+        output_array[start:stop] = chunk.view('<i8')
     return output_array
 
-def unpack_bitweights(we):
-    Nwe= 1
+def or_bitweights(bitweights, flags, realization):
+    """
+    Adds one realization to packed bitwise weights, in place
+    Input: bitweights: 2D array of 64-bit signed integers of shape (Ngal, Nwords), as from pack_bitweights
+           flags: boolean array of shape (Ngal,), True where the target was assigned in that realization
+           realization: index of the realization (sets bit realization%64 of column realization//64)
+    Output: returns bitweights
+    """
+    bitweights[:, realization//64] |= np.left_shift(np.asarray(flags, dtype=np.int64), realization%64)
+    return bitweights
+
+def unpack_bitweights(we, Nreal=None):
+    """
+    Inverse of pack_bitweights
+    Input: array of 64-bit integer bitwise weights, shape (Ngal,) or (Ngal, Nwe)
+           Nreal: number of realizations to return; default is all 64*Nwe bits
+    Output: 2D boolean array of shape (Ngal, Nreal)
+    """
     Nbits = 64
-    Ngal = np.shape(we)[0]
-    Nreal = Nbits*Nwe
-    print('Nbits, Nwe = ',Nbits,Nwe)
-    print('Nreal = ',Nreal)
-    print('Ngal = ',Ngal)
-    true8=[np.uint8(255) for n in range(0, Ngal)]
-    array_bool = np.zeros((Ngal,Nreal), dtype=bool)
-    for j in range(Nwe):
-        lg = np.zeros((Ngal, Nbits), dtype=bool)
-        for i in range(Nbits//8):
-            chunk8 = np.uint8(np.bitwise_and(np.right_shift(we,8*i), true8))
-            lg[:,Nbits-8*(i+1):Nbits-i*8] = np.reshape(np.unpackbits(chunk8), (Ngal, 8))
-        array_bool[:,j*Nbits:(j+1)*Nbits] = lg[:,::-1]
-    return array_bool
+    we = np.asarray(we)
+    if we.ndim == 1:
+        we = we[:, None]
+    Ngal, Nwe = we.shape
+    if Nreal is None:
+        Nreal = Nbits*Nwe
+    # little-endian bytes of each word, in word order
+    bytes8 = np.ascontiguousarray(we, dtype='<i8').view(np.uint8)
+    array_bool = np.unpackbits(bytes8, axis=1, count=Nreal, bitorder='little')
+    return array_bool.view(bool)
+
+_popcount8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount_bitweights(we):
+    """
+    Number of realizations set in each row of bitwise weights
+    Input: array of 64-bit integer bitwise weights, shape (Ngal,) or (Ngal, Nwe)
+    Output: integer array of shape (Ngal,)
+    """
+    we = np.asarray(we)
+    if we.ndim == 1:
+        we = we[:, None]
+    bytes8 = np.ascontiguousarray(we, dtype='<i8').view(np.uint8)
+    return _popcount8[bytes8].sum(axis=1, dtype=np.int64)
+
+def pairwise_pip(we1, we2, Nreal=None):
+    """
+    Pairwise counts of the realizations in which both objects were assigned
+    (popcount of the bitwise AND of the two bitwise weights)
+    Input: we1, we2: arrays of 64-bit integer bitwise weights, shape (Npair,) or (Npair, Nwe)
+           Nreal: if given, return the PIP weight (Nreal+1)/(count+1) instead of the count
+           (same convention as WEIGHT_COMP in SV3.cattools)
+    Output: array of shape (Npair,)
+    """
+    counts = popcount_bitweights(np.bitwise_and(we1, we2))
+    if Nreal is None:
+        return counts
+    return (Nreal + 1.)/(counts + 1.)
 
 def write_output(outdir, outfilename, overwrite, fileformat, targets, bitvectors, desi_target_key=None):
     """
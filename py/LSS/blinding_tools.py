@@ -4,11 +4,95 @@
 import fitsio
 from astropy.table import Table
 import numpy as np
+from functools import lru_cache
+from multiprocessing import Pool
 
 from LSS.common_tools import write_LSS
 
 
 
+@lru_cache(maxsize=None)
+def _fiducial_distances():
+    #fiducial cosmo, its comoving distance and the inverse relation, built once per process
+    from cosmoprimo.fiducial import DESI
+    from cosmoprimo.utils import DistanceToRedshift
+
+    cosmo_fid = DESI()
+    dis_fid = cosmo_fid.comoving_radial_distance
+    d2z = DistanceToRedshift(dis_fid)
+    return cosmo_fid, dis_fid, d2z
+
+
+class BlindingShift(object):
+    #reusable blinding context: holds the fiducial and blinded distance-redshift relations,
+    #so that they are built once per (w0, wa, fgrowth) and applied to many catalogs
+    #use get_blinding_shift to share contexts between calls with the same parameters
+
+    def __init__(self, w0=-1, wa=0, fgrowth_fid=0.8, fgrowth_blind=0.9):
+        self.w0, self.wa = w0, wa
+        self.fgrowth_fid, self.fgrowth_blind = fgrowth_fid, fgrowth_blind
+        self._dis_blind = None
+
+    @property
+    def dis_blind(self):
+        #give distances assuming different cosmo
+        if self._dis_blind is None:
+            cosmo_fid, dis_fid, d2z = _fiducial_distances()
+            cosmo_d = cosmo_fid.clone(w0_fld=self.w0,wa_fld=self.wa)
+            self._dis_blind = cosmo_d.comoving_radial_distance
+        return self._dis_blind
+
+    def zshift_DE(self, z):
+        #redshifts blinded with (w0, wa): distances in the blinded cosmo, put back to z assuming fiducial cosmo
+        cosmo_fid, dis_fid, d2z = _fiducial_distances()
+        return d2z(self.dis_blind(np.asarray(z)))
+
+    def zshift_RSD(self, z, z_realspace):
+        #redshifts blinded with fgrowth_blind, see apply_zshift_RSD
+        cosmo_fid, dis_fid, d2z = _fiducial_distances()
+        #convert both the original and the realspace redshifts to distances using the fiducial cosmology
+        dis_original = dis_fid(np.asarray(z))
+        dis_realspace = dis_fid(np.asarray(z_realspace))
+        dis_val = dis_realspace + ( (self.fgrowth_blind / self.fgrowth_fid) * (dis_original - dis_realspace) )
+        return d2z(dis_val)
+
+    def apply_DE(self, data, out_file, zcol='Z'):
+        data['Z'] = self.zshift_DE(data[zcol])
+        return write_LSS(data,out_file,comments=None)
+
+    def apply_RSD(self, data, data_realspace, out_file, zcol='Z', comments=''):
+        data['Z'] = self.zshift_RSD(data[zcol], data_realspace[zcol])
+        return write_LSS(data,out_file,comments=comments)
+
+    def apply_RSD_files(self, in_files, realspace_files, out_files, zcol='Z', comments='', nproc=None):
+        #RSD-blind a list of catalogs (e.g. one per region) read from in_files, writing to out_files,
+        #in a pool of nproc processes (defaults to one per file) that share the distance-redshift relations;
+        #forking is not safe once MPI is initialized, so MPI jobs should pass nproc=1 to blind the files in turn
+        tasks = [(self.w0, self.wa, self.fgrowth_fid, self.fgrowth_blind, fn, fnr, out_file, zcol, comments)
+                 for fn, fnr, out_file in zip(in_files, realspace_files, out_files)]
+        if nproc is None:
+            nproc = len(tasks)
+        if nproc <= 1:
+            return [_apply_RSD_file(task) for task in tasks]
+        #build the fiducial relations before forking, so that the workers inherit them
+        _fiducial_distances()
+        with Pool(processes=nproc) as pool:
+            return pool.map(_apply_RSD_file, tasks)
+
+
+@lru_cache(maxsize=16)
+def get_blinding_shift(w0=-1, wa=0, fgrowth_fid=0.8, fgrowth_blind=0.9):
+    #shared BlindingShift for these parameters
+    return BlindingShift(w0=w0, wa=wa, fgrowth_fid=fgrowth_fid, fgrowth_blind=fgrowth_blind)
+
+
+def _apply_RSD_file(task):
+    w0, wa, fgrowth_fid, fgrowth_blind, fn, fnr, out_file, zcol, comments = task
+    data = Table(fitsio.read(fn))
+    data_realspace = Table(fitsio.read(fnr))
+    return get_blinding_shift(w0, wa, fgrowth_fid, fgrowth_blind).apply_RSD(data, data_realspace, out_file, zcol=zcol, comments=comments)
+
+
 def apply_zshift_DE(data,out_file,w0=-1,wa=0,zcol='Z'):
     #data is table of LSS catalog info
     #out_file is the full path for where to write the output
@@ -16,26 +100,8 @@ def apply_zshift_DE(data,out_file,w0=-1,wa=0,zcol='Z'):
     #wa is the change in w0 w.r.t. the scale factor
     #zcol is the column name
     #data = Table(fitsio.read(in_file))
-    from cosmoprimo.fiducial import DESI
-    from cosmoprimo.utils import DistanceToRedshift
-    from cosmoprimo import Cosmology
-
-    #fiducial cosmo
-    cosmo_fid = DESI()
-    dis_fid = cosmo_fid.comoving_radial_distance
-
-    #give distances assuming different cosmo
-    cosmo_d = cosmo_fid.clone(w0_fld=w0,wa_fld=wa)#Cosmology(h=cosmo_fid['h'],Omega_m=cosmo_fid['Omega_m'],w0_fld=w0,wa_fld=wa,engine='class')
-    dis_d = cosmo_d.comoving_radial_distance
-    dis_val = dis_d(data[zcol]) 
-    
-    #put back to z assuming fiducial cosmo
-    d2z = DistanceToRedshift(dis_fid)
-    z_shift = d2z(dis_val)
-    data['Z'] = z_shift
-    
-    #writeout
-    write_LSS(data,out_file,comments=None)
+    #the distance-redshift relations are built once and cached, see BlindingShift
+    get_blinding_shift(w0=w0, wa=wa).apply_DE(data, out_file, zcol=zcol)
 
     
 def apply_zshift_RSD(data,data_realspace,out_file,fgrowth_fid=0.8,fgrowth_blind=0.9,zcol='Z',comments=''):
@@ -45,33 +111,16 @@ def apply_zshift_RSD(data,data_realspace,out_file,fgrowth_fid=0.8,fgrowth_blind=
     #fgrowth is the redshift-dependent growth rate f(a) = dln(D)/dln(a) with growth factor D(a) and scale factor a, given the fiducial cosmology and effective redshift of the Sample
     #fgrowth_blind is the growth rate to use to shift the redshifts
     #zcol is the column name
-    from cosmoprimo.fiducial import DESI
-    from cosmoprimo.utils import DistanceToRedshift
-    from cosmoprimo import Cosmology
-    
-    #fiducial cosmo
-    cosmo_fid = DESI()
-    dis_fid = cosmo_fid.comoving_radial_distance
-    
-    #convert both the original and the realspace redshift columns to distances using the fiducial cosmology
-    dis_original = dis_fid(data[zcol])
-    dis_realspace = dis_fid(data_realspace[zcol])
-    
+    #
     #create the blinded redshift by creating the redshift-space distances corresponding to the blinded growth rate.
     # this makes use of the fact, that the displacement field along the line of sight is directly proportional to the difference between blinded and fiducial growth rates.
     # The following equation comes from eq. (3.18) of 2006.10857, combined with the fact that the term (psi*r^hat)*r^hat can be inferred from the reconstructed realspace positions,
     # for which fshift=0, meaning that dis_original-dis_realspace = fgrowth_fid*(psi*r^hat)*r^hat:
     # dis_blind = dis_original - ((fgrowth_fid-fgrowth_blind)/fgrowth_fid * (dis_original-dis_realspace))
     # further sijmplification gives:
-    dis_val = dis_realspace + ( (fgrowth_blind / fgrowth_fid) * (dis_original - dis_realspace) )
-    
-    #put back to z assuming fiducial cosmo
-    d2z = DistanceToRedshift(dis_fid)
-    z_shift = d2z(dis_val)
-    data['Z'] = z_shift
-    
-    #writeout
-    write_LSS(data,out_file,comments=comments)
+    # dis_val = dis_realspace + ( (fgrowth_blind / fgrowth_fid) * (dis_original - dis_realspace) )
+    #the distance-redshift relations are built once and cached, see BlindingShift
+    get_blinding_shift(fgrowth_fid=fgrowth_fid, fgrowth_blind=fgrowth_blind).apply_RSD(data, data_realspace, out_file, zcol=zcol, comments=comments)
 
 def swap_z(data,out_file,frac=0.01,zcols=['Z']):
     #swap some fraction of the redshifts
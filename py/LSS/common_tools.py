@@ -139,115 +139,177 @@ def select_regressis_DES(input_array,ra_col='RA',dec_col='DEC'):
     sel_des = des[pix]
     return sel_des
 
-def find_znotposs_tloc(dz,priority_thresh=10000):
-    #dz should contain the potential targets of a given type, after cutting bad fibers
-    #priority_thresh cuts repeat observations (so, e.g., 3000 work for dark time main survey)
-    tileids = np.unique(dz['TILEID'])
+def group_bounds(ks):
+    '''
+    ks is an already sorted 1D array
+    returns the index of the first row of each group of identical values and the number of rows in each group
+    '''
+    if len(ks) == 0:
+        return np.zeros(0,dtype=int),np.zeros(0,dtype=int)
+    newg = np.ones(len(ks),dtype=bool)
+    newg[1:] = ks[1:] != ks[:-1]
+    first = np.flatnonzero(newg)
+    counts = np.diff(np.append(first,len(ks)))
+    return first,counts
+
+def join_unique_by_group(keys,vals,sep='-'):
+    '''
+    for each unique key, find the unique values associated with it and join them into a string, in increasing order, separated by sep
+    this is what was done per target with np.unique + "-".join in the loops of count_tiles_better
+    returns the unique keys, the number of unique values per key and the joined strings
+    '''
+    keys = np.asarray(keys)
+    vals = np.asarray(vals)
+    sel = np.lexsort((vals,keys))
+    ks = keys[sel]
+    vs = vals[sel]
+    #remove repeated key/value pairs
+    keep = np.ones(len(ks),dtype=bool)
+    keep[1:] = (ks[1:] != ks[:-1]) | (vs[1:] != vs[:-1])
+    ks = ks[keep]
+    vs = vs[keep]
+    if len(ks) == 0:
+        return ks,np.zeros(0,dtype=int),np.zeros(0,dtype=str)
+    first,counts = group_bounds(ks)
+    #add the separator to every value that is not the last of its group, then concatenate within groups
+    last = np.zeros(len(ks),dtype=bool)
+    last[first[1:]-1] = True
+    last[-1] = True
+    #only the distinct values need to be converted to strings
+    uv,inv = np.unique(vs,return_inverse=True)
+    uvs = uv.astype(str).astype(object)
+    tokens = np.where(last,uvs[inv],(uvs+sep)[inv])
+    strs = np.add.reduceat(tokens,first).astype(str)
+    return ks[first],counts,strs
+
+def group_means(groups,vals):
+    '''
+    groups is an array of labels (e.g., the TILES column), vals is a list of arrays (e.g., true/false columns) with the same length
+    for each unique label, get the mean of each of the vals over the rows with that label
+    returns the unique labels, the list of means per label and the inverse index that maps the labels back onto the input rows
+    '''
+    ug,inv = np.unique(np.asarray(groups),return_inverse=True)
+    inv = inv.ravel()
+    nl = np.bincount(inv,minlength=len(ug))
+    means = [np.bincount(inv,weights=np.asarray(val,dtype=float),minlength=len(ug))/nl for val in vals]
+    return ug,means,inv
+
+def group_any(groups,flags):
+    '''
+    groups is an array of labels (e.g., TARGETID), flags is a true/false array with the same length
+    returns the unique labels, whether any of the flags is true for each label and the inverse index that maps the labels back onto the input rows
+    '''
+    ug,inv = np.unique(np.asarray(groups),return_inverse=True)
+    inv = inv.ravel()
+    anyf = np.bincount(inv,weights=np.asarray(flags,dtype=float),minlength=len(ug)) > 0
+    return ug,anyf,inv
+
+def count_tiles_arrays(tids,tileids,tilelocids):
+    '''
+    take arrays of TARGETID, TILEID, TILELOCID, with one entry per target/tile combination (duplicates are fine, order does not matter)
+    return table with unique TARGETID and the number of tiles it showed up on (NTILE), the TILES and the TILELOCIDS
+    '''
+    utids,nt,tl = join_unique_by_group(tids,tileids)
+    _,_,tli = join_unique_by_group(tids,tilelocids)
+    print('went through '+str(len(tids))+' rows with '+str(len(utids))+' unique targetid')
+    tc = Table()
+    tc['TARGETID'] = utids
+    tc['NTILE'] = nt
+    tc['TILES'] = tl
+    tc['TILELOCIDS'] = tli
+    return tc
+
+def _find_znotposs_tloc_sorted(dz,priority_thresh):
+    #dz is a dictionary of column arrays, sorted by TILEID, so that each tile is a contiguous slice
+    first,counts = group_bounds(dz['TILEID'])
     ual = []
     ufl = []
-    for tile in tileids:
-        sel = dz['TILEID'] == tile
-        dzs = dz[sel]
+    for i0,nr in zip(first,counts):
+        dzs = {col:dz[col][i0:i0+nr] for col in dz}
+        tile = dzs['TILEID'][0]
         sela = dzs['ZWARN'] != 999999
         sela &= dzs['ZWARN']*0 == 0
-        tlida = np.unique(dzs[sela]['TILELOCID']) #tilelocids with good assignments
-        #print(tile,len(sela),len(dzs),np.sum(sela))
-        tida = np.unique(dzs[sela]['TARGETID']) #targetids with good assignments
+        tlida = np.unique(dzs['TILELOCID'][sela]) #tilelocids with good assignments
+        tida = np.unique(dzs['TARGETID'][sela]) #targetids with good assignments
         ua = ~np.isin(dzs['TARGETID'],tida) #columns that were not assigned
-        #ua &= dzs['NUMOBS'] == 0
         ua &= dzs['PRIORITY'] > priority_thresh #columns corresponding to targets with priority indicating observations unfinished
         ua &= ~np.isin(dzs['TILELOCID'],tlida) #columns corresponding to tilelocid that were not assigned
         #combination then gives the tilelocid of unassigned targets that have not finished observation; these must have been blocked by something
-        uatlids = np.unique(dzs[ua]['TILELOCID'])
+        uatlids = np.unique(dzs['TILELOCID'][ua])
         ual.append(uatlids)
         selp = dzs['PRIORITY'] > priority_thresh
-        tlids_gp = np.unique(dzs[selp]['TILELOCID'])
+        tlids_gp = np.unique(dzs['TILELOCID'][selp])
         tlids_all = np.unique(dzs['TILELOCID'])
         tlids_full = tlids_all[~np.isin(tlids_all,tlids_gp)]
         print('done with tile '+str(tile),str(len(uatlids)),str(len(tlids_full)))
         ufl.append(tlids_full)
+    return ual,ufl
+
+def _find_znotposs_tloc_chunk(args):
+    return _find_znotposs_tloc_sorted(*args)
+
+def find_znotposs_tloc(dz,priority_thresh=10000,par='n',nproc=None):
+    #dz should contain the potential targets of a given type, after cutting bad fibers
+    #priority_thresh cuts repeat observations (so, e.g., 3000 work for dark time main survey)
+    #the rows are sorted by TILEID once and each tile is then a contiguous slice
+    #if par == 'y', chunks of tiles are processed with a pool of nproc processes
+    cols = ['TILEID','TILELOCID','TARGETID','ZWARN','PRIORITY']
+    sel = np.argsort(np.asarray(dz['TILEID']),kind='stable')
+    dzsort = {col:np.asarray(dz[col])[sel] for col in cols}
+    del sel
+    if par == 'n':
+        ual,ufl = _find_znotposs_tloc_sorted(dzsort,priority_thresh)
+    else:
+        from multiprocessing import Pool
+        if nproc is None:
+            nproc = os.cpu_count()
+        #split at tile boundaries into a few chunks per process
+        first,_ = group_bounds(dzsort['TILEID'])
+        nchunk = min(len(first),4*nproc)
+        edges = np.append(first[np.linspace(0,len(first),nchunk+1).astype(int)[:-1]],len(dzsort['TILEID']))
+        inputs = [({col:dzsort[col][edges[i]:edges[i+1]] for col in cols},priority_thresh) for i in range(0,nchunk)]
+        with Pool(processes=nproc) as pool:
+            res = pool.map(_find_znotposs_tloc_chunk,inputs)
+        ual = [uatlids for chunk in res for uatlids in chunk[0]]
+        ufl = [tlids_full for chunk in res for tlids_full in chunk[1]]
     print('concatenating')
     ualt = np.concatenate(ual)
     uflt = np.concatenate(ufl)
     return ualt,uflt
 
 
-def find_znotposs(dz,logname=None):
+def _znotposs_tileloc(dz):
+    '''
+    dz has the columns TARGETID, TILELOCID and ZWARN for a set of potential assignments, containing all of the rows for each of its TARGETID
+    returns the unique TILELOCID, whether anything was observed at each of them, whether they had a target that was never observed and the number of TARGETID never observed
+    '''
+    obs = np.asarray(dz['ZWARN']) != 999999
+    _,tidobs,tinv = group_any(dz['TARGETID'],obs)
+    noz = ~tidobs[tinv] #rows for targetids with no observation
+    utl,tlobs,tlinv = group_any(dz['TILELOCID'],obs)
+    tlnoz = np.bincount(tlinv,weights=noz,minlength=len(utl)) > 0
+    return utl,tlobs,tlnoz,np.sum(~tidobs)
 
-    dz.sort('TARGETID')
-    tidnoz = []
-    tids = np.unique(dz['TARGETID'])
-    ti = 0
-    i = 0
+def find_znotposs(dz,logname=None):
+    '''
+    dz is the table of potential assignments, with columns TARGETID, TILELOCID and ZWARN
+    returns the TILELOCID where nothing was observed but that had a target that was never observed anywhere;
+    the assignment there was not possible because of priorities
+    '''
     message = 'finding targetids that were not observed'
     if logname is None:
         print(message)
     else:
         logger = logging.getLogger(logname)
         logger.info(message)
-    while i < len(dz):
-        za = 0
-
-        while dz[i]['TARGETID'] == tids[ti]:
-            if dz[i]['ZWARN'] != 999999:
-                za = 1
-                #break
-            i += 1
-            if i == len(dz):
-                break
-        if za == 0:
-            tidnoz.append(tids[ti])
-
-        if ti%30000 == 0:
-            if logname is None:
-                print(ti)
-            else:
-                logger.info('at index '+str(ti))
-                
-        ti += 1
-
-
-    selnoz = np.isin(dz['TARGETID'],tidnoz)
-    tidsb = np.unique(dz[selnoz]['TILELOCID'])
-    #dz = dz[selnoz]
-    dz.sort('TILELOCID')
-    tids = np.unique(dz['TILELOCID'])
-    message = 'number of targetids with no obs '+str(len(tidnoz))
+    utl,tlobs,tlnoz,nnoz = _znotposs_tileloc(dz)
+    message = 'number of targetids with no obs '+str(nnoz)
     if logname is None:
         print(message)
     else:
         logger.info(message)
-    tlidnoz = []
-    lznposs = []
-
-    ti = 0
-    i = 0
-
-    while i < len(dz):
-        za = 0
-
-        while dz[i]['TILELOCID'] == tids[ti]:
-            if dz[i]['ZWARN'] != 999999:
-                za = 1
-                #break
-            i += 1
-            if i == len(dz):
-                break
-        if za == 0:
-            tlidnoz.append(tids[ti])
-            #if np.isin(tids[ti],tidsb):
-            #    lznposs.append(tids[ti])
-
-        if ti%30000 == 0:
-            if logname is None:
-                print(ti,len(tids))
-            else:
-                logger.info(str(ti)+' '+str(len(tids)))
-        ti += 1
-    #the ones to veto are now the join of the two
-    wtbtlid = np.isin(tlidnoz,tidsb)
-    tlidnoz = np.array(tlidnoz)
-    lznposs = tlidnoz[wtbtlid]
+    #the ones to veto are the locations with no observation that had targets that were never observed
+    lznposs = utl[~tlobs & tlnoz]
     message = 'number of locations where assignment was not possible because of priorities '+str(len(lznposs))
     if logname is None:
         print(message)
@@ -255,6 +317,41 @@ def find_znotposs(dz,logname=None):
         logger.info(message)
     return lznposs
 
+def find_znotposs_hp(dzl,logname=None):
+    '''
+    same as find_znotposs, but going through the potential assignments one piece at a time, so that memory stays bounded
+    dzl is a list of tables or of file names (e.g., the healpix/ files); each piece must contain all of the rows for each of its TARGETID, as is the case when split by healpix
+    '''
+    if logname is not None:
+        logger = logging.getLogger(logname)
+    utll = []
+    tlobsl = []
+    tlnozl = []
+    nnoz = 0
+    for ii,dz in enumerate(dzl):
+        if isinstance(dz,str):
+            dz = fitsio.read(dz,columns=['TARGETID','TILELOCID','ZWARN'])
+        utl,tlobs,tlnoz,nnozp = _znotposs_tileloc(dz)
+        utll.append(utl)
+        tlobsl.append(tlobs)
+        tlnozl.append(tlnoz)
+        nnoz += nnozp
+        message = 'done with piece '+str(ii)+', '+str(len(utl))+' tilelocid'
+        if logname is None:
+            print(message)
+        else:
+            logger.info(message)
+    #locations can be in several pieces, so combine the per-piece results
+    utl,tlobs,tlinv = group_any(np.concatenate(utll),np.concatenate(tlobsl))
+    tlnoz = np.bincount(tlinv,weights=np.concatenate(tlnozl),minlength=len(utl)) > 0
+    lznposs = utl[~tlobs & tlnoz]
+    message = 'number of targetids with no obs '+str(nnoz)+'; number of locations where assignment was not possible because of priorities '+str(len(lznposs))
+    if logname is None:
+        print(message)
+    else:
+        logger.info(message)
+    return lznposs
+
 def comp_tile(dz):
     compa = []
     tll = []
@@ -293,49 +390,23 @@ def comp_tileloc(dz):
 
     locl,nlocl = np.unique(dz['TILELOCID'],return_counts=True)
     wz = dz['LOCATION_ASSIGNED'] == 1
-    dzz = dz[wz]
 
-    loclz,nloclz = np.unique(dzz['TILELOCID'],return_counts=True)
+    loclz,nloclz = np.unique(np.asarray(dz['TILELOCID'])[wz],return_counts=True)
 
     print('getting fraction assigned for each tilelocid')
     #should be one (sometimes zero, though) assigned target at each tilelocid and we are now counting how many targets there are per tilelocid
     #probability of assignment is then estimated as 1/n_tilelocid
-    nm = 0
-    nmt =0
-
-    loco = []
-    fzo = []
-    nlist = 0
-    nlistg1 = 0
-    for i in range(0,len(locl)):
-        if i%10000 == 0:
-            print('at row '+str(i))
-        nt = nlocl[i]
-        loc = locl[i]
-        w = loclz == loc
-        nz = 0
-        if len(loclz[w]) == 1:
-            nz = nloclz[w][0] #these are supposed all be 1...
-        else:
-            nm += 1.
-            nmt += nt
-        if len(loclz[w]) > 1:
-            print('why is len(loclz[w]) > 1?') #this should never happen
-        loco.append(loc)
-        frac = nz/nt
-        #if type(frac) != float:
-        #    if len(frac) > 1:
-        #        nlistg1 += 1
-        #    frac = frac[0]
-        #    nlist += 1
-
-        fzo.append(frac)
-    print(str(nlist)+ ' were type list for some reason; '+str(nlistg1)+ ' had length greater than 1')
+    #loclz is a subset of locl, so the assigned counts can be placed with searchsorted
+    nz = np.zeros(len(locl),dtype=nloclz.dtype)
+    nz[np.searchsorted(locl,loclz)] = nloclz
+    fzo = nz/nlocl
+    nm = np.sum(nz == 0)
+    nmt = np.sum(nlocl[nz == 0])
     print('number of fibers with no observation, number targets on those fibers')
     print(nm,nmt)
 
 
-    return loco,fzo
+    return locl,fzo
 
 
 def mknz(fcd,fcr,fout,bs=0.01,zmin=0.01,zmax=1.6,randens=2500.,compmd='ran',wtmd='clus'):
@@ -539,6 +610,19 @@ def get_comp(fb,ran_sw=''):
     print(comp_ntl)
     return comp_ntl
 
+def nz_from_bins(zl,nzd,bs=0.01,zmin=0.01,zmax=1.6):
+    '''
+    zl is the array of redshifts
+    nzd is the array of n(z) values in bins of size bs, starting at zmin
+    returns the n(z) value of the bin each redshift falls in, 0 outside of zmin < z < zmax
+    '''
+    zl = np.asarray(zl)
+    nl = np.zeros(len(zl))
+    sel = (zl > zmin) & (zl < zmax)
+    zind = ((zl[sel]-zmin)/bs).astype(int)
+    nl[sel] = nzd[np.clip(zind,0,len(nzd)-1)]
+    return nl
+
 def addnbar(fb,nran=18,bs=0.01,zmin=0.01,zmax=1.6,P0=10000,add_data=True,ran_sw='',ranmin=0,compmd='ran',par='n',nproc=18):
     '''
     fb is the root of the file name, including the path
@@ -546,6 +630,7 @@ def addnbar(fb,nran=18,bs=0.01,zmin=0.01,zmax=1.6,P0=10000,add_data=True,ran_sw=
     bs is the bin size of the nz file (read this from file in future)
     zmin is the lower edge of the minimum bin (read this from file in future)
     zmax is the upper edge of the maximum bin (read this from file in the future)
+    only the NX, WEIGHT and WEIGHT_FKP columns (and NTILE if it had to be added) are updated in the files
     '''
 
     from desitarget.internal import sharedmem
@@ -555,13 +640,7 @@ def addnbar(fb,nran=18,bs=0.01,zmin=0.01,zmax=1.6,P0=10000,add_data=True,ran_sw=
     #fd = Table(ff['LSS'].read())
     #fd = fitsio.read(fn) #reading in data with fitsio because it is much faster to loop through than table
     fd = Table(fitsio.read(fn))
-    zl = fd['Z']
-    nl = np.zeros(len(zl))
-    for ii in range(0,len(zl)):
-        z = zl[ii]
-        zind = int((z-zmin)/bs)
-        if z > zmin and z < zmax:
-            nl[ii] = nzd[zind]
+    nl = nz_from_bins(fd['Z'],nzd,bs=bs,zmin=zmin,zmax=zmax)
     mean_comp = len(fd)/np.sum(fd['WEIGHT_COMP'])
     print('mean completeness '+str(mean_comp))
     nont = 0
@@ -606,7 +685,10 @@ def addnbar(fb,nran=18,bs=0.01,zmin=0.01,zmax=1.6,P0=10000,add_data=True,ran_sw=
     #ft['WEIGHT_FKP'] = 1./(1+ft['NZ']*P0)
     if add_data:
         fd['WEIGHT_FKP'] = fkpl
-        write_LSS(fd,fn)
+        outcols = ['NX','WEIGHT','WEIGHT_FKP']
+        if nont == 1:
+            outcols.append('NTILE')
+        write_LSS_cols(fn,fd,outcols)
     #fd = np.array(fd)
     #ff['LSS'].insert_column('WEIGHT_FKP',fkpl)
     #ff['LSS'].write(fd)
@@ -618,15 +700,14 @@ def addnbar(fb,nran=18,bs=0.01,zmin=0.01,zmax=1.6,P0=10000,add_data=True,ran_sw=
         fn = fb+'_'+str(rann)+'_clustering.ran.fits'
         #ff = fitsio.FITS(fn,'rw')
         #fd = ff['LSS'].read()
-        fd = Table(fitsio.read(fn.replace('global','dvs_ro') ))
-        #fd = fitsio.read(fn) #reading in data with fitsio because it is much faster to loop through than table
-        zl = fd['Z']
-        nl = np.zeros(len(zl))
-        for ii in range(0,len(zl)):
-            z = zl[ii]
-            zind = int((z-zmin)/bs)
-            if z > zmin and z < zmax:
-                nl[ii] = nzd[zind]
+        #only the columns needed to get NX and the weights are read; the rest of the file is left untouched
+        incols = ['Z','WEIGHT','WEIGHT_COMP','WEIGHT_SYS','WEIGHT_ZFAIL']
+        if nont == 0:
+            incols.append('NTILE')
+        if compmd == 'ran':
+            incols.append('FRAC_TLOBS_TILES')
+        fd = Table(fitsio.read(fn.replace('global','dvs_ro'),columns=incols))
+        nl = nz_from_bins(fd['Z'],nzd,bs=bs,zmin=zmin,zmax=zmax)
         #del fd
         #ft = Table.read(fn)
         #ft['NZ'] = nl
@@ -650,7 +731,10 @@ def addnbar(fb,nran=18,bs=0.01,zmin=0.01,zmax=1.6,P0=10000,add_data=True,ran_sw=
         #fkpl = comp_ntl[fd['NTILE']-1]/(1+nl*P0*comp_ntl[fd['NTILE']-1])
         fkpl = 1/(1+fd['NX']*P0)
         fd['WEIGHT_FKP'] = fkpl
-        write_LSS(fd,fn)
+        outcols = ['NX','WEIGHT','WEIGHT_FKP']
+        if nont == 1:
+            outcols.append('NTILE')
+        write_LSS_cols(fn,fd,outcols)
         #ff['LSS'].insert_column('WEIGHT_FKP',fkpl)
         #fd = np.array(fd)
         #ff['LSS'].write(fd)
@@ -826,58 +910,48 @@ def add_map_cols(fn,rann,new_cols=['HALPHA', 'HALPHA_ERROR', 'CALIB_G', 'CALIB_R
     new_fn = '/global/cfs/cdirs/desi/survey/catalogs/external_input_maps/mapvalues/randoms-1-'+str(rann)+'-skymapvalues.fits'
     mask_fn = '/global/cfs/cdirs/desi/survey/catalogs/external_input_maps/maskvalues/randoms-1-'+str(rann)+'-skymapmask.fits'
    
-    df = Table(fitsio.read(fn))
-    
+    with fitsio.FITS(fn) as f:
+        cols_in = f['LSS'].get_colnames()
+    tids = fitsio.read(fn,columns=['TARGETID'])['TARGETID']
+    newvals = {}
+
     col = 'SKYMAP_MASK'
     domask = True
-    if np.isin(col,list(df.dtype.names)):
+    if col in cols_in:
         print(col+' already in '+fn)
         if redo:
-            df.remove_columns([col])
             print('will replace '+col) 
         else:
             print('not replacing '+col)
             domask = False
     if domask:
-        mask = fitsio.read(mask_fn)
-        df = join(df,mask,keys=['TARGETID'])
+        mask = fitsio.read(mask_fn,columns=['TARGETID',col])
+        newvals[col] = mask[col][match_targetid(tids,mask['TARGETID'])]
         del mask
         
-    cols2read_new = ['TARGETID']
-    for col in new_cols:
-        if np.isin(col,list(df.dtype.names)):
-            print(col+' already in '+fn)
-            if redo:
-                df.remove_columns([col])
-                print('will replace '+col)
-                cols2read_new.append(col)
-            else:
-                print('not replacing '+col)
-        else:
-            cols2read_new.append(col)
-
-    rannew = fitsio.read(new_fn,columns=cols2read_new)
-    df = join(df,rannew,keys=['TARGETID'])
-    del rannew
-    cols2read_fid = ['TARGETID']
-    for col in fid_cols:
-        if np.isin(col,list(df.dtype.names)):
-            print(col+' already in '+fn)
-            if redo:
-                df.remove_columns([col])
-                print('will replace '+col)
-                cols2read_fid.append(col)
+    for new_fn_col,cols2add in zip([new_fn,fid_fn],[new_cols,fid_cols]):
+        cols2read = ['TARGETID']
+        for col in cols2add:
+            if col in cols_in:
+                print(col+' already in '+fn)
+                if redo:
+                    print('will replace '+col)
+                    cols2read.append(col)
+                else:
+                    print('not replacing '+col)
             else:
-                print('not replacing '+col)
-        else:
-            cols2read_fid.append(col)
-
-    ranfid = fitsio.read(fid_fn,columns=cols2read_fid)
-    df = join(df,ranfid,keys=['TARGETID'])
+                cols2read.append(col)
+        if len(cols2read) > 1:
+            ranmap = fitsio.read(new_fn_col,columns=cols2read)
+            ind = match_targetid(tids,ranmap['TARGETID'])
+            for col in cols2read[1:]:
+                newvals[col] = ranmap[col][ind]
+            del ranmap
 
-    print(len(df))
-    comments = ['Adding map columns']
-    write_LSS(df,fn,comments)
+    print(len(tids))
+    if len(newvals) > 0:
+        comments = ['Adding map columns']
+        write_LSS_cols(fn,newvals,list(newvals.keys()),comments)
 
 
 def add_veto_col(fn,ran=False,tracer_mask='lrg',rann=0,tarver='targetsDR9v1.1.1',redo=False):
@@ -885,34 +959,28 @@ def add_veto_col(fn,ran=False,tracer_mask='lrg',rann=0,tarver='targetsDR9v1.1.1'
     if ran:
         mask_fn = '/dvs_ro/cfs/cdirs/desi/survey/catalogs/main/LSS/randoms-1-'+str(rann)+tracer_mask+'imask.fits'
     maskf = fitsio.read(mask_fn)
-    df = fitsio.read(fn.replace('global','dvs_ro'))
-    if np.isin(tracer_mask+'_mask',list(df.dtype.names)):
+    col = tracer_mask+'_mask'
+    with fitsio.FITS(fn.replace('global','dvs_ro')) as f:
+        cols_in = f['LSS'].get_colnames()
+    if col in cols_in:
         print('mask column already in '+fn)
         if redo:
-            df = Table(df)
-            df.remove_columns([tracer_mask+'_mask'])
             print('will replace '+tracer_mask)
         else:
             return True
     else:
         print('adding '+tracer_mask)
-    print(len(df))
-    sel = np.isin(maskf['TARGETID'],df['TARGETID'])
+    tids = fitsio.read(fn.replace('global','dvs_ro'),columns=['TARGETID'])['TARGETID']
+    print(len(tids))
+    sel = np.isin(maskf['TARGETID'],tids)
     maskf = maskf[sel]
     print(len(maskf))
-    maskf = Table(maskf)
-    maskf.sort('TARGETID')
-    df = Table(df)
-    df.sort('TARGETID')
-    if np.array_equal(df['TARGETID'],maskf['TARGETID']):
-        df[tracer_mask+'_mask'] = maskf[tracer_mask+'_mask']
-    else:
+    if len(maskf) != len(tids):
         return('TARGETIDs do not match! exiting')
-    #df = join(df,maskf,keys=['TARGETID'])
-    print(len(df),'should match above')
+    ind = match_targetid(tids,maskf['TARGETID'])
+    print(len(ind),'should match above')
     #comments = ['Adding imaging mask column']
-    write_LSS(df,fn)#,comments)
-    del df
+    write_LSS_cols(fn,{col:maskf[col][ind]},[col])#,comments)
 
 def parse_circandrec_mask(custom_mask_fn):
     '''
@@ -1045,67 +1113,19 @@ def apply_veto(fin,fout=None,ebits=None,zmask=False,maxp=3400,comp_only=False,re
     if '.dat' in fin:
         ff['Z'].name = 'Z_not4clus'
         print('updating completeness')
-        compa = []
-        fractl = []
-        tll = []
-        ti = 0
         ff.sort('TILES')
-        nts = len(np.unique(ff['TILES']))
-        tlsl = ff['TILES']
-        tlslu = np.unique(tlsl)
-        laa = ff['LOCATION_ASSIGNED']
-        lta = ff['TILELOCID_ASSIGNED']
         print('TILELOCID_ASSIGNED',np.unique(ff['TILELOCID_ASSIGNED'],return_counts=True),len(ff))
-
-        # for tls in np.unique(dz['TILES']): #this is really slow now, need to figure out a better way
-        i = 0
-        tot = 0
-        atot = 0
-        tltot = 0
-        while i < len(ff):
-            tls = []
-            tlis = []
-            nli = 0 #initialize total available per tile group
-            nai = 0 #initialize total assigned
-            nti = 0 #initialize total at location where something of the same type was assigned
-
-            while tlsl[i] == tlslu[ti]:
-                nli += 1
-                nai += laa[i] #laa is true/false assigned
-                nti += lta[i] #lta is true/false something of the same type was assigned
-                i += 1
-                if i == len(ff):
-                    break
-
-            if ti % 10000 == 0:
-                print('at tiles ' + str(ti) + ' of ' + str(nts))
-
-            tot += nli
-            atot += nai
-            tltot += nti
-            cp = nai / nli #
-            fract = nti/nli
-            # print(tls,cp,no,nt)
-            compa.append(cp)
-            fractl.append(fract)
-            tll.append(tlslu[ti])
-            ti += 1
-        #print(tot,atot,tltot)
-        comp_dicta = dict(zip(tll, compa))
-        fract_dicta = dict(zip(tll, fractl))
+        #LOCATION_ASSIGNED is true/false assigned, TILELOCID_ASSIGNED is true/false something of the same type was assigned
+        tll,(compa,fractl),inv = group_means(ff['TILES'],[ff['LOCATION_ASSIGNED'],ff['TILELOCID_ASSIGNED']])
+        print('completeness measured for '+str(len(tll))+' tile groups')
         tlobs_fn = fout.replace('full'+mapveto+'.dat.fits','frac_tlobs.fits')
         tlobs = Table()
         tlobs['TILES'] = tll
         tlobs['FRAC_TLOBS_TILES'] = fractl
         write_LSS(tlobs,tlobs_fn)
         del tlobs
-        fcompa = []
-        fracta = []
-        for tl in ff['TILES']:
-            fcompa.append(comp_dicta[tl])
-            fracta.append(fract_dicta[tl])
-        ff['COMP_TILE'] = np.array(fcompa)
-        ff['FRAC_TLOBS_TILES'] = np.array(fracta)
+        ff['COMP_TILE'] = compa[inv]
+        ff['FRAC_TLOBS_TILES'] = fractl[inv]
         print('data quantities measured, moving to write-out phase')
         #print(np.sum(ff['FRAC_TLOBS_TILES']),len(ff))
         #if comp_only:
@@ -1215,54 +1235,8 @@ def get_tlcomp(fin):
     '''
     ff = Table(fitsio.read(fin))#+'full_noveto.'+dr+'.fits')
     print('getting completeness')
-    compa = []
-    fractl = []
-    tll = []
-    ti = 0
-    ff.sort('TILES')
-    nts = len(np.unique(ff['TILES']))
-    tlsl = ff['TILES']
-    tlslu = np.unique(tlsl)
-    laa = ff['LOCATION_ASSIGNED']
-    lta = ff['TILELOCID_ASSIGNED']
     print('TILELOCID_ASSIGNED',np.unique(ff['TILELOCID_ASSIGNED'],return_counts=True),len(ff))
-
-    # for tls in np.unique(dz['TILES']): #this is really slow now, need to figure out a better way
-    i = 0
-    tot = 0
-    atot = 0
-    tltot = 0
-    while i < len(ff):
-        tls = []
-        tlis = []
-        nli = 0 #initialize total available per tile group
-        nai = 0 #initialize total assigned
-        nti = 0 #initialize total at location where something of the same type was assigned
-
-        while tlsl[i] == tlslu[ti]:
-            nli += 1
-            nai += laa[i] #laa is true/false assigned
-            nti += lta[i] #lta is true/false something of the same type was assigned
-            i += 1
-            if i == len(ff):
-                break
-
-        if ti % 10000 == 0:
-            print('at tiles ' + str(ti) + ' of ' + str(nts))
-
-        tot += nli
-        atot += nai
-        tltot += nti
-        cp = nai / nli #
-        fract = nti/nli
-        # print(tls,cp,no,nt)
-        compa.append(cp)
-        fractl.append(fract)
-        tll.append(tlslu[ti])
-        ti += 1
-    #print(tot,atot,tltot)
-    comp_dicta = dict(zip(tll, compa))
-    fract_dicta = dict(zip(tll, fractl))
+    tll,(fractl,),_ = group_means(ff['TILES'],[ff['TILELOCID_ASSIGNED']])
     tlobs_fn = fin.replace('full.dat.fits','frac_tlobs.fits')
     tlobs = Table()
     tlobs['TILES'] = tll
@@ -1345,6 +1319,78 @@ def write_LSS_scratchcp(ff, outf, comments=None,extname='LSS'):
         os.system('rm '+tmpfn)
     return True
 
+def write_LSS_cols(fn,ff,cols,comments=None,extname='LSS',atomic=True):
+    '''
+    fn is the full path to an existing LSS catalog
+    ff is the structured array/Table/dictionary with the new values, with the same rows as the catalog
+    cols is the list of columns to update
+    comments is a list of comments to include in the header
+    columns that exist in the catalog are overwritten (with their type in the file) and missing ones are added;
+    the other columns are never read into memory
+    if atomic, the catalog is copied to a temporary file that is updated, checked and then moved in place, like in write_LSS,
+    so fn is never seen half-written; if the check fails, fn is left as it was and 'FAILED' is returned
+    if not atomic, the file is updated in place
+    '''
+    import shutil
+    nrows = len(ff[cols[0]])
+    with fitsio.FITS(fn) as fd:
+        if fd[extname].get_nrows() != nrows:
+            raise ValueError('number of rows in '+fn+' does not match the input')
+        names = fd[extname].get_colnames()
+        dt = fd[extname].get_rec_dtype()[0]
+    upcols = [col for col in cols if col in names]
+    newcols = [col for col in cols if col not in names]
+    outfn = fn
+    if atomic:
+        outfn = fn+'.tmp'
+        shutil.copyfile(fn,outfn)
+    with fitsio.FITS(outfn,'rw') as fd:
+        if len(upcols) > 0:
+            fd[extname].write([np.asarray(ff[col]).astype(dt[col]) for col in upcols],names=upcols)
+        for col in newcols:
+            fd[extname].insert_column(col,np.asarray(ff[col]))
+        if comments is not None:
+            for comment in comments:
+                fd[extname].write_comment(comment)
+    print('updated columns '+str(cols)+' in '+outfn)
+    if atomic:
+        try:
+            fitsio.read(outfn,columns=(cols[0]))
+        except:
+            print('read failed, output corrupted?! '+fn+' was not changed')
+            os.remove(outfn)
+            return 'FAILED'
+        os.replace(outfn,fn)
+        print('moved output to ' + fn)
+    return True
+
+def match_targetid(tids,tids_ref):
+    '''
+    tids is an array of TARGETID, tids_ref is an array of unique TARGETID (e.g., of a table with values to add to the first)
+    returns the index in tids_ref of each entry of tids; raises ValueError if some of them are not in tids_ref
+    '''
+    tids = np.asarray(tids)
+    tids_ref = np.asarray(tids_ref)
+    if len(tids_ref) == 0:
+        if len(tids) > 0:
+            raise ValueError('some TARGETID are not in the reference array')
+        return np.zeros(0,dtype=int)
+    sel = np.argsort(tids_ref)
+    ind = np.clip(np.searchsorted(tids_ref,tids,sorter=sel),0,len(sel)-1)
+    ind = sel[ind]
+    if not np.array_equal(tids_ref[ind],tids):
+        raise ValueError('some TARGETID are not in the reference array')
+    return ind
+
+def write_LSS_cols_bytid(fn,ff,cols,comments=None,extname='LSS'):
+    '''
+    same as write_LSS_cols, but the rows of ff (which must have a TARGETID column) are matched to those of the catalog by TARGETID,
+    so ff can, e.g., be the full_noveto version of the catalog
+    '''
+    tids = fitsio.read(fn,ext=extname,columns=['TARGETID'])['TARGETID']
+    ind = match_targetid(tids,ff['TARGETID'])
+    return write_LSS_cols(fn,{col:np.asarray(ff[col])[ind] for col in cols},cols,comments=comments,extname=extname)
+
 
 def create_sky_targets(dirname, columns=None, format_output='fits', release='1.1.1', version='main', program='dark', dr='dr9', nfiles=10, mpicomm=None):
     """
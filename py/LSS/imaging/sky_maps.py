@@ -13,6 +13,7 @@ import numpy as np
 from time import time
 import healpy as hp
 from glob import glob
+from functools import lru_cache
 
 from astropy.coordinates import SkyCoord
 from astropy import units as u
@@ -425,7 +426,92 @@ def ls_bitmask_one_brick(brickname, ra, dec, photsys, tracer, mxdir=None):
     return mx
 
 
-def ls_bitmask_for_randoms(randoms, ident, lssmapdir=None, survey="main"):
+@lru_cache(maxsize=None)
+def ls_to_skymap_bit_table(tracer):
+    """Look-up tables to transpose a Legacy Surveys tracer bitmask to skymap_mask.
+
+    Parameters
+    ----------
+    tracer : :class:`str`
+        The name of a tracer that has masks in the brickmasks directory.
+        Options are "ELG" and "LRG".
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Array of shape (nbytes, 256) of "i8". Row `i` maps each possible
+        value of byte `i` of the `tracer` bitmask to the corresponding
+        skymap_mask bits, so that the transposed bitmask is the bitwise
+        OR of the look-ups for each byte (see :func:`transpose_ls_bitmask()`).
+    """
+    tracer = tracer.lower()
+    # ADM the name of the relevant column/bitmask.
+    mxname = "{}_mask".format(tracer)
+    # ADM the bitmask itself.
+    mx = globals()[mxname]
+
+    # ADM pair each bit in the LS bitmask with a bit in the skymap bitmask.
+    bits, sbits = [], []
+    for nom in mx.names():
+        altnom = "{}_{}".format(tracer.upper(), nom)
+        # ADM the mask name will be the same in LS and skymap...
+        if nom in skymap_mask.names():
+            snom = nom
+        # ADM ...or it will be preceeded by the tracer name...
+        elif altnom in skymap_mask.names():
+            snom = altnom
+        # ADM ...or something went wrong when naming masks.
+        else:
+            msg = "Can't transpose {} in {} to {} or {} in {}".format(
+                nom, mxname, nom, altnom, "skymap_mask")
+            log.critical(msg)
+            raise ValueError(msg)
+        log.info("Transposing {} to {}".format(nom, snom))
+        bits.append(int(mx[nom]).bit_length() - 1)
+        sbits.append(int(skymap_mask[snom]))
+
+    # ADM build one 256-entry look-up table per byte of the LS bitmask.
+    nbytes = max(bits) // 8 + 1
+    values = np.arange(256)
+    luts = np.zeros((nbytes, 256), dtype='i8')
+    for bit, sbit in zip(bits, sbits):
+        luts[bit // 8][(values >> (bit % 8)) & 1 == 1] |= sbit
+    luts.setflags(write=False)
+
+    return luts
+
+
+def transpose_ls_bitmask(lsmx, tracer):
+    """Transpose a Legacy Surveys tracer bitmask to the skymap_mask representation.
+
+    Parameters
+    ----------
+    lsmx : :class:`~numpy.ndarray`
+        Values of the `tracer` bitmask (i.e. the elg_mask or lrg_mask
+        column of a pre-constructed bitmask catalog).
+    tracer : :class:`str`
+        The name of a tracer that has masks in the brickmasks directory.
+        Options are "ELG" and "LRG".
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        The corresponding skymap_mask bits, as "i8". Bits of `lsmx` that
+        are not defined in the `tracer` bitmask are ignored.
+    """
+    luts = ls_to_skymap_bit_table(tracer)
+    lsmx = np.asarray(lsmx).astype('i8')
+    # ADM I use "i8" here because (as of the time of writing) fitsio
+    # ADM does not support I/O for "u8" (uint64).
+    trans = luts[0][lsmx & 255]
+    for i in range(1, len(luts)):
+        trans |= luts[i][(lsmx >> (8*i)) & 255]
+
+    return trans
+
+
+def ls_bitmask_for_randoms(randoms, ident, lssmapdir=None, survey="main",
+                           numproc=1):
     """Assign Legacy-Surveys-based tracer bitmask information to randoms.
 
     Parameters
@@ -443,6 +529,9 @@ def ls_bitmask_for_randoms(randoms, ident, lssmapdir=None, survey="main"):
         Used to look up the LSS directory.
     survey : :class:`str`, optional, defaults to "main"
         A survey phase. Either upper-case or lower-case can be passed.
+    numproc : :class:`int`, optional, defaults to 1
+        Number of processes over which to parallelize, one random
+        catalog (IDENT) per process.
 
     Returns
     -------
@@ -464,9 +553,15 @@ def ls_bitmask_for_randoms(randoms, ident, lssmapdir=None, survey="main"):
     # ADM of writing) fitsio does not support I/O for "u8" (uint64).
     done = np.zeros(len(randoms), dtype="i8")
 
-    # ADM need to process once per different ident/random catalog.
-    sidents = sorted(list(set(ident["IDENT"])))
-    for sident in sidents:
+    # ADM need to process once per different ident/random catalog, so
+    # ADM group the rows of the randoms by ident.
+    sidents, inv, cnt = np.unique(ident["IDENT"], return_inverse=True,
+                                  return_counts=True)
+    identrows = np.split(np.argsort(inv.ravel(), kind="stable"), np.cumsum(cnt)[:-1])
+
+    def _bitmask_one_ident(k):
+        """Transposed bitmasks for the randoms of one random catalog."""
+        sident = sidents[k]
         log.info("Working on random catalog {}...t={:.1f}s".format(
             sident, time()-start))
         # ADM loop through each tracer and populate a bitmask transposed
@@ -475,6 +570,8 @@ def ls_bitmask_for_randoms(randoms, ident, lssmapdir=None, survey="main"):
             # ADM the file that contains the Legacy Surveys info.
             fn = "randoms-{}{}imask.fits".format(sident, tracer)
             fn = os.path.join(lss_dir, fn)
+            # ADM the name of the relevant column/bitmask.
+            mxname = "{}_mask".format(tracer)
             lsmx = fitsio.read(fn)
             # ADM first-time-through, set up an array to hold the bitmask
             # ADM transposed from the LS to skymap representation.
@@ -489,38 +586,46 @@ def ls_bitmask_for_randoms(randoms, ident, lssmapdir=None, survey="main"):
                            " consistently on TARGETID".format(fn))
                     log.critical(msg)
                     raise ValueError(msg)
-            # ADM the name of the relevant column/bitmask.
-            mxname = "{}_mask".format(tracer)
             log.info("Transposing bits from {} to skymap_mask..t={:.1f}s".format(
                 mxname, time()-start))
-            # ADM the bitmask itself.
-            mx = globals()[mxname]
-            # ADM loop through the relevant bitmask names and transpose
-            # ADM from the LS bitmask to skymap bitmask representation.
-            for nom in mx.names():
-                altnom = "{}_{}".format(tracer.upper(), nom)
-                # ADM the mask name will be the same in LS and skymap...
-                if nom in skymap_mask.names():
-                    snom = nom
-                # ADM ...or it will be preceeded by the tracer name...
-                elif altnom in skymap_mask.names():
-                    snom = altnom
-                # ADM ...or something went wrong when naming masks.
-                else:
-                    msg = "Can't transpose {} in {} to {} or {} in {}".format(
-                        nom, mxname, nom, altnom, "skymap_mask")
-                    log.critical(msg)
-                    raise ValueError(msg)
-                log.info("Transposing {} to {}".format(nom, snom))
-                # ADM find instances of bit in the Legacy Surveys mask.
-                is_bit_set = lsmx[mxname] & mx[nom] != 0
-                # ADM set instances of this bit using the skymap mask.
-                # ADM I cast as 'i8', here, because (as of the time of
-                # ADM writing) fitsio does not support I/O for "u8".
-                trans |= np.array(is_bit_set * skymap_mask[snom], dtype='i8')
-        # ADM now match on TARGETID and assign mask bits.
-        rii, tii = match(randoms["TARGETID"], targetids)
-        done[rii] = trans[tii]
+            # ADM transpose all of the bits at once via a look-up table.
+            trans |= transpose_ls_bitmask(lsmx[mxname], tracer)
+
+        # ADM now match the randoms of this catalog on TARGETID using a
+        # ADM sorted join (the bitmask catalogs are usually pre-sorted, and
+        # ADM searching for sorted TARGETIDs is far more cache-friendly).
+        rii = identrows[k]
+        if len(targetids) == 0:
+            return rii[:0], trans
+        if not np.all(targetids[1:] > targetids[:-1]):
+            sorter = np.argsort(targetids, kind="stable")
+            targetids, trans = targetids[sorter], trans[sorter]
+            if np.any(targetids[1:] == targetids[:-1]):
+                msg = "Duplicate TARGETIDs in {}".format(fn)
+                log.critical(msg)
+                raise ValueError(msg)
+        tids = randoms["TARGETID"][rii]
+        rsorter = np.argsort(tids, kind="stable")
+        rii, tids = rii[rsorter], tids[rsorter]
+        tii = np.searchsorted(targetids, tids)
+        tii[tii == len(targetids)] = 0
+        ismatch = targetids[tii] == tids
+
+        return rii[ismatch], trans[tii[ismatch]]
+
+    def _assign_bits(rii, bits):
+        """Assign the transposed bitmasks to the output array."""
+        done[rii] = bits
+
+    # - Parallel process the random catalogs.
+    if numproc > 1:
+        pool = sharedmem.MapReduce(np=numproc)
+        with pool:
+            _ = pool.map(_bitmask_one_ident, np.arange(len(sidents)),
+                         reduce=_assign_bits)
+    else:
+        for k in range(len(sidents)):
+            _assign_bits(*_bitmask_one_ident(k))
 
     return done
 
@@ -959,15 +1064,18 @@ def read_sky_map(mapname, lssmapdir=None):
     # ADM construct the filename for, and read, the relevant map.
     fn = os.path.join(lssmapdir, pixmap["SUBDIR"], pixmap["FILENAME"])
 
-    # MMM obtain nside for the relevant map.
-    nsidemap = pixmap['NSIDE']
+    return _read_map_file(fn, pixmap["COLNAME"], pixmap["MAPTYPE"],
+                          pixmap["NSIDE"], pixmap["NESTED"])
+
 
+def _read_map_file(fn, colname, maptype, nsidemap, nested):
+    """Read the map data for one `maparray` entry (see :func:`read_sky_map()`)."""
     # ADM try a few generic ways to read all types of maps.
     # ADM some maps are 1-D and have no column names.
-    if pixmap["COLNAME"] == "NONE-IMAGE":
+    if colname == "NONE-IMAGE":
         mapdata = fitsio.read(fn)
     # ADM some maps are ALM maps.
-    elif pixmap["MAPTYPE"] == "ALMMAP":
+    elif maptype == "ALMMAP":
         # MMM WARNING - Hardwired values of ellmin, ellmax
         ellmin = 3
         ellmax = 2048
@@ -977,11 +1085,11 @@ def read_sky_map(mapname, lssmapdir=None):
 
     # ADM these are the MAPTYPE cases of either PIXMAP or PIXMASK.
     else:
-        mapdata = fitsio.read(fn, 1, columns=pixmap["COLNAME"])
+        mapdata = fitsio.read(fn, 1, columns=colname)
         # ADM if we're dealing with a 2-D map, use hp.read_map.
         if len(mapdata.shape) > 1:
             colnames = fitsio.read(fn, rows=0).dtype.names
-            w = np.where([pixmap["COLNAME"] in i for i in colnames])
+            w = np.where([colname in i for i in colnames])
             # MMM test what passes through this piece of code
             # mapdata = hp.read_map(fn, field=w[0][0])
             # print("HELLO2", len(mapdata), pixmap["NSIDE"])
@@ -990,10 +1098,23 @@ def read_sky_map(mapname, lssmapdir=None):
             # ADM guard against a common incorrect-column-name error.
             if len(w) == 0:
                 msg = "is the specified column name ({}) wrong for (2-D) map {}?"
-                log.critical(msg.format(pixmap["COLNAME"], mapname))
-                raise ValueError(msg.format(pixmap["COLNAME"], mapname))
+                log.critical(msg.format(colname, fn))
+                raise ValueError(msg.format(colname, fn))
             else:
-                mapdata = hp.read_map(fn, field=w[0][0], nest=pixmap["NESTED"])
+                mapdata = hp.read_map(fn, field=w[0][0], nest=nested)
+
+    return mapdata
+
+
+@lru_cache(maxsize=8)
+def _read_map_file_cached(fn, colname, maptype, nsidemap, nested):
+    """LRU-cached, read-only, version of :func:`_read_map_file()`.
+
+    Maps are cached by file and column, so ALM maps are only synthesized
+    once per process, however many random catalogs are sampled.
+    """
+    mapdata = _read_map_file(fn, colname, maptype, nsidemap, nested)
+    mapdata.setflags(write=False)
 
     return mapdata
 
@@ -1240,7 +1361,8 @@ def aux_test_mask():
 
 
 def create_pixweight_file(randomcatlist, fieldslist, masklist, nside_out=512,
-                          lssmapdir=None, outfn=None, write=True, reg=None):
+                          lssmapdir=None, outfn=None, write=True, reg=None,
+                          numproc=1, chunksize=None):
     """
     Creates a pixweight file from randoms filtered by bitmasks.
 
@@ -1268,12 +1390,26 @@ def create_pixweight_file(randomcatlist, fieldslist, masklist, nside_out=512,
     reg : :class:`str`, optional, defaults to ``None``
         If 'N' or 'S' are chosen and PHOTSYS is in the randoms, the
         randoms are cut to PHOTSYS==reg
+    numproc : :class:`int`, optional, defaults to 1
+        Number of processes over which to parallelize, one random
+        catalog per process.
+    chunksize : :class:`int`, optional, defaults to ``None``
+        If passed, read each random catalog (and associated files) in
+        chunks of `chunksize` rows, to bound the memory used. If ``None``
+        then each random catalog is read in one go.
 
     Returns
     -------
     :class:`~numpy.ndarray`
         Pixweight array of the requested masked fields. This is also
         written to file if `write`=``True``.
+
+    Notes
+    -----
+    - The per-pixel counts and weighted sums for each random catalog are
+      computed independently (in parallel if `numproc` > 1) and then
+      added to the output in the order of `randomcatlist`, so the output
+      is identical whatever the values of `numproc` and `chunksize`.
     """
     # MMM formally grab $LSS_MAP_DIR in case lssmapdir=None was passed.
     lssmapdir = get_lss_map_dir(lssmapdir=lssmapdir)
@@ -1346,6 +1482,7 @@ def create_pixweight_file(randomcatlist, fieldslist, masklist, nside_out=512,
         skymapvaluescat = rancat_name_to_map_name(randomcat, lssmapdir=lssmapdir)
         skymapmaskcat = rancat_name_to_mask_name(randomcat, lssmapdir=lssmapdir)
 
+        randomswithallfields = False
         skyfield = fitsio.read(skymapvaluescat, rows=[0])
 
     # MMM check if there are no foreign or misspelled items in fieldlist.
@@ -1374,90 +1511,133 @@ def create_pixweight_file(randomcatlist, fieldslist, masklist, nside_out=512,
     # ADM useful to cast lists as arrays to facilitate boolean indexing.
     fieldsarray, bitmaskarray = np.array(fieldslist), np.array(bitmasklist)
 
-    # MMM loop over sets of files.
-    for randomcat in randomcatlist:
+    # MMM for region selection all fields must be in the randoms.
+    if reg is not None and skyfcol:
+        print('for region selection, all fields must be in the randoms, code exiting!!!')
+        print('fields that were loaded with randoms are '+str(stdfield.dtype.names))
+        return 'ERROR'
+
+    # ADM the fields/bitmasks that are read from each file, and whether
+    # ADM all bitmasks are the same, so the mask need only be set once.
+    fieldcols = [fieldsarray[np.array([fld in col for fld in fieldslist])]
+                 for col in [stdfcol, skyfcol]]
+    need2setmask = bitmasklist.count(bitmasklist[0]) != len(bitmasklist)
+
+    def _counts_one_file(ifile):
+        """Per-pixel counts and weighted sums for each field for one random
+        catalog, reading `chunksize` rows at a time if `chunksize` is set."""
+        randomcat = randomcatlist[ifile]
 
         # MMM log file we are reading.
         log.info("Reading in random catalog {} and associated files...t = {:.1f}s"
                  .format(randomcat, time()-start))
 
-        # MMM names of the sky-map field and mask values, if needed
-        skymapvaluescat = rancat_name_to_map_name(randomcat, lssmapdir=lssmapdir)
-        skymapmaskcat = rancat_name_to_mask_name(randomcat, lssmapdir=lssmapdir)
-
-        # MMM read RA DEC and SKYMAP_MASK for each random.
-        # ADM read ALL needed columns from randomcat here as a speed-up.
-        ranvalues, ranhdr = fitsio.read(randomcat, columns=stdfcol+['RA', 'DEC'],
-                                        header=True)
-
-        # MMM read field values; only if need be.
-        if skyfcol:
-            skymapvalues = fitsio.read(skymapvaluescat, columns=skyfcol)
-        else:
-            skymapvalues = []
-
-        regsel = np.ones(len(ranvalues),dtype='bool')
-        if reg is not None:
-            if skymapvalues != []:
-                print('for region selection, all fields must be in the randoms, code exiting!!!')
-                print('fields that were loaded with randoms are '+str(ranvalues.dtype.names))
-                return 'ERROR'
-            regcol = fitsio.read(randomcat,columns=['PHOTSYS'])
-            regsel = regcol['PHOTSYS'] == reg
-            oldlength = len(ranvalues)
-            ranvalues = ranvalues[regsel]
-            print('cut randoms to selected region, kept '+str(len(ranvalues))+' out of '+str(oldlength)) 
-        if not randomswithallfields:
-            skymapmask = fitsio.read(skymapmaskcat, columns=maskcol)
-        else:
-            skymapmask = np.zeros(len(ranvalues), dtype=[('SKYMAP_MASK', 'i8')])
-            skymapmask["SKYMAP_MASK"] = fitsio.read(randomcat,
-                                                    columns=['SKYMAP_MASK'])[regsel]
-
         # ADM check all random catalogs were generated at same density.
         # MMM I can only do this if not reading from user made randoms
         # MMM Also don't check targetids match (they should by construction).
         if not randomswithallfields:
+            ranhdr = fitsio.read_header(randomcat, 1)
             if ranhdr["DENSITY"] != chxhdr["DENSITY"]:
                 raise_myerror("Random catalogs {} and {} made at different densities"
                               .format(randomcat, randomcatlist[0]))
 
-        # MMM find nested HEALPixel in the passed nside for each random.
-        theta, phi = np.radians(90-ranvalues['DEC']), np.radians(ranvalues['RA'])
-        randpixnums = hp.ang2pix(nside_out, theta, phi, nest=True)
-
-        # MMM if all bitmasks are same, no need to set mask every time.
-        # MMM mask-in (i.e., list selected) randoms.
-        need2setmask = True
-        if bitmasklist.count(bitmasklist[0]) == len(bitmasklist):
-            bitmask = bitmasklist[0]
-            need2setmask = False
-            maskin = (skymapmask['SKYMAP_MASK'] & bitmask) == 0
-            # uniq, ii, cnt = np.unique(randpixnums[maskin], return_inverse=True,
-            #                          return_counts=True)
-
-        ############################
-        # MMM ----- read all fields at once ----
-        log.info("Determining counts for {}...t = {:.1f}s".format(
-            randomcat, time()-start))
-        for col, values in zip([stdfcol, skyfcol], [ranvalues, skymapvalues]):
-            if len(col) > 0:
-                # ADM limit to just the fields/bitmasks corresponding to col.
-                jj = np.array([fld in col for fld in fieldslist])
-                for field, bitmask in zip(fieldsarray[jj], bitmaskarray[jj]):
+        # MMM names of the sky-map field and mask values, if needed
+        skymapvaluescat = rancat_name_to_map_name(randomcat, lssmapdir=lssmapdir)
+        skymapmaskcat = rancat_name_to_mask_name(randomcat, lssmapdir=lssmapdir)
+
+        nrows = fitsio.read_header(randomcat, 1)["NAXIS2"]
+        step = nrows if chunksize is None else int(chunksize)
+        # ADM with chunks, accumulate dense per-pixel sums in the order of
+        # ADM the rows, which gives exactly the same (float64) sums as a
+        # ADM single np.bincount over the whole file.
+        if step < nrows:
+            dcnt = {field: np.zeros(npix, dtype='i8') for field in fieldslist}
+            dwcnt = {field: np.zeros(npix, dtype='f8') for field in fieldslist}
+        partial = {}
+
+        for rowmin in range(0, max(nrows, 1), max(step, 1)):
+            rowmax = min(rowmin + step, nrows)
+            # MMM read RA DEC and SKYMAP_MASK for each random.
+            # ADM read ALL needed columns from randomcat here as a speed-up.
+            with fitsio.FITS(randomcat) as fx:
+                ranvalues = fx[1][stdfcol+['RA', 'DEC']][rowmin:rowmax]
+                if reg is not None:
+                    regsel = fx[1]['PHOTSYS'][rowmin:rowmax] == reg
+                    ranvalues = ranvalues[regsel]
+                if randomswithallfields:
+                    skymapmask = np.zeros(len(ranvalues), dtype=[('SKYMAP_MASK', 'i8')])
+                    skymapmask["SKYMAP_MASK"] = fx[1]['SKYMAP_MASK'][rowmin:rowmax][regsel] \
+                        if reg is not None else fx[1]['SKYMAP_MASK'][rowmin:rowmax]
+
+            # MMM read field values; only if need be.
+            skymapvalues = []
+            if skyfcol:
+                with fitsio.FITS(skymapvaluescat) as fx:
+                    skymapvalues = fx[1][skyfcol][rowmin:rowmax]
+            if not randomswithallfields:
+                with fitsio.FITS(skymapmaskcat) as fx:
+                    skymapmask = fx[1][maskcol][rowmin:rowmax]
+                if reg is not None:
+                    skymapmask = skymapmask[regsel]
+
+            # MMM find nested HEALPixel in the passed nside for each random.
+            theta, phi = np.radians(90-ranvalues['DEC']), np.radians(ranvalues['RA'])
+            randpixnums = hp.ang2pix(nside_out, theta, phi, nest=True)
+
+            # MMM if all bitmasks are same, no need to set mask every time.
+            # MMM mask-in (i.e., list selected) randoms.
+            if not need2setmask:
+                maskin = (skymapmask['SKYMAP_MASK'] & bitmasklist[0]) == 0
+
+            # MMM ----- read all fields at once ----
+            log.info("Determining counts for {} rows {}-{}...t = {:.1f}s".format(
+                randomcat, rowmin, rowmax, time()-start))
+            for fields, values in zip(fieldcols, [ranvalues, skymapvalues]):
+                for field in fields:
+                    bitmask = bitmaskarray[fieldsarray == field][0]
                     if need2setmask:
                         maskin = (skymapmask['SKYMAP_MASK'] & bitmask) == 0
-                    #    uniq, ii, cnt = np.unique(
-                    #        randpixnums[maskin], return_inverse=True,
-                    #        return_counts=True)
                     masknan = values[field]*0 == 0
                     maskhpun = values[field] != hp.UNSEEN
-                    uniq, ii, cnt = np.unique(
-                        randpixnums[maskin & masknan & maskhpun],
-                        return_inverse=True, return_counts=True)
-                    wcnt = np.bincount(ii, values[field][maskin & masknan & maskhpun])
-                    counts[field][uniq] += cnt
-                    wcounts[field][uniq] += wcnt
+                    ii = maskin & masknan & maskhpun
+                    if step < nrows:
+                        dcnt[field] += np.bincount(randpixnums[ii], minlength=npix)
+                        np.add.at(dwcnt[field], randpixnums[ii], values[field][ii])
+                    else:
+                        uniq, jj, cnt = np.unique(
+                            randpixnums[ii], return_inverse=True, return_counts=True)
+                        partial[field] = uniq, cnt, np.bincount(jj, values[field][ii])
+
+        if step < nrows:
+            for field in fieldslist:
+                uniq = np.flatnonzero(dcnt[field])
+                partial[field] = uniq, dcnt[field][uniq], dwcnt[field][uniq]
+
+        return ifile, partial
+
+    # ADM add the partial counts into the output arrays strictly in the
+    # ADM order of randomcatlist, as the (float32) sums depend on order.
+    pending = {}
+    nextfile = np.zeros((), dtype='i8')
+
+    def _reduce(ifile, partial):
+        """Reduce the partial counts for each random catalog, in order."""
+        pending[ifile] = partial
+        while int(nextfile) in pending:
+            for field, (uniq, cnt, wcnt) in pending.pop(int(nextfile)).items():
+                counts[field][uniq] += cnt
+                wcounts[field][uniq] += wcnt
+            nextfile[...] += 1
+        return ifile
+
+    # - Parallel process input files.
+    if numproc > 1:
+        pool = sharedmem.MapReduce(np=numproc)
+        with pool:
+            _ = pool.map(_counts_one_file, np.arange(len(randomcatlist)), reduce=_reduce)
+    else:
+        for ifile in range(len(randomcatlist)):
+            _reduce(*_counts_one_file(ifile))
 
     ##########################
     # MMM compute weighted means.
@@ -1525,10 +1705,6 @@ def generate_map_values(rancatname, lssmapdir=None, outdir=None, write=True):
     # ADM read the random catalog.
     randoms, hdr, ident = read_randoms(rancatname)
 
-    # ADM store the Galactic coordinates for the randoms.
-    c = SkyCoord(randoms["RA"]*u.degree, randoms["DEC"]*u.degree)
-    lgal, bgal = c.galactic.l.value, c.galactic.b.value
-
     # ADM grab the output filename.
     outfn = rancat_name_to_map_name(rancatname, lssmapdir=outdir)
 
@@ -1536,40 +1712,18 @@ def generate_map_values(rancatname, lssmapdir=None, outdir=None, write=True):
     maps = maparray[(maparray["MAPTYPE"] == "PIXMAP") |
                     (maparray["MAPTYPE"] == "ALMMAP")]
 
-    # ADM set up an initial output array. We'll modify the dtypes later.
-    dt = [('TARGETID', '>i8')]
-    dt += [(mapname, '>f4') for mapname in maps["MAPNAME"]]
+    # ADM sample all of the maps in one pass. The sampler only computes
+    # ADM the Galactic coordinates of the randoms once, and their pixel
+    # ADM numbers once per (nside, nested, Galactic) map scheme.
+    sampler = MapSampler(randoms, lssmapdir=lssmapdir)
+    values = sampler.sample_maps(list(maps["MAPNAME"]))
+
+    # ADM set up the output array, using the dtypes of the maps.
+    dt = [('TARGETID', '>i8')] + values.dtype.descr
     done = np.zeros(len(randoms), dtype=dt)
     done["TARGETID"] = randoms["TARGETID"]
-
-    # ADM loop through the maps to find the values.
-    for pixmap in maps:
-        mapname = pixmap["MAPNAME"]
-        log.info("Working on map {}...t={:.1f}s".format(mapname, time()-start))
-
-        mapdata = read_sky_map(mapname, lssmapdir=lssmapdir)
-
-        # ADM the coordinates to use for this map.
-        c1, c2 = randoms["RA"], randoms["DEC"]
-        if pixmap["GALACTIC"]:
-            log.info("Using Galactic coordinates for {} map".format(mapname))
-            c1, c2 = lgal, bgal
-
-        # MMM obtain nside for the relevant map.
-        nsidemap = pixmap['NSIDE']
-
-        # ADM determine the map values for each of the randoms in the
-        # ADM map scheme (i.e. nested or ring).
-        theta, phi = np.radians(90-c2), np.radians(c1)
-        pixnums = hp.ang2pix(nsidemap, theta, phi, nest=pixmap["NESTED"])
-
-        # ADM alter the dtype of the output for this map, if needed.
-        if done[mapname].dtype != mapdata.dtype:
-            dtmod = [(nom, dtyp) if nom != mapname else (nom, mapdata.dtype.str)
-                     for nom, dtyp in dt]
-            done = done.astype(dtmod)
-        # ADM add the map values for the randoms.
-        done[mapname] = mapdata[pixnums]
+    for mapname in values.dtype.names:
+        done[mapname] = values[mapname]
 
     # ADM now we've looped over all maps, write the final array to file.
     if write:
@@ -1607,7 +1761,135 @@ def get_map_from_alms(alms, ellmin, ellmax, nside_in=512, nside_out=512):
     return ptest
 
 
-def sample_map(mapname, randoms, lssmapdir=None, nside=512):
+class MapSampler(object):
+    """Sample sky maps at the locations of a random catalog.
+
+    The Galactic coordinates of the randoms are computed once, their
+    HEALPixel numbers are computed once per (nside, nested, Galactic)
+    scheme, and the maps themselves are read through an LRU cache.
+
+    >>> sampler = MapSampler(randoms)
+    >>> values = sampler.sample_maps(["HALPHA", "EBV_SGF14"])
+    >>> means = sampler.sample_map("HALPHA", nside=512)
+
+    Parameters
+    ----------
+    randoms : :class:`~numpy.ndarray`
+        Random catalog, as made by, e.g. :func:`read_randoms()`. Only the
+        "RA" and "DEC" columns are used.
+    lssmapdir : :class:`str`, optional, defaults to $LSS_MAP_DIR
+        Location of the directory that hosts all of the sky maps. If
+       `lssmapdir` is ``None`` (or not passed), $LSS_MAP_DIR is used.
+    """
+    def __init__(self, randoms, lssmapdir=None):
+        # ADM formally grab $LSS_MAP_DIR in case lssmapdir=None was passed.
+        self.lssmapdir = get_lss_map_dir(lssmapdir=lssmapdir)
+        self.ra, self.dec = randoms["RA"], randoms["DEC"]
+        self._galactic = None
+        self._pixnums = {}
+
+    def coordinates(self, galactic=False):
+        """(RA, Dec) or, if `galactic` is ``True``, (l, b) of the randoms."""
+        if not galactic:
+            return self.ra, self.dec
+        if self._galactic is None:
+            c = SkyCoord(self.ra*u.degree, self.dec*u.degree)
+            self._galactic = c.galactic.l.value, c.galactic.b.value
+        return self._galactic
+
+    def pixnums(self, nside, nest=True, galactic=False):
+        """HEALPixel number of each of the randoms in the passed scheme."""
+        key = (int(nside), bool(nest), bool(galactic))
+        if key not in self._pixnums:
+            c1, c2 = self.coordinates(galactic=galactic)
+            theta, phi = np.radians(90-c2), np.radians(c1)
+            self._pixnums[key] = hp.ang2pix(key[0], theta, phi, nest=key[1])
+        return self._pixnums[key]
+
+    def get_pixmap(self, mapname):
+        """The (single) entry in the `maparray` global array for `mapname`."""
+        # ADM limit to just the map we are working with.
+        pixmap = maparray[maparray["MAPNAME"] == mapname]
+
+        if len(pixmap) != 1:
+            # ADM check somebody didn't include two maps with the same name.
+            if len(pixmap) > 1:
+                msg = "There are TWO maps in maparray that have MAPNAME={}!"
+            # ADM check there's an entry in maparray for the passed map name.
+            elif len(pixmap) < 1:
+                msg = "There are NO maps in maparray that have MAPNAME={}!"
+            log.critical(msg.format(mapname))
+            raise ValueError(msg.format(mapname))
+
+        # ADM now we know for sure we have a 1-D map, we can enforce that.
+        return pixmap[0]
+
+    def read_map(self, mapname):
+        """The (read-only) data for the map `mapname`."""
+        pixmap = self.get_pixmap(mapname)
+        fn = os.path.join(self.lssmapdir, pixmap["SUBDIR"], pixmap["FILENAME"])
+        return _read_map_file_cached(fn, pixmap["COLNAME"], pixmap["MAPTYPE"],
+                                     int(pixmap["NSIDE"]), bool(pixmap["NESTED"]))
+
+    def sample(self, mapname):
+        """The value of the map `mapname` for each of the randoms."""
+        pixmap = self.get_pixmap(mapname)
+        if pixmap["GALACTIC"]:
+            log.info("Using Galactic coordinates for {} map".format(mapname))
+        mapdata = self.read_map(mapname)
+        pixnums = self.pixnums(pixmap["NSIDE"], nest=pixmap["NESTED"],
+                               galactic=pixmap["GALACTIC"])
+        return mapdata[pixnums]
+
+    def sample_maps(self, mapnames):
+        """The values of each of the maps in `mapnames` for the randoms.
+
+        Returns a structured array with one column per map, each with the
+        dtype of the corresponding map.
+        """
+        # ADM group the maps by scheme, so the pixel numbers for a scheme
+        # ADM can be dropped as soon as all of its maps are sampled.
+        schemes = [self.get_pixmap(mapname)[["NSIDE", "NESTED", "GALACTIC"]].tolist()
+                   for mapname in mapnames]
+        values = {}
+        for scheme in sorted(set(schemes)):
+            for mapname in [m for m, sch in zip(mapnames, schemes) if sch == scheme]:
+                log.info("Working on map {}...t={:.1f}s".format(mapname, time()-start))
+                values[mapname] = self.sample(mapname)
+            self._pixnums.pop((int(scheme[0]), bool(scheme[1]), bool(scheme[2])), None)
+
+        done = np.zeros(len(self.ra), dtype=[(mapname, values[mapname].dtype.str)
+                                             for mapname in mapnames])
+        for mapname in mapnames:
+            done[mapname] = values[mapname]
+
+        return done
+
+    def sample_map(self, mapname, nside=512):
+        """The mean of the map `mapname` over the randoms in each NESTED
+        HEALPixel at the passed `nside`, as for :func:`sample_map()`.
+        """
+        mapdata = self.read_map(mapname)
+        randmapvals = self.sample(mapname)
+
+        # ADM find the nested HEALPixel in the passed nside for each random.
+        randpixnums = self.pixnums(nside, nest=True, galactic=False)
+
+        # ADM determine the mean in each HEALPixel, weighted by the randoms.
+        uniq, ii, cnt = np.unique(randpixnums, return_inverse=1, return_counts=1)
+        randmeans = np.bincount(ii, randmapvals)/cnt
+
+        # ADM set up the output array.
+        npix = hp.nside2npix(nside)
+        done = np.zeros(npix, dtype=[(mapname.upper(), mapdata.dtype.type)])
+        # ADM The method to find the means will skip any missing pixels, so
+        # ADM populate on uniq indices to retain the missing pixels as zeros.
+        done[uniq] = randmeans
+
+        return done
+
+
+def sample_map(mapname, randoms, lssmapdir=None, nside=512, sampler=None):
     """Sample a systematics map.
 
     Parameters
@@ -1621,6 +1903,11 @@ def sample_map(mapname, randoms, lssmapdir=None, nside=512):
        `lssmapdir` is ``None`` (or not passed), $LSS_MAP_DIR is used.
     nside : :class:`int`, optional, defaults to nside=512
         Resolution (HEALPix nside) at which to build the (NESTED) map.
+    sampler : :class:`MapSampler`, optional, defaults to ``None``
+        A :class:`MapSampler` made from `randoms`. Pass the same sampler
+        to sample several maps for one random catalog, so the pixel
+        numbers of the randoms are only computed once. If ``None``, a new
+        sampler is made (the maps themselves are cached regardless).
 
     Returns
     -------
@@ -1629,71 +1916,10 @@ def sample_map(mapname, randoms, lssmapdir=None, nside=512):
         HEALPixel map at the given nside. The name of the column in the
         output array is `mapname` in upper-case letters.
     """
-    # ADM limit to just the map we are working with.
-    pixmap = maparray[maparray["MAPNAME"] == mapname]
-
-    if len(pixmap) != 1:
-        # ADM check somebody didn't include two maps with the same name.
-        if len(pixmap) > 1:
-            msg = "There are TWO maps in maparray that have MAPNAME={}!"
-        # ADM check there's an entry in maparray for the passed map name.
-        elif len(pixmap) < 1:
-            msg = "There are NO maps in maparray that have MAPNAME={}!"
-        log.critical(msg.format(mapname))
-        raise ValueError(msg.format(mapname))
-
-    # ADM now we know for sure we have a 1-D map, we can enforce that.
-    pixmap = pixmap[0]
-
-    # ADM construct the filename for, and read, the relevant map.
-    lssmapdir = get_lss_map_dir(lssmapdir=lssmapdir)
-    fn = os.path.join(lssmapdir, pixmap["SUBDIR"], pixmap["FILENAME"])
-    mapdata = fitsio.read(fn, columns=pixmap["COLNAME"])
-
-    # MMM obtain nside directly (as opposed of using hp.npix2nside(len(mapdata))
-    nsidemap = pixmap['NSIDE']
-
-    # MMM obtain map through which to pass the randoms
-    # MMM WARNING - Hardwired values of ellmin, ellmax
-    if (pixmap['MAPTYPE'] == 'ALMMAP'):
-        ellmin = 3
-        ellmax = 2048
-        lssmapdir = get_lss_map_dir(lssmapdir)
-        fn = os.path.join(lssmapdir, pixmap["SUBDIR"], pixmap["FILENAME"])
-        alms = hp.read_alm(fn)
-        mapdata = get_map_from_alms(alms, ellmin, ellmax,
-                                    nside_out=nsidemap, nside_in=nsidemap)
-
-    # ADM if needed, convert the randoms to Galactic coordinates.
-    c1, c2 = randoms["RA"], randoms["DEC"]
-    if pixmap["GALACTIC"]:
-        log.info("Using Galactic coordinates for {} map".format(mapname))
-        c = SkyCoord(c1*u.degree, c2*u.degree)
-        c1, c2 = c.galactic.l.value, c.galactic.b.value
-
-    # ADM determine the map values for each of the randoms in the
-    # ADM map scheme (i.e. nested or ring).
-    theta, phi = np.radians(90-c2), np.radians(c1)
-    pixnums = hp.ang2pix(nsidemap, theta, phi, nest=pixmap["NESTED"])
-    randmapvals = mapdata[pixnums]
-
-    # ADM find the nested HEALPixel in the passed nside for each random.
-    theta, phi = np.radians(90-randoms["DEC"]), np.radians(randoms["RA"])
-    randpixnums = hp.ang2pix(nside, theta, phi, nest=True)
-
-    # ADM determine the mean in each HEALPixel, weighted by the randoms.
-    uniq, ii, cnt = np.unique(randpixnums, return_inverse=1, return_counts=1)
-    randmeans = np.bincount(ii, randmapvals)/cnt
+    if sampler is None:
+        sampler = MapSampler(randoms, lssmapdir=lssmapdir)
 
-    # ADM set up the output array.
-    dt = [(mapname.upper(), mapdata.dtype.type)]
-    npix = hp.nside2npix(nside)
-    done = np.zeros(npix, dtype=[(mapname.upper(), mapdata.dtype.type)])
-    # ADM The method to find the means will skip any missing pixels, so
-    # ADM populate on uniq indices to retain the missing pixels as zeros.
-    done[uniq] = randmeans
-
-    return done
+    return sampler.sample_map(mapname, nside=nside)
 
 
 def pure_healpix_map_filename(outdir, nsideproc, hpxproc):
@@ -4,7 +4,9 @@ python functions to do various useful date processing/manipulation
 import numpy as np
 import glob
 import os
+import json
 from random import random
+from contextlib import closing
 
 import astropy.io.fits as fits
 from astropy.table import Table,join,unique,vstack,setdiff
@@ -30,13 +32,212 @@ logger.setLevel(level=logging.INFO)
 
 
 
-def combtile_qso(tiles,outf='',restart=False,release='guadalupe'):
+#per-tile partitioned store for the combined daily files (e.g., datcomb_dark_spec_zdone.fits)
+#instead of rewriting the whole file each time tiles are added, each new tile is written once as its own fragment in
+#outf+'.tiles/' and a json manifest lists the fragments, along with the "base" file holding the tiles combined before
+#(by default outf itself); read_tile_store gives the concatenation and compact_tile_store writes it back to outf
+
+def tile_store_dir(outf):
+    return outf+'.tiles/'
+
+def _tile_manifest_name(outf):
+    return tile_store_dir(outf)+'manifest.json'
+
+def _tile_fragment_name(outf,tile):
+    return tile_store_dir(outf)+'tile-'+str(tile)+'.fits'
+
+def _match_dtype(tspec,dtype):
+    #column order got mixed up, so copy the columns by name
+    new = np.empty(len(tspec),dtype=dtype)
+    for colname in dtype.names:
+        new[colname][...] = tspec[colname][...]
+    return new
+
+def _new_tile_manifest(base=None,base_columns=None):
+    base_tiles = []
+    base_nrows = 0
+    if base is not None:
+        base_tiles = [int(tile) for tile in np.unique(fitsio.read(base,columns=['TILEID'])['TILEID'])]
+        base_nrows = fitsio.read_header(base,ext=1)['NAXIS2']
+    return {'base':base,'base_columns':base_columns,'base_tiles':base_tiles,'base_nrows':base_nrows,'fragments':[]}
+
+def _write_tile_manifest(outf,manifest):
+    fn = _tile_manifest_name(outf)
+    tmpfn = fn+'.tmp'
+    with open(tmpfn,'w') as f:
+        json.dump(manifest,f,indent=1)
+    os.replace(tmpfn,fn)
+
+def read_tile_manifest(outf):
+    '''
+    returns the manifest of the per-tile store of outf, i.e. a dictionary with the base file (None if there is none),
+    the columns to keep from it (None for all), its TILEID and number of rows and the list of fragments, each with TILEID, FILE and NROWS
+    if there is no store yet, the manifest describes outf alone (without being written out)
+    '''
+    fn = _tile_manifest_name(outf)
+    if not os.path.isfile(fn):
+        return _new_tile_manifest(outf if os.path.isfile(outf) else None)
+    with open(fn) as f:
+        manifest = json.load(f)
+    base = manifest['base']
+    if base is not None and fitsio.read_header(base,ext=1)['NAXIS2'] != manifest['base_nrows']:
+        #base was rewritten by a compaction that did not get to update the manifest; drop the fragments it already contains
+        logger.info(base+' has changed since the manifest of '+outf+' was written, recovering')
+        fragments = manifest['fragments']
+        manifest = _new_tile_manifest(base,manifest['base_columns'])
+        manifest['fragments'] = [frag for frag in fragments if frag['TILEID'] not in manifest['base_tiles']]
+        _write_tile_manifest(outf,manifest)
+    return manifest
+
+def init_tile_store(outf,base=None,base_columns=None,reset=False,empty=False):
+    '''
+    create the per-tile store of outf and return its manifest (if it already exists and reset is False, just return the manifest)
+    base is the file with the tiles that were combined before; by default outf, if it exists, unless empty is True
+    base_columns is the list of columns to keep from base (None for all)
+    only the TILEID column of base is read
+    '''
+    if os.path.isfile(_tile_manifest_name(outf)) and not reset:
+        return read_tile_manifest(outf)
+    if base is None and os.path.isfile(outf) and not empty:
+        base = outf
+    os.makedirs(tile_store_dir(outf),exist_ok=True)
+    oldfiles = glob.glob(tile_store_dir(outf)+'tile-*.fits')
+    manifest = _new_tile_manifest(base,base_columns)
+    _write_tile_manifest(outf,manifest)
+    #only remove the old fragments once they are out of the manifest
+    for fn in oldfiles:
+        os.remove(fn)
+    return manifest
+
+def tile_store_tileids(outf,manifest=None):
+    '''
+    TILEID of all of the tiles in the store of outf, without reading any data
+    '''
+    if manifest is None:
+        manifest = read_tile_manifest(outf)
+    return np.array(manifest['base_tiles']+[frag['TILEID'] for frag in manifest['fragments']],dtype=int)
+
+def tile_store_dtype(outf,manifest=None):
+    '''
+    dtype of the concatenation of the store of outf (None if it is empty); only one row is read
+    '''
+    if manifest is None:
+        manifest = read_tile_manifest(outf)
+    if manifest['base'] is not None and manifest['base_nrows'] > 0:
+        return fitsio.read(manifest['base'],columns=manifest['base_columns'],rows=[0]).dtype
+    for frag in manifest['fragments']:
+        if frag['NROWS'] > 0:
+            return fitsio.read(tile_store_dir(outf)+frag['FILE'],rows=[0]).dtype
+    return None
+
+def add_tile_fragment(outf,tile,tspec,manifest=None):
+    '''
+    write the rows tspec of tile as a new fragment of the store of outf and add it to the manifest, which is returned
+    rows are converted to the dtype of the store if they do not match it
+    the fragment is in place before the manifest is updated, so an interrupted update never leaves a partial tile in the store
+    a tile without any row is only recorded in the manifest (with NROWS 0 and no file), as fitsio cannot read an empty table back
+    '''
+    if manifest is None:
+        manifest = init_tile_store(outf)
+    elif not os.path.isfile(_tile_manifest_name(outf)):
+        os.makedirs(tile_store_dir(outf),exist_ok=True)
+    tspec = np.array(tspec)
+    dtype = tile_store_dtype(outf,manifest)
+    if dtype is not None and tspec.dtype != dtype:
+        tspec = _match_dtype(tspec,dtype)
+    fn = _tile_fragment_name(outf,tile)
+    if len(tspec) > 0:
+        tmpfn = fn+'.tmp'
+        fitsio.write(tmpfn,tspec,extname='LSS',clobber=True)
+        os.replace(tmpfn,fn)
+    manifest['fragments'] = [frag for frag in manifest['fragments'] if frag['TILEID'] != int(tile)]
+    manifest['fragments'].append({'TILEID':int(tile),'FILE':os.path.basename(fn) if len(tspec) > 0 else None,'NROWS':len(tspec)})
+    _write_tile_manifest(outf,manifest)
+    if len(tspec) == 0 and os.path.isfile(fn):
+        #an earlier, non-empty, version of the tile
+        os.remove(fn)
+    return manifest
+
+def iter_tile_store(outf,columns=None,tiles=None,manifest=None):
+    '''
+    generator over the parts (base, then fragments in the order they were added) of the store of outf
+    only the columns (None for all) and the tiles (list of TILEID, None for all) that are asked for are read
+    '''
+    if manifest is None:
+        manifest = read_tile_manifest(outf)
+    base = manifest['base']
+    if base is not None and manifest['base_nrows'] > 0 and (tiles is None or np.isin(manifest['base_tiles'],tiles).any()):
+        cols = columns
+        if manifest['base_columns'] is not None:
+            cols = manifest['base_columns'] if columns is None else [col for col in columns if col in manifest['base_columns']]
+        if tiles is None:
+            yield fitsio.read(base,columns=cols)
+        else:
+            sel = np.isin(fitsio.read(base,columns=['TILEID'])['TILEID'],tiles)
+            yield fitsio.read(base,columns=cols,rows=np.where(sel)[0])
+    for frag in manifest['fragments']:
+        if frag['NROWS'] > 0 and (tiles is None or frag['TILEID'] in tiles):
+            yield fitsio.read(tile_store_dir(outf)+frag['FILE'],columns=columns)
+
+def read_tile_store(outf,columns=None,tiles=None,sort=None):
+    '''
+    concatenation of the base file and of the fragments of the store of outf, i.e., what outf would contain if it had been rewritten at each update
+    columns and tiles restrict what is read, as in iter_tile_store
+    sort is an optional column to (stably) sort the rows by
+    '''
+    manifest = read_tile_manifest(outf)
+    dtype = tile_store_dtype(outf,manifest)
+    if dtype is None:
+        return None
+    if columns is not None:
+        dtype = np.dtype([(col,dtype[col]) for col in dtype.names if col in columns])
+    tl = [part if part.dtype == dtype else _match_dtype(part,dtype) for part in iter_tile_store(outf,columns=columns,tiles=tiles,manifest=manifest)]
+    if len(tl) == 0:
+        return np.empty(0,dtype=dtype)
+    specd = np.hstack(tl)
+    del tl
+    if sort is not None:
+        specd = specd[np.argsort(specd[sort],kind='stable')]
+    return specd
+
+def compact_tile_store(outf,sort=None):
+    '''
+    rewrite outf with the full concatenation of its store (sorted by the column sort, if not None) and remove the fragments
+    afterwards, outf is the base of the (empty) store and can be read directly as before
+    '''
+    import LSS.common_tools as common
+    manifest = read_tile_manifest(outf)
+    if len(manifest['fragments']) == 0 and manifest['base'] == outf and manifest['base_columns'] is None and sort is None:
+        print('no fragments to compact into '+outf)
+        return True
+    specd = read_tile_store(outf,sort=sort)
+    if specd is None:
+        print('nothing in the store of '+outf)
+        return False
+    if common.write_LSS(specd,outf) == 'FAILED':
+        return False
+    print('compacted '+str(len(manifest['fragments']))+' fragments into '+outf)
+    init_tile_store(outf,base=outf,reset=True)
+    return True
+
+
+def combtile_qso(tiles,outf='',restart=False,release='guadalupe',partitioned='n'):
+    #if partitioned == 'y', new tiles are added as fragments of the per-tile store of outf instead of rewriting outf (see read_tile_store)
     s = 0
     n = 0
     nfail = 0
     kl = ['TARGET_RA','TARGET_DEC','DESI_TARGET','TARGETID', 'Z', 'LOCATION',  'TSNR2_LYA', 'TSNR2_QSO', 'DELTA_CHI2_MGII', 'A_MGII', 'SIGMA_MGII', 'B_MGII', 'VAR_A_MGII', 'VAR_SIGMA_MGII', 'VAR_B_MGII', 'Z_RR', 'Z_QN', 'C_LYA', 'C_CIV', 'C_CIII', 'C_MgII', 'C_Hbeta', 'C_Halpha', 'Z_LYA', 'Z_CIV', 'Z_CIII', 'Z_MgII', 'Z_Hbeta', 'Z_Halpha', 'QSO_MASKBITS', 'TILEID']
     #
-    if os.path.isfile(outf) and restart == False:
+    if partitioned == 'y':
+        if restart or not (os.path.isfile(outf) or os.path.isfile(_tile_manifest_name(outf))):
+            infl = '/global/cfs/cdirs/desi/survey/catalogs/main/LSS/daily/QSO_catalog_'+release+'.fits'
+            manifest = init_tile_store(outf,base=infl,base_columns=kl,reset=True)
+        else:
+            manifest = init_tile_store(outf)
+        specd = np.empty(0,dtype=tile_store_dtype(outf,manifest))
+        s = 1
+        tmask = ~np.isin(tiles['TILEID'],tile_store_tileids(outf,manifest))
+    elif os.path.isfile(outf) and restart == False:
         #specd = Table.read(outf)
         specd = fitsio.read(outf)
 
@@ -81,6 +282,11 @@ def combtile_qso(tiles,outf='',restart=False,release='guadalupe'):
                 for colname in cols:
                     new[colname][...] = tspec[colname][...]
 
+                if partitioned == 'y':
+                    manifest = add_tile_fragment(outf,tile,new[new['TARGETID'] > 0],manifest)
+                    n += 1
+                    print(tile,n,len(tiles[tmask]))
+                    continue
                 #specd = np.hstack((specd,tspec))
                 specd = np.hstack((specd,new))
             #specd.sort('TARGETID')
@@ -93,6 +299,8 @@ def combtile_qso(tiles,outf='',restart=False,release='guadalupe'):
             print(str(tile)+' failed')
             nfail += 1
     print('total number of failures was '+str(nfail))
+    if partitioned == 'y':
+        return n > 0
     if n > 0:
         #specd.write(outf,format='fits', overwrite=True)
         fitsio.write(outf,specd,clobber=True)
@@ -145,12 +353,55 @@ def combtile_qso_alt(tiles,outf='',coaddir=''):
 
 
 
-def combtile_spec(tiles,outf='',md='',specver='daily',redo='n',specrel='guadalupe',prog='dark',par='n'):
+def _map_in_windows(func,tasks,nproc=None):
+    #same as map(func,tasks), with the tasks run by a pool of nproc processes (None for the number of CPUs)
+    #only nproc tasks are submitted ahead of the one whose result is returned, so the results waiting to be used stay bounded
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    if nproc is None:
+        nproc = os.cpu_count()
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        futures = deque()
+        try:
+            for task in tasks:
+                futures.append(executor.submit(func,task))
+                if len(futures) > nproc:
+                    yield futures.popleft().result()
+            while len(futures) > 0:
+                yield futures.popleft().result()
+        finally:
+            #if a tile failed or the caller stopped early, do not run the tiles that are still queued
+            for future in futures:
+                future.cancel()
+
+def _combspec_tile(task):
+    #read the data for one tile, as needed by combtile_spec (module level, so it can be sent to a process pool)
+    tile,zdate,tdate,md,specver,coaddir,nthreads = task
+    if md == 'zmtl':
+        #if specver ==
+        #tspec = combzmtl(tile,zdate,tdate)
+        return combzmtl(tile,tdate,coaddir='/global/cfs/cdirs/desi/spectro/redux/'+specver+'/tiles/cumulative/')
+    return combspecdata(tile,zdate,tdate,coaddir=coaddir,nthreads=nthreads)
+
+def combtile_spec(tiles,outf='',md='',specver='daily',redo='n',specrel='guadalupe',prog='dark',par='n',partitioned='n',nproc=None,nthreads=1,coaddir='/global/cfs/cdirs/desi/spectro/redux/daily/tiles/archive/'):
+    #if partitioned == 'y', new tiles are added as fragments of the per-tile store of outf instead of rewriting outf (see read_tile_store)
+    #if par == 'y', tiles are read by a pool of nproc processes (None for the number of CPUs); each tile reads its petals with nthreads threads (see combspecdata)
+    #tiles are added in the same order and with the same columns in either case
     s = 0
     n = 0
     nfail = 0
     tl = []
-    if os.path.isfile(outf) and redo == 'n':
+    if partitioned == 'y':
+        if redo == 'y':
+            manifest = init_tile_store(outf,base='/global/cfs/cdirs/desi/survey/catalogs/DA02/LSS/'+specrel+'/datcomb_'+prog+'_spec_zdone.fits',reset=True)
+        else:
+            manifest = init_tile_store(outf)
+        dtype = tile_store_dtype(outf,manifest)
+        if dtype is not None:
+            specd = np.empty(0,dtype=dtype)
+            s = 1
+        tmask = ~np.isin(tiles['TILEID'],tile_store_tileids(outf,manifest))
+    elif os.path.isfile(outf) and redo == 'n':
         #specd = Table.read(outf)
         specd = fitsio.read(outf)
         tl.append(specd)
@@ -173,17 +424,15 @@ def combtile_spec(tiles,outf='',md='',specver='daily',redo='n',specrel='guadalup
     else:
         tmask = np.ones(len(tiles)).astype('bool')
 
-    if par == 'y':
-        print('defunct')
+    tasks = [(tile,zdate,str(tdate),md,specver,coaddir,nthreads) for tile,zdate,tdate in zip(tiles[tmask]['TILEID'],tiles[tmask]['ZDATE'],tiles[tmask]['THRUDATE'])]
+    if par == 'y' and len(tasks) > 1:
+        #the tiles come back in order, whatever order they are read in
+        tspecs = _map_in_windows(_combspec_tile,tasks,nproc)
     else:
-        for tile,zdate,tdate in zip(tiles[tmask]['TILEID'],tiles[tmask]['ZDATE'],tiles[tmask]['THRUDATE']):
-            tdate = str(tdate)
-            if md == 'zmtl':
-                #if specver ==
-                #tspec = combzmtl(tile,zdate,tdate)
-                tspec = combzmtl(tile,tdate,coaddir='/global/cfs/cdirs/desi/spectro/redux/'+specver+'/tiles/cumulative/')
-            else:
-                tspec = combspecdata(tile,zdate,tdate)
+        tspecs = (_combspec_tile(task) for task in tasks)
+    with closing(tspecs):
+        for task,tspec in zip(tasks,tspecs):
+            tile = task[0]
             if tspec:
                 tspec['TILEID'] = tile
                 tspec = np.array(tspec)
@@ -191,7 +440,7 @@ def combtile_spec(tiles,outf='',md='',specver='daily',redo='n',specrel='guadalup
                 #tspec.write('temp.fits',format='fits', overwrite=True)
                 #tspec = fitsio.read('temp.fits')
                 #tspec = np.empty(len(tspecio),dtype=dt)
-    
+
                 if s == 0:
                     specd = tspec
                     s = 1
@@ -202,19 +451,25 @@ def combtile_spec(tiles,outf='',md='',specver='daily',redo='n',specrel='guadalup
                 cols = specd.dtype.names
                 for colname in cols:
                     new[colname][...] = tspec[colname][...]
-    
+
                     #specd = np.hstack((specd,tspec))
                     #specd = np.hstack((specd,new))
-                tl.append(new)
+                if partitioned == 'y':
+                    manifest = add_tile_fragment(outf,tile,new[new['TARGETID'] > 0],manifest)
+                else:
+                    tl.append(new)
                 #specd.sort('TARGETID')
                 #kp = (specd['TARGETID'] > 0)
                 #specd = specd[kp]
-    
+
                 n += 1
                 print(tile,n,len(tiles[tmask]))#,len(specd))
             else:
                 print(str(tile)+' failed')
                 nfail += 1
+    if partitioned == 'y':
+        print('total number of failures was '+str(nfail))
+        return n > 0
     specd = np.hstack(tl)
     kp = (specd['TARGETID'] > 0)
     specd = specd[kp]
@@ -282,8 +537,19 @@ def combtile_spec_alt(tiles,outf='',md='',redo='n',prog='dark',coaddir=''):
         return False
 
 
-def combspecdata(tile,zdate,tdate,coaddir='/global/cfs/cdirs/desi/spectro/redux/daily/tiles/archive/',md='' ):
+def _read_petal_spec(task):
+    #read the redshift, zmtl, fibermap and scores tables of one petal for combspecdata
+    fbase,tile,tdate,zfn,zhdu,shdu,si = task
+    fend = '-'+str(si)+'-'+str(tile)+'-thru'+tdate+'.fits'
+    tn = Table.read(fbase+zfn+fend,hdu=zhdu)
+    tnq = Table.read(fbase+'zmtl'+fend)
+    tnf = Table.read(fbase+zfn+fend,hdu='FIBERMAP')
+    tns = Table.read(fbase+'coadd'+fend,hdu=shdu)
+    return tn,tnq,tnf,tns
+
+def combspecdata(tile,zdate,tdate,coaddir='/global/cfs/cdirs/desi/spectro/redux/daily/tiles/archive/',md='',nthreads=1 ):
     #put data from different spectrographs together, one table for fibermap, other for z
+    #if nthreads > 1, the petals are read by that many threads (reading is latency bound on the network file system)
     zdate = str(zdate)
     specs = []
     #find out which spectrograph have data
@@ -329,14 +595,17 @@ def combspecdata(tile,zdate,tdate,coaddir='/global/cfs/cdirs/desi/spectro/redux/
     tql = []
     tspecl = []
     tfl = []
-    for i in range(0,len(specs)):
-        tn = Table.read(coaddir+str(tile)+'/'+zdate+'/'+zfn+'-'+str(specs[i])+'-'+str(tile)+'-thru'+tdate+'.fits',hdu=zhdu)
+    tasks = [(coaddir+str(tile)+'/'+zdate+'/',tile,tdate,zfn,zhdu,shdu,si) for si in specs]
+    if nthreads > 1 and len(tasks) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            petals = list(executor.map(_read_petal_spec,tasks))
+    else:
+        petals = map(_read_petal_spec,tasks)
+    for tn,tnq,tnf,tns in petals:
         tspecl.append(tn)
-        tnq = Table.read(coaddir+str(tile)+'/'+zdate+'/zmtl-'+str(specs[i])+'-'+str(tile)+'-thru'+tdate+'.fits')
         tql.append(tnq)
-        tnf = Table.read(coaddir+str(tile)+'/'+zdate+'/'+zfn+'-'+str(specs[i])+'-'+str(tile)+'-thru'+tdate+'.fits',hdu='FIBERMAP')
         tfl.append(tnf)
-        tns = Table.read(coaddir+str(tile)+'/'+zdate+'/coadd-'+str(specs[i])+'-'+str(tile)+'-thru'+tdate+'.fits',hdu=shdu)
         tsl.append(tns)
 #         if i == 0:
 #            tspec = tn
@@ -436,7 +705,8 @@ def combspecdata_alt(tile,tdate,coaddir='',md='' ):
     return tspec
 
 
-def combtile_em(tiles,outf='',md='',prog='dark',redo='n'):
+def combtile_em(tiles,outf='',md='',prog='dark',redo='n',partitioned='n'):
+    #if partitioned == 'y', new tiles are added as fragments of the per-tile store of outf instead of rewriting outf (see read_tile_store)
     s = 0
     n = 0
     nfail = 0
@@ -444,7 +714,14 @@ def combtile_em(tiles,outf='',md='',prog='dark',redo='n'):
     #print(len(guadtid))
     guadtid = np.unique(guadtid['TILEID'])
 
-    if os.path.isfile(outf) and redo == 'n':
+    if partitioned == 'y':
+        manifest = init_tile_store(outf,reset=(redo == 'y'),empty=(redo == 'y'))
+        dtype = tile_store_dtype(outf,manifest)
+        if dtype is not None:
+            specd = np.empty(0,dtype=dtype)
+            s = 1
+        tmask = ~np.isin(tiles['TILEID'],tile_store_tileids(outf,manifest))
+    elif os.path.isfile(outf) and redo == 'n':
         #specd = Table.read(outf)
         specd = fitsio.read(outf)
         #dt = specd.dtype
@@ -479,6 +756,11 @@ def combtile_em(tiles,outf='',md='',prog='dark',redo='n'):
         if tspec is not None:
             tspec = np.array(tspec)
 
+            if partitioned == 'y':
+                manifest = add_tile_fragment(outf,tile,tspec[tspec['TARGETID'] > 0],manifest)
+                n += 1
+                print(tile,n,len(tiles[tmask]))
+                continue
             if s == 0:
                 specd = tspec
                 s = 1
@@ -502,6 +784,8 @@ def combtile_em(tiles,outf='',md='',prog='dark',redo='n'):
             print(str(tile)+' failed')
             nfail += 1
     print('total number of failures was '+str(nfail))
+    if partitioned == 'y':
+        return n > 0
     newtot = np.hstack(newl)
     specd = np.hstack((specd,newtot))
     kp = (specd['TARGETID'] > 0)
@@ -1093,9 +1377,117 @@ def goodlocdict(tf):
 #     print(str(len(aa)) +' after imaging veto' )
 #     return aa
 
+#in-process cache of the MTL ledgers, for the many read_targets_in_tiles(mdir,tile,mtl=True,isodate=MTLTIME) calls of the combine stage
+#neighbouring tiles overlap, so the same healpix ledgers were read and cut again for every tile;
+#here each ledger file is read once (up to _mtl_cache_maxfiles files and _mtl_cache_maxbytes bytes are kept, least recently used first out)
+#and the time cut and the selection of the last entry per TARGETID are applied to it with array operations for each tile
+_mtl_cache = {}
+_mtl_cache_maxfiles = 512
+_mtl_cache_maxbytes = 2*1024**3
+_mtl_cache_counts = {'hits':0,'misses':0,'nbytes':0}
+
+def _mtl_cache_entry_nbytes(entry):
+    if entry is None:
+        return 0
+    return sum([arr.nbytes for arr in entry])
+
+def mtl_cache_info():
+    '''
+    return a dictionary with the numbers of hits and misses of the ledger cache and the number of ledgers currently cached
+    '''
+    info = dict(_mtl_cache_counts)
+    info['nfiles'] = len(_mtl_cache)
+    return info
+
+def clear_mtl_cache(maxfiles=None,maxbytes=None):
+    '''
+    empty the ledger cache and reset its counters; if maxfiles (maxbytes) is not None, change the maximum number of ledger files (bytes) kept in memory
+    '''
+    global _mtl_cache_maxfiles,_mtl_cache_maxbytes
+    _mtl_cache.clear()
+    _mtl_cache_counts['hits'] = 0
+    _mtl_cache_counts['misses'] = 0
+    _mtl_cache_counts['nbytes'] = 0
+    if maxfiles is not None:
+        _mtl_cache_maxfiles = maxfiles
+    if maxbytes is not None:
+        _mtl_cache_maxbytes = maxbytes
+
+def _get_mtl_ledger(fn,columns,nside):
+    #full ledger in fn (columns restricted to columns, if not None) as cached, along with the order that groups the entries by TARGETID
+    #(keeping the order of the ledger within each TARGETID) and the nside healpix pixel of each entry; None if fn does not exist
+    from desitarget.io import read_mtl_ledger
+    key = (fn,None if columns is None else tuple(columns),nside)
+    if key in _mtl_cache:
+        _mtl_cache_counts['hits'] += 1
+        #move to the end, i.e., most recently used
+        _mtl_cache[key] = _mtl_cache.pop(key)
+        return _mtl_cache[key]
+    _mtl_cache_counts['misses'] += 1
+    try:
+        mtl = read_mtl_ledger(fn,unique=False,columns=columns)
+    except FileNotFoundError:
+        mtl = None
+    if mtl is None:
+        entry = None
+    else:
+        order = np.lexsort((np.arange(len(mtl)),mtl['TARGETID']))
+        pix = hp.ang2pix(nside,np.radians(90-mtl['DEC']),np.radians(mtl['RA']),nest=True)
+        entry = (mtl,order,pix)
+    nbytes = _mtl_cache_entry_nbytes(entry)
+    if nbytes > _mtl_cache_maxbytes:
+        #too large to be kept
+        return entry
+    while len(_mtl_cache) > 0 and (len(_mtl_cache) >= _mtl_cache_maxfiles or _mtl_cache_counts['nbytes']+nbytes > _mtl_cache_maxbytes):
+        _mtl_cache_counts['nbytes'] -= _mtl_cache_entry_nbytes(_mtl_cache.pop(next(iter(_mtl_cache))))
+    _mtl_cache[key] = entry
+    _mtl_cache_counts['nbytes'] += nbytes
+    return entry
+
+def _cut_mtl_ledger(entry,isodate,pixlist):
+    #same selection as desitarget.io.read_one_mtl_ledger(fn,unique=True,isodate=isodate) followed by the is_in_hp cut, from a cached ledger
+    mtl,order,pix = entry
+    if isodate is None:
+        sel = order
+    else:
+        try:
+            ii = mtl['TIMESTAMP'] < isodate
+        except TypeError:
+            ii = mtl['TIMESTAMP'] < isodate.encode()
+        sel = order[ii[order]]
+    #last entry for each TARGETID, in order of TARGETID
+    tids = mtl['TARGETID'][sel]
+    last = np.ones(len(sel),dtype='bool')
+    last[:-1] = tids[1:] != tids[:-1]
+    sel = sel[last]
+    sel = sel[np.isin(pix[sel],pixlist)]
+    return mtl[sel]
+
+def read_mtl_in_tiles_cached(mdir,tiles,isodate=None,columns=None):
+    '''
+    same as desitarget.io.read_targets_in_tiles(mdir,tiles,mtl=True,isodate=isodate), restricted to columns (None for all),
+    but reading the ledgers through the in-process cache (see mtl_cache_info)
+    columns should then include TARGETID, RA, DEC and TIMESTAMP
+    '''
+    from desitarget.io import find_mtl_file_format_from_header, read_keyword_from_mtl_header, read_mtl_ledger, nside2nside, pixarea2nside, tiles2pix, is_point_in_desi
+    nside = pixarea2nside(7.)
+    pixlist = tiles2pix(nside,tiles=tiles)
+    fileform = find_mtl_file_format_from_header(mdir)
+    filenside = int(read_keyword_from_mtl_header(mdir,'FILENSID'))
+    mtls = []
+    for filepix in nside2nside(nside,filenside,pixlist):
+        entry = _get_mtl_ledger(fileform.format(filepix),columns,nside)
+        if entry is not None:
+            mtls.append(_cut_mtl_ledger(entry,isodate,pixlist))
+    if len(mtls) == 0:
+        #no ledgers for these tiles, return an empty array with the data model
+        fn = glob.glob(fileform.format('*'))[0]
+        return np.zeros(0,dtype=read_mtl_ledger(fn,columns=columns).dtype.descr)
+    mtl = np.concatenate(mtls)
+    ii = is_point_in_desi(tiles,mtl['RA'],mtl['DEC'])
+    return mtl[ii]
+
 def get_tiletab(tile_row,tarcol=['RA','DEC','TARGETID','DESI_TARGET','BGS_TARGET','MWS_TARGET','SUBPRIORITY','PRIORITY_INIT','TARGET_STATE','TIMESTAMP','ZWARN','PRIORITY']):
-    from desitarget.io import read_targets_in_tiles
-    
     tile = tile_row['TILEID'][0]
     ts = str(tile).zfill(6)
     faf = '/global/cfs/cdirs/desi/target/fiberassign/tiles/trunk/'+ts[:3]+'/fiberassign-'+ts+'.fits.gz'
@@ -1106,7 +1498,7 @@ def get_tiletab(tile_row,tarcol=['RA','DEC','TARGETID','DESI_TARGET','BGS_TARGET
     if mdir == '/global/cfs/cdirs/desi/survey/ops/staging/mtl/main/bright/':
         mdir = '/global/cfs/cdirs/desi/target/catalogs/mtl/1.0.0/mtl/main/bright/'
     #wt = tiles['TILEID'] == tile
-    tars = read_targets_in_tiles(mdir,tile_row,mtl=True,isodate=fht['MTLTIME'])
+    tars = read_mtl_in_tiles_cached(mdir,tile_row,isodate=fht['MTLTIME'],columns=tarcol+[col for col in ['RA','DEC','TARGETID','TIMESTAMP'] if col not in tarcol])
     #tars.keep_columns(tarcols)
     tars = tars[[b for b in tarcol]]
 
@@ -1117,12 +1509,20 @@ def get_tiletab(tile_row,tarcol=['RA','DEC','TARGETID','DESI_TARGET','BGS_TARGET
     return tars
 
 
-def combtiles_wdup(tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARGET','BGS_TARGET','MWS_TARGET','SUBPRIORITY','PRIORITY_INIT','TARGET_STATE','TIMESTAMP','ZWARN','PRIORITY']):
-    from desitarget.io import read_targets_in_tiles
+def combtiles_wdup(tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARGET','BGS_TARGET','MWS_TARGET','SUBPRIORITY','PRIORITY_INIT','TARGET_STATE','TIMESTAMP','ZWARN','PRIORITY'],partitioned='n',redo='n'):
+    #if partitioned == 'y', new tiles are added as fragments of the per-tile store of fout instead of rewriting fout;
+    #fragments are not sorted, use read_tile_store(fout,sort='TARGETID') or compact_tile_store(fout,sort='TARGETID') to get the sorted table
+    #if partitioned == 'y' and redo == 'y', the store is started over from no tiles
+    import LSS.common_tools as common
+    #the MTL ledgers are read through the cache shared by the tiles (see read_mtl_in_tiles_cached)
+    mtlcols = tarcol+[col for col in ['RA','DEC','TARGETID','TIMESTAMP'] if col not in tarcol]
     s = 0
     n = 0
     tl = []
-    if os.path.isfile(fout):
+    if partitioned == 'y':
+        manifest = init_tile_store(fout,reset=(redo == 'y'),empty=(redo == 'y'))
+        tmask = ~np.isin(tiles['TILEID'],tile_store_tileids(fout,manifest))
+    elif os.path.isfile(fout):
         tars = Table.read(fout)
         tl.append(tars)
         #s = 1
@@ -1140,7 +1540,7 @@ def combtiles_wdup(tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARGET','BG
         if mdir == '/global/cfs/cdirs/desi/survey/ops/staging/mtl/main/bright/':
             mdir = '/global/cfs/cdirs/desi/target/catalogs/mtl/1.0.0/mtl/main/bright/'
         wt = tiles['TILEID'] == tile
-        tars = read_targets_in_tiles(mdir,tiles[wt],mtl=True,isodate=fht['MTLTIME'])
+        tars = read_mtl_in_tiles_cached(mdir,tiles[wt],isodate=fht['MTLTIME'],columns=mtlcols)
         #tars.keep_columns(tarcols)
         tars = tars[[b for b in tarcol]]
 
@@ -1148,7 +1548,10 @@ def combtiles_wdup(tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARGET','BG
         tars = join(tars,tt,keys=['TARGETID'])
         tars['TILEID'] = tile
         tars.remove_columns(['ZWARN'])
-        tl.append(tars)
+        if partitioned == 'y':
+            manifest = add_tile_fragment(fout,tile,tars,manifest)
+        else:
+            tl.append(tars)
         #if s == 0:
         #    tarsn = tars
         #    s = 1
@@ -1157,7 +1560,11 @@ def combtiles_wdup(tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARGET','BG
         #tarsn.sort('TARGETID')
         n += 1
         print(tile,n,len(tiles[tmask]))#,len(tarsn))
-    if np.sum(tmask) > 0:
+    print('MTL ledger cache: '+str(mtl_cache_info()))
+    if partitioned == 'y':
+        if np.sum(tmask) == 0:
+            print('nothing to update, done')
+    elif np.sum(tmask) > 0:
         print('about to stack')
         tarsn = vstack(tl)
         tarsn.sort('TARGETID')
@@ -1166,17 +1573,40 @@ def combtiles_wdup(tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARGET','BG
     else:
         print('nothing to update, done')
 
+def _read_potential_assignments(faf):
+    #primary header and POTENTIAL_ASSIGNMENTS table of a fiberassign file, with a single opening of the (gzipped) file
+    #the meta and column attributes (units etc.) are those Table.read(faf,hdu='POTENTIAL_ASSIGNMENTS') gives,
+    #obtained by letting astropy read the header of the extension with no rows
+    import io
+    with fitsio.FITS(faf) as fa:
+        fht = fa[0].read_header()
+        hdr = fa['POTENTIAL_ASSIGNMENTS'].read_header()
+        tt = Table(fa['POTENTIAL_ASSIGNMENTS'].read())
+    ahdr = fits.Header([fits.Card.fromstring(rec['card_string']) for rec in hdr.records()])
+    ahdr['NAXIS2'] = 0
+    empty = Table.read(io.BytesIO((fits.PrimaryHDU().header.tostring()+ahdr.tostring()).encode()),format='fits',hdu=1)
+    tt.meta = empty.meta
+    for col in empty.colnames:
+        tt[col].unit = empty[col].unit
+        tt[col].description = empty[col].description
+        tt[col].format = empty[col].format
+    return fht,tt
+
 def combtiles_wdup_hp(hpx,tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARGET','BGS_TARGET','MWS_TARGET','SUBPRIORITY','PRIORITY_INIT','TARGET_STATE','TIMESTAMP','ZWARN','PRIORITY']):
+    #the tiles are accumulated in a list and stacked and sorted by TARGETID once at the end;
+    #the sort is stable, so rows with the same TARGETID are in the order the tiles were added
     import desimodel.footprint as foot
-    from desitarget.io import read_targets_in_tiles
-    s = 0
+    #the MTL ledgers are read through the cache shared by the tiles (see read_mtl_in_tiles_cached)
+    mtlcols = tarcol+[col for col in ['RA','DEC','TARGETID','TIMESTAMP'] if col not in tarcol]
     n = 0
-
+    nrow = 0
+    tl = []
     tarsn = None
     tls = foot.pix2tiles(8,[hpx],tiles)
     if os.path.isfile(fout):
         tarsn = Table.read(fout)
-        s = 1
+        tl.append(tarsn)
+        nrow = len(tarsn)
         tdone = np.unique(tarsn['TILEID'])
         tmask = ~np.isin(tls['TILEID'],tdone)
     else:
@@ -1185,37 +1615,37 @@ def combtiles_wdup_hp(hpx,tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARG
     for tile in tls[tmask]['TILEID']:
         ts = str(tile).zfill(6)
         faf = '/global/cfs/cdirs/desi/target/fiberassign/tiles/trunk/'+ts[:3]+'/fiberassign-'+ts+'.fits.gz'
-        fht = fitsio.read_header(faf)
+        fht,tt = _read_potential_assignments(faf)
         mdir = '/global/cfs/cdirs/desi'+fht['MTL'][8:]+'/'
         if mdir == '/global/cfs/cdirs/desi/survey/ops/staging/mtl/main/dark/':
             mdir = '/global/cfs/cdirs/desi/target/catalogs/mtl/1.0.0/mtl/main/dark/'
         if mdir == '/global/cfs/cdirs/desi/survey/ops/staging/mtl/main/bright/':
             mdir = '/global/cfs/cdirs/desi/target/catalogs/mtl/1.0.0/mtl/main/bright/'
         wt = tls['TILEID'] == tile
-        tars = read_targets_in_tiles(mdir,tls[wt],mtl=True,isodate=fht['MTLTIME'])
+        tars = read_mtl_in_tiles_cached(mdir,tls[wt],isodate=fht['MTLTIME'],columns=mtlcols)
         #tars.keep_columns(tarcols)
         tars = tars[[b for b in tarcol]]
         theta, phi = np.radians(90-tars['DEC']), np.radians(tars['RA'])
         tpix = hp.ang2pix(8,theta,phi,nest=True)
         sel = tpix == hpx
         tars = tars[sel]
-        tt = Table.read(faf,hdu='POTENTIAL_ASSIGNMENTS')
         if np.sum(np.isin(tt['TARGETID'],tars['TARGETID'])) > 0:
             tars = join(tars,tt,keys=['TARGETID'])
             tars['TILEID'] = tile
             tars.remove_columns(['ZWARN'])
-            if s == 0:
-                tarsn = tars
-                s = 1
-            else:
-                tarsn = vstack([tarsn,tars],metadata_conflicts='silent')
-            tarsn.sort('TARGETID')
+            tl.append(tars)
+            nrow += len(tars)
 
-            print(tile,n,len(tls[tmask]),len(tarsn))
+            print(tile,n,len(tls[tmask]),nrow)
 
         else:
             print('no overlapping targetid')
         n += 1
+    print('MTL ledger cache: '+str(mtl_cache_info()))
+    if len(tl) > 0 and (tarsn is None or len(tl) > 1):
+        tarsn = vstack(tl,metadata_conflicts='silent')
+        tarsn.sort('TARGETID',kind='stable')
+    del tl
     if tarsn is not None and n > 0:
         tarsn.write(fout,format='fits', overwrite=True)
     else:
@@ -1224,6 +1654,21 @@ def combtiles_wdup_hp(hpx,tiles,fout='',tarcol=['RA','DEC','TARGETID','DESI_TARG
         else:
             print('no tiles to update for this pixel '+str(hpx))
 
+def _combtiles_wdup_hp_task(task):
+    hpx,tiles,fout = task
+    return combtiles_wdup_hp(hpx,tiles,fout)
+
+def combtiles_wdup_hps(hpxs,tiles,fouts,nproc=None):
+    #run combtiles_wdup_hp for each of the healpix pixels hpxs (output written to the matching entry of fouts),
+    #with a pool of nproc processes (None for the number of CPUs)
+    #each process has its own ledger cache, so the memory allowed for the cache (_mtl_cache_maxbytes) is split between them
+    from concurrent.futures import ProcessPoolExecutor
+    if nproc is None:
+        nproc = os.cpu_count()
+    with ProcessPoolExecutor(max_workers=nproc,initializer=clear_mtl_cache,initargs=(None,_mtl_cache_maxbytes//nproc)) as executor:
+        #list() so that errors in the workers are raised here
+        list(executor.map(_combtiles_wdup_hp_task,[(hpx,tiles,fout) for hpx,fout in zip(hpxs,fouts)]))
+
 def gettarinfo_type(faf,tars,goodloc,pdict,tp='SV3_DESI_TARGET'):
     #get target info
     #in current files on SVN, TARGETS has all of the necessary info on potential assignments
@@ -1362,56 +1807,18 @@ def count_tiles_input(fjg):
     take input array with require columns TARGETID TILEID TILELOCID
     return table with unique TARGETID and the number of tiles it showed up on (NTILE), the TILES and the TILELOCIDS
     '''
-    fjg.keep_columns(['TARGETID','TILEID','TILELOCID'])
-    fjg = np.array(fjg)
-    #print(fjg.dtype.names)
-    fjg = fjg[np.argsort(fjg['TARGETID'])]
-
-    tids = np.unique(fjg['TARGETID'])
-    print('going through '+str(len(fjg))+' rows with '+str(len(tids))+' unique targetid')
-    nloc = []#np.zeros(len(np.unique(f['TARGETID'])))
-    nt = []
-    tl = []
-    tli = []
-    ti = 0
-    i = 0
-    while i < len(fjg):
-        tls  = []
-        tlis = []
-        nli = 0
-
-        while fjg[i]['TARGETID'] == tids[ti]:
-            nli += 1
-            tls.append(fjg[i]['TILEID'])
-            tlis.append(fjg[i]['TILELOCID'])
-            i += 1
-            if i == len(fjg):
-                break
-        nloc.append(nli)
-        tlsu = np.unique(tls)
-        tlisu = np.unique(tlis)
-        nt.append(len(tlsu))
-        tl.append("-".join(tlsu.astype(str)))
-        tli.append("-".join(tlisu.astype(str)))
-
-        if ti%100000 == 0:
-            print(ti)
-        ti += 1
-    tc = Table()
-    tc['TARGETID'] = tids
-    tc['NTILE'] = nt
-    tc['TILES'] = tl
-    tc['TILELOCIDS'] = tli
+    import LSS.common_tools as common
+    tc = common.count_tiles_arrays(fjg['TARGETID'],fjg['TILEID'],fjg['TILELOCID'])
 
     return tc
 
 def count_tiles_better(dr,pd,rann=0,specrel='daily',fibcol='COADD_FIBERSTATUS',px=False,survey='main',indir=None,gtl=None,badfib=None, prog_ = 'dark'):
     '''
-    from files with duplicates that have already been sorted by targetid, quickly go
-    through and get the multi-tile information
+    from files with duplicates, quickly go through and get the multi-tile information
     dr is either 'dat' or 'ran'
     returns file with TARGETID,NTILE,TILES,TILELOCIDS
     '''
+    import LSS.common_tools as common
 
     #fs = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/main/LSS/'+specrel+'/datcomb_'+pd+'_spec_zdone.fits')
     #wf = fs['FIBERSTATUS'] == 0
@@ -1455,43 +1862,7 @@ def count_tiles_better(dr,pd,rann=0,specrel='daily',fibcol='COADD_FIBERSTATUS',p
     wg = np.isin(fj['TILELOCID'],gtl)
     fjg = fj[wg]
     del fj
-    fjg = fjg[np.argsort(fjg['TARGETID'])]
-
-    tids = np.unique(fjg['TARGETID'])
-    print('going through '+str(len(fjg))+' rows with '+str(len(tids))+' unique targetid')
-    nloc = []#np.zeros(len(np.unique(f['TARGETID'])))
-    nt = []
-    tl = []
-    tli = []
-    ti = 0
-    i = 0
-    while i < len(fjg):
-        tls  = []
-        tlis = []
-        nli = 0
-
-        while fjg[i]['TARGETID'] == tids[ti]:
-            nli += 1
-            tls.append(fjg[i]['TILEID'])
-            tlis.append(fjg[i]['TILELOCID'])
-            i += 1
-            if i == len(fjg):
-                break
-        nloc.append(nli)
-        tlsu = np.unique(tls)
-        tlisu = np.unique(tlis)
-        nt.append(len(tlsu))
-        tl.append("-".join(tlsu.astype(str)))
-        tli.append("-".join(tlisu.astype(str)))
-
-        if ti%100000 == 0:
-            print(ti)
-        ti += 1
-    tc = Table()
-    tc['TARGETID'] = tids
-    tc['NTILE'] = nt
-    tc['TILES'] = tl
-    tc['TILELOCIDS'] = tli
+    tc = common.count_tiles_arrays(fjg['TARGETID'],fjg['TILEID'],fjg['TILELOCID'])
 
     return tc
 
@@ -1499,61 +1870,25 @@ def count_tiles_better(dr,pd,rann=0,specrel='daily',fibcol='COADD_FIBERSTATUS',p
 
 def count_tiles_better_px(dr,pd,gtl,rann=0,specrel='daily',fibcol='COADD_FIBERSTATUS',px=None,survey='main'):
     '''
-    from files with duplicates that have already been sorted by targetid, quickly go
-    through and get the multi-tile information
+    from files with duplicates, quickly go through and get the multi-tile information
     dr is either 'dat' or 'ran'
     returns file with TARGETID,NTILE,TILES,TILELOCIDS
     '''
+    import LSS.common_tools as common
 
     if dr == 'dat':
-        fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/'+survey+'/LSS/'+specrel+'/datcomb_'+pd+'_tarspecwdup_zdone.fits')
+        fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/'+survey+'/LSS/'+specrel+'/datcomb_'+pd+'_tarspecwdup_zdone.fits',columns=['TARGETID','TILEID','TILELOCID'])
         #outf = '/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/datcomb_'+pd+'ntileinfo.fits'
     if dr == 'ran':
         if px is not None:
-            fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/'+survey+'/LSS/'+specrel+'/healpix/rancomb_'+str(rann)+pd+'_'+str(px)+'_wdupspec_zdone.fits')
+            fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/'+survey+'/LSS/'+specrel+'/healpix/rancomb_'+str(rann)+pd+'_'+str(px)+'_wdupspec_zdone.fits',columns=['TARGETID','TILEID','TILELOCID'])
         else:
-            fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/'+survey+'/LSS/'+specrel+'/rancomb_'+str(rann)+pd+'wdupspec_zdone.fits')
+            fj = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/'+survey+'/LSS/'+specrel+'/rancomb_'+str(rann)+pd+'wdupspec_zdone.fits',columns=['TARGETID','TILEID','TILELOCID'])
 
         #outf = '/global/cfs/cdirs/desi/survey/catalogs/SV3/LSS/random'+str(rann)+'/rancomb_'+pd+'ntileinfo.fits'
     wg = np.isin(fj['TILELOCID'],gtl)
     fjg = fj[wg]
-    fjg = fjg[np.argsort(fjg['TARGETID'])]
-
-    tids = np.unique(fjg['TARGETID'])
-    print('going through '+str(len(fjg))+' rows with '+str(len(tids))+' unique targetid')
-    nloc = []#np.zeros(len(np.unique(f['TARGETID'])))
-    nt = []
-    tl = []
-    tli = []
-    ti = 0
-    i = 0
-    while i < len(fjg):
-        tls  = []
-        tlis = []
-        nli = 0
-
-        while fjg[i]['TARGETID'] == tids[ti]:
-            nli += 1
-            tls.append(fjg[i]['TILEID'])
-            tlis.append(fjg[i]['TILELOCID'])
-            i += 1
-            if i == len(fjg):
-                break
-        nloc.append(nli)
-        tlsu = np.unique(tls)
-        tlisu = np.unique(tlis)
-        nt.append(len(tlsu))
-        tl.append("-".join(tlsu.astype(str)))
-        tli.append("-".join(tlisu.astype(str)))
-
-        if ti%100000 == 0:
-            print(ti)
-        ti += 1
-    tc = Table()
-    tc['TARGETID'] = tids
-    tc['NTILE'] = nt
-    tc['TILES'] = tl
-    tc['TILELOCIDS'] = tli
+    tc = common.count_tiles_arrays(fjg['TARGETID'],fjg['TILEID'],fjg['TILELOCID'])
 
     return tc
 
@@ -3297,28 +3632,14 @@ def add_zfail_weight2fullQSO(indir,version,qsocat,tsnrcut=80,readpars=False):
     plt.xlim(np.percentile(ff[selgz]['TSNR2_'+tp[:3]],0.5),np.percentile(ff[selgz]['TSNR2_'+tp[:3]],99))
     plt.show()
     
-    common.write_LSS(ff,outdir+tp+'_full_noveto.dat.fits',comments='added ZFAIL weight')
-    ff.keep_columns(['TARGETID','WEIGHT_ZFAIL','mod_success_rate'])
-    ffc = Table.read(outdir+tp+'_full.dat.fits')
-    cols = list(ffc.dtype.names)
-    if 'WEIGHT_ZFAIL' in cols:
-        ffc.remove_columns(['WEIGHT_ZFAIL'])
-    if 'mod_success_rate' in cols:
-        ffc.remove_columns(['mod_success_rate'])
-    ffc = join(ffc,ff,keys=['TARGETID'],join_type='left')
-    common.write_LSS(ffc,outdir+tp+'_full.dat.fits',comments='added ZFAIL weight')
+    zfcols = ['WEIGHT_ZFAIL','mod_success_rate']
+    common.write_LSS_cols(outdir+tp+'_full_noveto.dat.fits',ff,zfcols,comments=['added ZFAIL weight'])
+    ff.keep_columns(['TARGETID']+zfcols)
+    common.write_LSS_cols_bytid(outdir+tp+'_full.dat.fits',ff,zfcols,comments=['added ZFAIL weight'])
 
     fname_mapveto = outdir+tp+'_full_HPmapcut.dat.fits'
     if os.path.isfile(fname_mapveto):
-        ff.keep_columns(['TARGETID','WEIGHT_ZFAIL','mod_success_rate'])
-        ffc = Table.read(fname_mapveto)
-        cols = list(ffc.dtype.names)
-        if 'WEIGHT_ZFAIL' in cols:
-            ffc.remove_columns(['WEIGHT_ZFAIL'])
-        if 'mod_success_rate' in cols:
-            ffc.remove_columns(['mod_success_rate'])
-        ffc = join(ffc,ff,keys=['TARGETID'],join_type='left')
-        common.write_LSS(ffc,fname_mapveto)#,comments='added ZFAIL weight')
+        common.write_LSS_cols_bytid(fname_mapveto,ff,zfcols)#,comments='added ZFAIL weight')
  
 
 
@@ -3457,28 +3778,14 @@ def add_zfail_weight2full(indir,tp='',tsnrcut=80,readpars=False,hpmapcut='_HPmap
     plt.xlim(np.percentile(ff[selgz]['TSNR2_'+tp[:3]],0.5),np.percentile(ff[selgz]['TSNR2_'+tp[:3]],99))
     plt.show()
     
-    common.write_LSS(ff,fullname)#,comments='added ZFAIL weight')
+    zfcols = ['WEIGHT_ZFAIL','mod_success_rate']
+    common.write_LSS_cols(fullname,ff,zfcols)#,comments='added ZFAIL weight')
     if tp != 'BGS_BRIGHT-21.5':
-        ff.keep_columns(['TARGETID','WEIGHT_ZFAIL','mod_success_rate'])
-        ffc = Table.read(indir+tp+'_full.dat.fits')
-        cols = list(ffc.dtype.names)
-        if 'WEIGHT_ZFAIL' in cols:
-            ffc.remove_columns(['WEIGHT_ZFAIL'])
-        if 'mod_success_rate' in cols:
-            ffc.remove_columns(['mod_success_rate'])
-        ffc = join(ffc,ff,keys=['TARGETID'],join_type='left')
-        common.write_LSS(ffc,indir+tp+'_full.dat.fits')#,comments='added ZFAIL weight')
+        ff.keep_columns(['TARGETID']+zfcols)
+        common.write_LSS_cols_bytid(indir+tp+'_full.dat.fits',ff,zfcols)#,comments='added ZFAIL weight')
         fname_mapveto = indir+tp+'_full_HPmapcut.dat.fits'
         if os.path.isfile(fname_mapveto):
-            ff.keep_columns(['TARGETID','WEIGHT_ZFAIL','mod_success_rate'])
-            ffc = Table.read(fname_mapveto)
-            cols = list(ffc.dtype.names)
-            if 'WEIGHT_ZFAIL' in cols:
-                ffc.remove_columns(['WEIGHT_ZFAIL'])
-            if 'mod_success_rate' in cols:
-                ffc.remove_columns(['mod_success_rate'])
-            ffc = join(ffc,ff,keys=['TARGETID'],join_type='left')
-            common.write_LSS(ffc,fname_mapveto)#,comments='added ZFAIL weight')
+            common.write_LSS_cols_bytid(fname_mapveto,ff,zfcols)#,comments='added ZFAIL weight')
     
     
 #     if dchi2 is not None:
@@ -81,7 +81,9 @@ def read_fits_to_pandas(filename, ext=1, columns=None):
     file = fitsio.FITS(filename)[ext]
     if columns is not None:
         file = file[columns]
-    return pd.DataFrame(file.read().byteswap().newbyteorder())
+    data = file.read()
+    # convert to native byte order (ndarray.newbyteorder does not exist anymore in numpy >= 2).
+    return pd.DataFrame(data.astype(data.dtype.newbyteorder('=')))
 
 
 def save_dataframe_to_fits(dataframe, filename, extname="QSO_CAT", clobber=True):
@@ -468,7 +470,60 @@ def qso_catalog_for_a_tile(path_to_tile, tile, last_night, survey, program):
     return pd.concat([run_catalog_maker(path_to_tile, tile, last_night, petal, survey, program) for petal in range(10)], ignore_index=True)
 
 
-def build_qso_catalog_from_tiles(redux='/global/cfs/cdirs/desi/spectro/redux/', release='fuji', dir_output='', npool=20, tiles_to_use=None, qsoversion='test'):
+def qso_fragment_filename(dir_fragments, tile, last_night):
+    """ Name of the file with the QSO catalog of tile built with the data up to last_night (see build_qso_catalog_from_tiles with incremental=True). """
+    return os.path.join(dir_fragments, f'QSO_cat-{tile}-thru{last_night}.fits')
+
+
+def update_qso_fragments(DIR, dir_fragments, tiles, last_night, survey, program, npool=20):
+    """
+    Build the per-tile QSO catalogs (fragments) which are missing in dir_fragments, ie) for the new tiles and the tiles whose LASTNIGHT changed.
+    The TS probas are computed (once) for the new rows only. Fragments of older LASTNIGHT are removed.
+    A tile without any QSO is recorded with an empty file, so that it is not treated again.
+
+    Args:
+        * DIR (str): where the tiles are (cumulative directory).
+        * dir_fragments (str): directory where the fragments are saved.
+        * tiles, last_night, survey, program (array of str): tile information as read in tiles-{release}.fits
+        * npool (int): nbr of workers used for the parallelisation.
+
+    Return:
+        * sel (array of bool): which tiles were (re)built.
+    """
+    import multiprocessing
+    from itertools import repeat
+
+    os.makedirs(dir_fragments, exist_ok=True)
+    sel = np.array([not os.path.isfile(qso_fragment_filename(dir_fragments, tile, night)) for tile, night in zip(tiles, last_night)], dtype='bool')
+    log.info(f'There are {sel.sum()} new or updated tiles out of {tiles.size} to treat with npool={npool}')
+
+    if sel.sum() > 0:
+        logging.getLogger("QSO_CAT_UTILS").setLevel(logging.ERROR)
+        with multiprocessing.Pool(npool) as pool:
+            arguments = zip(repeat(DIR), tiles[sel], last_night[sel], survey[sel], program[sel])
+            QSO_cat = pd.concat(pool.starmap(qso_catalog_for_a_tile, arguments), ignore_index=True)
+        logging.getLogger("QSO_CAT_UTILS").setLevel(logging.INFO)
+
+        if QSO_cat.shape[0] > 0:
+            log.info('Compute the TS probas for the new rows...')
+            compute_RF_TS_proba(QSO_cat)
+
+        for tile, night in zip(tiles[sel], last_night[sel]):
+            # remove the fragments built with older LASTNIGHT for this tile.
+            for filename in glob.glob(os.path.join(dir_fragments, f'QSO_cat-{tile}-thru*.fits')):
+                os.remove(filename)
+            filename = qso_fragment_filename(dir_fragments, tile, night)
+            tmp = filename + '.tmp'
+            if QSO_cat.shape[0] > 0 and (QSO_cat['TILEID'].values == int(tile)).any():
+                save_dataframe_to_fits(QSO_cat.iloc[QSO_cat['TILEID'].values == int(tile)], tmp)
+            else:
+                open(tmp, 'w').close()
+            os.replace(tmp, filename)
+
+    return sel
+
+
+def build_qso_catalog_from_tiles(redux='/global/cfs/cdirs/desi/spectro/redux/', release='fuji', dir_output='', npool=20, tiles_to_use=None, qsoversion='test', incremental=False, dir_fragments=None):
     """
     Build the QSO catalog from the healpix directory.
 
@@ -480,6 +535,10 @@ def build_qso_catalog_from_tiles(redux='/global/cfs/cdirs/desi/spectro/redux/',
         * dir_output (str): directory where the QSO catalog will be saved.
         * npool (int): nbr of workers used for the parallelisation.
         * tiles_to_use (list of str): Build the catalog only on this list of tiles. Default=None, use all the tiles collected from tiles-{release}.fits file.
+        * incremental (bool): if True, keep the QSO catalog of each tile in a fragment keyed on (TILEID, LASTNIGHT) and only rebuild
+                              the tiles whose LASTNIGHT changed (see update_qso_fragments). The rows of the other tiles are taken
+                              from the previous catalog (or from their fragment) and the output is the same as without incremental.
+        * dir_fragments (str): directory of the fragments. Default=None, use QSO_cat_{release}_cumulative_v{qsoversion}_tiles in dir_output.
     """
     import multiprocessing
     from itertools import repeat
@@ -502,6 +561,38 @@ def build_qso_catalog_from_tiles(redux='/global/cfs/cdirs/desi/spectro/redux/',
         sel = np.isin(tiles, tiles_to_use)
         tiles, last_night, survey, program = tiles[sel], last_night[sel], survey[sel], program[sel]
 
+    filename = os.path.join(dir_output, f'QSO_cat_{release}_cumulative_v{qsoversion}.fits')
+
+    if incremental:
+        if dir_fragments is None:
+            dir_fragments = os.path.join(dir_output, f'QSO_cat_{release}_cumulative_v{qsoversion}_tiles')
+        sel = update_qso_fragments(DIR, dir_fragments, tiles, last_night, survey, program, npool=npool)
+
+        # rows of the tiles which did not change come from the previous catalog, if any, the others from the fragments.
+        QSO_cat_list, from_fragments = [], ~sel
+        if os.path.isfile(filename) and (~sel).sum() > 0:
+            QSO_cat_old = read_fits_to_pandas(filename)
+            keep = np.isin(np.char.add(np.char.add(QSO_cat_old['TILEID'].values.astype(str), '-'), QSO_cat_old['LASTNIGHT'].values.astype(str)),
+                           np.char.add(np.char.add(tiles[~sel], '-'), last_night[~sel]))
+            QSO_cat_list.append(QSO_cat_old.iloc[keep])
+            from_fragments = ~sel & ~np.isin(tiles, QSO_cat_old['TILEID'].values[keep].astype(str))
+            del QSO_cat_old
+        for tile, night in zip(tiles[sel | from_fragments], last_night[sel | from_fragments]):
+            fragment = qso_fragment_filename(dir_fragments, tile, night)
+            if os.path.getsize(fragment) > 0:
+                QSO_cat_list.append(read_fits_to_pandas(fragment))
+        if len(QSO_cat_list) == 0:
+            log.warning('No QSO in the tiles...')
+            return
+        QSO_cat = pd.concat(QSO_cat_list, ignore_index=True)
+        del QSO_cat_list
+        # same order as the tiles in tiles-{release}.fits, as without incremental.
+        tile_order = pd.Series(np.arange(tiles.size), index=tiles.astype(int))
+        QSO_cat = QSO_cat.iloc[np.argsort(tile_order.loc[QSO_cat['TILEID'].values].values, kind='stable')].reset_index(drop=True)
+
+        save_dataframe_to_fits(QSO_cat, filename)
+        return
+
     log.info(f'There are {tiles.size} tiles to treat with npool={npool}')
     logging.getLogger("QSO_CAT_UTILS").setLevel(logging.ERROR)
     with multiprocessing.Pool(npool) as pool:
@@ -512,7 +603,7 @@ def build_qso_catalog_from_tiles(redux='/global/cfs/cdirs/desi/spectro/redux/',
     log.info('Compute the TS probas...')
     compute_RF_TS_proba(QSO_cat)
 
-    save_dataframe_to_fits(QSO_cat, os.path.join(dir_output, f'QSO_cat_{release}_cumulative_v{qsoversion}.fits'))
+    save_dataframe_to_fits(QSO_cat, filename)
 
 
 def qso_catalog_for_a_pixel(path_to_pix, pre_pix, pixel, survey, program, keep_all=False):
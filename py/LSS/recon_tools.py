@@ -3,6 +3,7 @@
 
 
 import os
+import time
 import argparse
 import logging
 
@@ -18,15 +19,45 @@ from LSS.cosmodesi_io_tools import get_clustering_positions_weights, catalog_dir
 logger = logging.getLogger('recon')
 
 
-def run_reconstruction(Reconstruction, distance, data_fn, randoms_fn, data_rec_fn, randoms_rec_fn, f=0.8, bias=1.2, boxsize=None, nmesh=None, cellsize=7, smoothing_radius=15, nthreads=64, convention='reciso', dtype='f8', mpicomm=None, **kwargs):
+class _ColumnReader(object):
+    """Read the columns of a FITS catalog (and keep them) only as they are accessed."""
+
+    def __init__(self, fn, ext=1):
+        self.fn, self.ext = fn, ext
+        self._columns = {}
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            with fitsio.FITS(self.fn) as fits:
+                self._columns[name] = fits[self.ext].read_column(name)
+        return self._columns[name]
 
+
+def run_reconstruction(Reconstruction, distance, data_fn, randoms_fn, data_rec_fn, randoms_rec_fn, f=0.8, bias=1.2, boxsize=None, nmesh=None, cellsize=7, smoothing_radius=15, nthreads=64, convention='reciso', dtype='f8', mpicomm=None, **kwargs):
+    """
+    Run reconstruction on data and randoms, and write the shifted catalogs.
+
+    Each random file is read once: in full with :meth:`Table.read` if shifted randoms are to be written
+    (``convention != 'rsd'``), else only the columns needed for positions and weights.
+    Cartesian positions are kept per file, so that each file is shifted and written directly,
+    by updating its RA, DEC and Z columns.
+    """
     root = mpicomm is None or mpicomm.rank == 0
 
     if np.ndim(randoms_fn) == 0: randoms_fn = [randoms_fn]
     if np.ndim(randoms_rec_fn) == 0: randoms_rec_fn = [randoms_rec_fn]
-    
+
     data_positions, data_weights = None, None
     randoms_positions, randoms_weights = None, None
+    # per-file random catalogs (to write out) and positions
+    randoms_catalogs, randoms_positions_list = [None] * len(randoms_fn), [None] * len(randoms_fn)
+    t0 = time.time()
+
+    def log_timing(stage):
+        nonlocal t0
+        t1 = time.time()
+        if root: logger.info('{} took {:.2f} s.'.format(stage, t1 - t0))
+        t0 = t1
 
     if root:
         logger.info('Loading {}.'.format(data_fn))
@@ -34,6 +65,7 @@ def run_reconstruction(Reconstruction, distance, data_fn, randoms_fn, data_rec_f
         (ra, dec, dist), data_weights, mask = get_clustering_positions_weights(data, distance, name='data', return_mask=True, **kwargs)
         data = data[mask]
         data_positions = utils.sky_to_cartesian(dist, ra, dec, dtype=dtype)
+    log_timing('Loading data')
 
     if mpicomm is not None:
         rec_kwargs = {'mpicomm': mpicomm, 'mpiroot': 0}
@@ -42,19 +74,27 @@ def run_reconstruction(Reconstruction, distance, data_fn, randoms_fn, data_rec_f
     recon = Reconstruction(f=f, bias=bias, boxsize=boxsize, nmesh=nmesh, cellsize=cellsize, los='local', positions=data_positions, dtype=dtype, **rec_kwargs)
 
     recon.assign_data(data_positions, data_weights)
-    #if root:
-    #    logger.info('random files are',str(randoms_fn))
+    log_timing('Assigning data')
 
-    #for fn in randoms_fn:
     if root:
         logger.info('Loading {}.'.format(randoms_fn))
-        randoms = vstack([Table(fitsio.read(fn)) for fn in randoms_fn])
-        (ra, dec, dist), randoms_weights = get_clustering_positions_weights(randoms, distance, name='randoms', **kwargs)
-        randoms_positions = utils.sky_to_cartesian(dist, ra, dec, dtype=dtype)
+        randoms_weights = []
+        for ifn, fn in enumerate(randoms_fn):
+            catalog = Table.read(fn) if convention != 'rsd' else _ColumnReader(fn)
+            (ra, dec, dist), weights, mask = get_clustering_positions_weights(catalog, distance, name='randoms', return_mask=True, **kwargs)
+            if convention != 'rsd': randoms_catalogs[ifn] = catalog[mask]
+            randoms_positions_list[ifn] = utils.sky_to_cartesian(dist, ra, dec, dtype=dtype)
+            randoms_weights.append(weights)
+        randoms_positions = np.concatenate(randoms_positions_list, axis=0)
+        randoms_weights = np.concatenate(randoms_weights, axis=0)
+    log_timing('Loading randoms')
     recon.assign_randoms(randoms_positions, randoms_weights)
+    del randoms_positions, randoms_weights
+    log_timing('Assigning randoms')
 
     recon.set_density_contrast(smoothing_radius=smoothing_radius)
     recon.run()
+    log_timing('Running reconstruction')
 
     field = 'rsd' if convention == 'rsd' else 'disp+rsd'
     if type(recon) is IterativeFFTParticleReconstruction:
@@ -70,24 +110,24 @@ def run_reconstruction(Reconstruction, distance, data_fn, randoms_fn, data_rec_f
         logger.info('Saving {}.'.format(data_rec_fn))
         utils.mkdir(os.path.dirname(data_rec_fn))
         catalog.write(data_rec_fn, format='fits', overwrite=True)
+    log_timing('Shifting and writing data')
 
     if convention != 'rsd':
         field = 'disp+rsd' if convention == 'recsym' else 'disp'
-        for fn, rec_fn in zip(randoms_fn, randoms_rec_fn):
-            if root:
-                catalog = Table.read(fn)
-                (ra, dec, dist), randoms_weights, mask = get_clustering_positions_weights(catalog, distance, name='randoms', return_mask=True, **kwargs)
-                catalog = catalog[mask]
-                randoms_positions = utils.sky_to_cartesian(dist, ra, dec, dtype=dtype)
-            randoms_positions_rec = recon.read_shifted_positions(randoms_positions, field=field)
+        for ifn, (fn, rec_fn) in enumerate(zip(randoms_fn, randoms_rec_fn)):
+            randoms_positions_rec = recon.read_shifted_positions(randoms_positions_list[ifn], field=field)
             if root:
+                catalog = randoms_catalogs[ifn]
                 dist, ra, dec = utils.cartesian_to_sky(randoms_positions_rec)
                 catalog['RA'], catalog['DEC'], catalog['Z'] = ra, dec, distance_to_redshift(dist)
                 logger.info('Saving {}.'.format(rec_fn))
                 utils.mkdir(os.path.dirname(rec_fn))
                 catalog.write(rec_fn, format='fits', overwrite=True)
-        
-        
+                # free memory as we go
+                randoms_catalogs[ifn] = randoms_positions_list[ifn] = None
+        log_timing('Shifting and writing randoms')
+
+
 def get_f_bias(tracer='ELG'):
     if tracer.startswith('ELG') or tracer.startswith('QSO'):
         return 0.9, 1.3
@@ -4,20 +4,34 @@ import numpy as np
 
 _dir_tabulated = os.path.join(os.path.dirname(__file__), 'data')
 
+# Hubble distance c/H0, in Mpc/h
+_hubble_distance = 299792.458 / 100.
+
 
 class CosmologyError(Exception):
 
     """Exception related to cosmology."""
 
 
+def _hermite(x, xp, fp, dfp):
+    """Cubic Hermite interpolation of ``fp`` (with derivative ``dfp``) tabulated at increasing ``xp``, for ``x`` within ``xp`` range."""
+    i = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    h = xp[i + 1] - xp[i]
+    t = (x - xp[i]) / h
+    t2 = t * t
+    t3 = t2 * t
+    return (2. * t3 - 3. * t2 + 1.) * fp[i] + (t3 - 2. * t2 + t) * h * dfp[i] + (-2. * t3 + 3. * t2) * fp[i + 1] + (t3 - t2) * h * dfp[i + 1]
+
+
 class TabulatedDESI(object):
     """
     Class to load tabulated z->E(z) and z->comoving_radial_distance(z) relations within DESI fiducial cosmology
-    (in LSS/data/desi_fiducial_cosmology.dat) and perform the (linear) interpolations at any z.
+    (in LSS/data/desi_fiducial_cosmology.dat) and perform the (cubic Hermite) interpolations at any z.
 
     >>> cosmo = TabulatedDESI()
     >>> distance = cosmo.comoving_radial_distance([0.1, 0.2])
     >>> efunc = cosmo.efunc(0.3)
+    >>> z = cosmo.z_at_comoving_radial_distance(distance)
 
     The cosmology is defined in https://github.com/abacusorg/AbacusSummit/blob/master/Cosmologies/abacus_cosm000/CLASS.ini
     and the tabulated file was obtained using https://github.com/adematti/cosmoprimo/blob/main/cosmoprimo/fiducial.py.
@@ -25,25 +39,60 @@ class TabulatedDESI(object):
     Note
     ----
     Redshift interpolation range is [0, 100].
+    The table is read only once per process and shared (read-only) by all instances.
     """
     _filename = os.path.join(_dir_tabulated, 'desi_fiducial_cosmology.dat')
+    _table = None
 
     def __init__(self):
-        self._z, self._efunc, self._comoving_radial_distance = np.loadtxt(self._filename, comments='#', usecols=None, unpack=True)
+        if TabulatedDESI._table is None:
+            TabulatedDESI._table = self._load(self._filename)
+        self._z, self._efunc, self._comoving_radial_distance, self._defunc = TabulatedDESI._table
+
+    @staticmethod
+    def _load(filename):
+        z, efunc, comoving_radial_distance = np.loadtxt(filename, comments='#', usecols=None, unpack=True)
+        # derivative of E(z), for the Hermite interpolation; that of the comoving distance is c/H0/E(z)
+        defunc = np.gradient(efunc, z, edge_order=2)
+        table = (z, efunc, comoving_radial_distance, defunc)
+        for array in table: array.setflags(write=False)
+        return table
+
+    def _check_z(self, z):
+        z = np.asarray(z, dtype='f8')
+        mask = (z < self._z[0]) | (z > self._z[-1])
+        if mask.any(): raise CosmologyError('Input z outside of tabulated range.')
+        return z
 
     def efunc(self, z):
         r"""Return :math:`E(z)`, where the Hubble parameter is defined as :math:`H(z) = H_{0} E(z)`, unitless."""
-        z = np.asarray(z)
-        mask = (z < self._z[0]) | (z > self._z[-1])
-        if mask.any(): raise CosmologyError('Input z outside of tabulated range.')
-        return np.interp(z, self._z, self._efunc, left=None, right=None)
+        z = self._check_z(z)
+        return _hermite(z, self._z, self._efunc, self._defunc)
 
     def comoving_radial_distance(self, z):
         r"""Return comoving radial distance, in :math:`\mathrm{Mpc}/h`."""
-        z = np.asarray(z)
-        mask = (z < self._z[0]) | (z > self._z[-1])
-        if mask.any(): raise CosmologyError('Input z outside of tabulated range.')
-        return np.interp(z, self._z, self._comoving_radial_distance, left=None, right=None)
+        z = self._check_z(z)
+        return _hermite(z, self._z, self._comoving_radial_distance, _hubble_distance / self._efunc)
+
+    def angular_diameter_distance(self, z):
+        r"""Return angular diameter distance (flat cosmology), in :math:`\mathrm{Mpc}/h`."""
+        z = self._check_z(z)
+        return self.comoving_radial_distance(z) / (1. + z)
+
+    def comoving_volume(self, z):
+        r"""Return full-sky comoving volume within redshift z (flat cosmology), in :math:`(\mathrm{Mpc}/h)^{3}`."""
+        return 4. / 3. * np.pi * self.comoving_radial_distance(z)**3
+
+    def z_at_comoving_radial_distance(self, distance):
+        r"""Return redshift at comoving radial distance (in :math:`\mathrm{Mpc}/h`), inverting the tabulated relation."""
+        distance = np.asarray(distance, dtype='f8')
+        mask = (distance < self._comoving_radial_distance[0]) | (distance > self._comoving_radial_distance[-1])
+        if mask.any(): raise CosmologyError('Input distance outside of tabulated range.')
+        z = np.interp(distance, self._comoving_radial_distance, self._z)
+        # Newton steps, with d(distance)/dz = c/H0/E(z)
+        for i in range(2):
+            z = np.clip(z - (self.comoving_radial_distance(z) - distance) * self.efunc(z) / _hubble_distance, self._z[0], self._z[-1])
+        return z
 
 
 if __name__ == '__main__':
@@ -51,5 +100,19 @@ if __name__ == '__main__':
     cosmo = TabulatedDESI()
     distance = cosmo.comoving_radial_distance([0.1, 0.2])
     efunc = cosmo.efunc(0.3)
-    assert np.allclose(distance, [292.58423977, 570.41981713], rtol=1e-9, atol=0)
-    assert np.allclose(efunc, 1.1736407657972752, rtol=1e-9, atol=0)
\ No newline at end of file
+    # reference values changed at the 1e-9 level when going from linear to cubic interpolation
+    # (linear gave 570.41981713 and 1.1736407657972752)
+    assert np.allclose(distance, [292.58423977, 570.41981818], rtol=1e-9, atol=0)
+    assert np.allclose(efunc, 1.173640763365794, rtol=1e-9, atol=0)
+    assert np.allclose(cosmo.z_at_comoving_radial_distance(distance), [0.1, 0.2], rtol=1e-9, atol=0)
+    assert np.allclose(cosmo.angular_diameter_distance(0.2) * 1.2, distance[1], rtol=1e-12, atol=0)
+    assert TabulatedDESI()._z is cosmo._z
+
+    # interpolation accuracy: interpolate from every other row of the table and compare to the rows left out
+    z, efunc, distance, defunc = cosmo._table
+    z_odd = z[1:-1:2]
+    efunc_interp = _hermite(z_odd, z[::2], efunc[::2], np.gradient(efunc[::2], z[::2], edge_order=2))
+    distance_interp = _hermite(z_odd, z[::2], distance[::2], _hubble_distance / efunc[::2])
+    sel = z_odd > 1e-4  # table precision is ~1e-5 relative below that
+    assert np.allclose(efunc_interp, efunc[1:-1:2], rtol=1e-9, atol=0)
+    assert np.allclose(distance_interp[sel], distance[1:-1:2][sel], rtol=1e-9, atol=0)
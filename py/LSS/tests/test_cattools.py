@@ -0,0 +1,63 @@
+"""
+Test the per-tile store of LSS.main.cattools.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import LSS.main.cattools as ct
+    missing = None
+except ImportError as e:
+    missing = str(e)
+
+
+@unittest.skipIf(missing is not None, 'missing dependency: {0}'.format(missing))
+class TestTileStore(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.outf = os.path.join(self.testdir, 'datcomb_dark_spec_zdone.fits')
+        self.dtype = [('TARGETID', 'i8'), ('TILEID', 'i4'), ('Z', 'f8')]
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def tile(self, tileid, n):
+        rows = np.zeros(n, dtype=self.dtype)
+        rows['TILEID'] = tileid
+        rows['TARGETID'] = 1000*tileid + np.arange(n)
+        return rows
+
+    def test_empty_tiles(self):
+        """Test tiles without any row are recorded but leave the store readable."""
+        manifest = ct.init_tile_store(self.outf)
+        manifest = ct.add_tile_fragment(self.outf, 5, self.tile(5, 0), manifest)
+        self.assertIsNone(ct.read_tile_store(self.outf))
+        manifest = ct.add_tile_fragment(self.outf, 7, self.tile(7, 3), manifest)
+        manifest = ct.add_tile_fragment(self.outf, 8, self.tile(8, 0), manifest)
+        specd = ct.read_tile_store(self.outf)
+        self.assertTrue(np.array_equal(specd, self.tile(7, 3)))
+        self.assertTrue(np.array_equal(ct.tile_store_tileids(self.outf), [5, 7, 8]))
+
+        # ADM a tile that is redone without rows drops its earlier rows.
+        manifest = ct.add_tile_fragment(self.outf, 7, self.tile(7, 0), manifest)
+        self.assertIsNone(ct.read_tile_store(self.outf))
+        self.assertEqual(os.listdir(ct.tile_store_dir(self.outf)), ['manifest.json'])
+
+    def test_compact(self):
+        """Test compacting a store with empty tiles writes the other tiles out."""
+        manifest = ct.init_tile_store(self.outf)
+        for tileid, n in [(1, 4), (2, 0), (3, 2)]:
+            manifest = ct.add_tile_fragment(self.outf, tileid, self.tile(tileid, n), manifest)
+        self.assertTrue(ct.compact_tile_store(self.outf))
+        specd = ct.read_tile_store(self.outf)
+        self.assertTrue(np.array_equal(specd, np.concatenate([self.tile(1, 4), self.tile(3, 2)])))
+        self.assertEqual(len(ct.read_tile_manifest(self.outf)['fragments']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
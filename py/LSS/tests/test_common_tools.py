@@ -0,0 +1,136 @@
+"""
+Test LSS.common_tools.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import fitsio
+    from astropy.table import Table
+    from LSS import common_tools as common
+    missing = None
+except ImportError as e:
+    missing = str(e)
+
+
+def comp_tileloc_loop(dz):
+    """The original per-location loop of comp_tileloc, as reference."""
+    locl, nlocl = np.unique(dz['TILELOCID'], return_counts=True)
+    wz = dz['LOCATION_ASSIGNED'] == 1
+    loclz, nloclz = np.unique(dz[wz]['TILELOCID'], return_counts=True)
+    loco = []
+    fzo = []
+    for i in range(0, len(locl)):
+        nt = nlocl[i]
+        loc = locl[i]
+        w = loclz == loc
+        nz = 0
+        if len(loclz[w]) == 1:
+            nz = nloclz[w][0]
+        loco.append(loc)
+        fzo.append(nz/nt)
+    return loco, fzo
+
+
+def count_tiles_loop(fjg):
+    """The original per-row loop of count_tiles_better, as reference."""
+    fjg = np.array(fjg)
+    fjg = fjg[np.argsort(fjg['TARGETID'])]
+    tids = np.unique(fjg['TARGETID'])
+    nt = []
+    tl = []
+    tli = []
+    ti = 0
+    i = 0
+    while i < len(fjg):
+        tls = []
+        tlis = []
+        while fjg[i]['TARGETID'] == tids[ti]:
+            tls.append(fjg[i]['TILEID'])
+            tlis.append(fjg[i]['TILELOCID'])
+            i += 1
+            if i == len(fjg):
+                break
+        tlsu = np.unique(tls)
+        tlisu = np.unique(tlis)
+        nt.append(len(tlsu))
+        tl.append("-".join(tlsu.astype(str)))
+        tli.append("-".join(tlisu.astype(str)))
+        ti += 1
+    return tids, nt, tl, tli
+
+
+@unittest.skipIf(missing is not None, 'missing dependency: {0}'.format(missing))
+class TestCommonTools(unittest.TestCase):
+
+    def test_count_tiles_arrays(self):
+        """Test count_tiles_arrays matches the original loop on a synthetic tarspecwdup table."""
+        rng = np.random.default_rng(1)
+        ntarg = 3000
+        tids = rng.choice(2**40, ntarg, replace=False)
+        ff = Table()
+        ff['TARGETID'] = np.repeat(tids, rng.integers(1, 6, ntarg))
+        ff['TILEID'] = rng.integers(1000, 1050, len(ff))
+        ff['LOCATION'] = rng.integers(0, 5000, len(ff))
+        ff['TILELOCID'] = 10000*ff['TILEID'] + ff['LOCATION']
+        # ADM repeated rows, in random order.
+        ff = ff[rng.permutation(np.concatenate([np.arange(len(ff)), rng.choice(len(ff), len(ff)//10)]))]
+        tc = common.count_tiles_arrays(ff['TARGETID'], ff['TILEID'], ff['TILELOCID'])
+        for col, ref in zip(['TARGETID', 'NTILE', 'TILES', 'TILELOCIDS'], count_tiles_loop(ff)):
+            self.assertTrue(np.array_equal(tc[col], ref), col)
+
+    def test_comp_tileloc(self):
+        """Test comp_tileloc matches the original loop."""
+        rng = np.random.default_rng(6)
+        for nloc in [1, 10, 3000]:
+            tilelocid = rng.choice((10000*np.arange(1000, 1100)[:, None] + np.arange(5000)[None, :]).ravel(), nloc, replace=False)
+            # ADM several targets per location, some locations with no assigned target.
+            ntar = rng.integers(1, 6, nloc)
+            dz = Table()
+            dz['TILELOCID'] = rng.permutation(np.repeat(tilelocid, ntar))
+            dz['LOCATION_ASSIGNED'] = (rng.random(len(dz)) < 0.3).astype(int)
+            loco, fzo = common.comp_tileloc(dz)
+            locref, fzref = comp_tileloc_loop(dz)
+            self.assertTrue(np.array_equal(loco, locref))
+            self.assertTrue(np.array_equal(fzo, fzref))
+
+    def test_comp_tileloc_none_assigned(self):
+        """Test comp_tileloc with no assigned target."""
+        dz = Table({'TILELOCID': [3, 1, 1, 2], 'LOCATION_ASSIGNED': [0, 0, 0, 0]})
+        loco, fzo = common.comp_tileloc(dz)
+        self.assertTrue(np.array_equal(loco, [1, 2, 3]))
+        self.assertTrue(np.array_equal(fzo, [0., 0., 0.]))
+
+    def test_write_LSS_cols(self):
+        """Test write_LSS_cols updates and adds columns, and leaves the catalog unchanged if the check fails."""
+        testdir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(testdir, 'test_clustering.dat.fits')
+            cat = np.zeros(100, dtype=[('TARGETID', 'i8'), ('WEIGHT', 'f8'), ('Z', 'f4')])
+            cat['TARGETID'] = np.arange(100)
+            cat['WEIGHT'] = 1.
+            common.write_LSS(cat, fn)
+            new = {'WEIGHT': np.full(100, 2.), 'NX': np.arange(100.)}
+            self.assertTrue(common.write_LSS_cols(fn, new, ['WEIGHT', 'NX']))
+            out = fitsio.read(fn)
+            self.assertTrue(np.array_equal(out['WEIGHT'], new['WEIGHT']))
+            self.assertTrue(np.array_equal(out['NX'], new['NX']))
+            self.assertTrue(np.array_equal(out['TARGETID'], cat['TARGETID']))
+            self.assertFalse(os.path.exists(fn+'.tmp'))
+
+            # ADM a failed read-back must not touch the catalog.
+            with mock.patch.object(common.fitsio, 'read', side_effect=OSError('corrupted')):
+                self.assertEqual(common.write_LSS_cols(fn, {'WEIGHT': np.full(100, 3.)}, ['WEIGHT']), 'FAILED')
+            self.assertTrue(np.array_equal(fitsio.read(fn)['WEIGHT'], new['WEIGHT']))
+            self.assertFalse(os.path.exists(fn+'.tmp'))
+        finally:
+            shutil.rmtree(testdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
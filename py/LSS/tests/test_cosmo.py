@@ -0,0 +1,51 @@
+"""
+Test the comoving distances of LSS.Cosmo.
+"""
+import unittest
+
+import numpy as np
+
+try:
+    from LSS.Cosmo import distance
+    from LSS.romberg import rom
+    missing = None
+except ImportError as e:
+    missing = str(e)
+
+
+@unittest.skipIf(missing is not None, 'missing dependency: {0}'.format(missing))
+class TestDistance(unittest.TestCase):
+
+    def setUp(self):
+        self.d = distance(0.31, 0.69)
+
+    def romberg_dc(self, z):
+        """The original Romberg comoving distance, as reference."""
+        return (self.d.c/self.d.h0)*rom(0, z, self.d.evolution)
+
+    def test_dc_matches_romberg(self):
+        """Test dc matches Romberg integration for positive and negative z."""
+        z = np.array([-0.9, -0.5, -0.01, 0., 0.003, 0.5, 1.2, 3.7])
+        ref = np.array([self.romberg_dc(zz) for zz in z])
+        self.assertTrue(np.allclose(self.d.dc(z), ref, rtol=1e-6, atol=1e-6))
+        for zz, r in zip(z, ref):
+            self.assertAlmostEqual(self.d.dc(zz), r, delta=1e-6*max(abs(r), 1.))
+
+    def test_dc_nonfinite(self):
+        """Test dc returns nan for nan, inf and z <= -1 without falling back to Romberg."""
+        z = np.array([0.5, np.nan, np.inf, -np.inf, -1., -2., -0.5])
+        dc = self.d.dc(z)
+        self.assertTrue(np.all(np.isnan(dc[1:6])))
+        self.assertTrue(np.all(np.isfinite(dc[[0, 6]])))
+        self.assertTrue(np.isnan(self.d.dc(np.nan)))
+        self.assertTrue(np.isnan(self.d.dc(np.inf)))
+
+    def test_dc2z(self):
+        """Test dc2z inverts dc."""
+        z = np.array([-0.5, -0.1, 0., 0.7, 3.])
+        self.assertTrue(np.allclose(self.d.dc2z(self.d.dc(z)), z, atol=1e-9))
+        self.assertTrue(np.all(np.isnan(self.d.dc2z(np.array([np.nan, np.inf])))))
+
+
+if __name__ == '__main__':
+    unittest.main()
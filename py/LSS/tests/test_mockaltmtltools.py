@@ -0,0 +1,118 @@
+"""
+Test the batched ledger updates in LSS.main.mockaltmtltools.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import healpy as hp
+    from astropy.table import Table
+    import desitarget.mtl
+    from desitarget.io import find_target_files, write_with_units
+    from desitarget.mtl import make_mtl, mtldatamodel, zcatdatamodel, survey_data_model
+    from desitarget.targetmask import desi_mask
+    from desitarget.targets import encode_targetid, initial_priority_numobs
+    import LSS.main.mockaltmtltools as amt
+    missing = None
+except ImportError as e:
+    missing = str(e)
+
+
+def write_ledgers(targets, outdir):
+    """Write initial main-survey dark-time ledgers for targets to outdir.
+
+    This mirrors desitarget.mtl.make_ledger_in_hp, but writes the files
+    directly rather than through desitarget.io.write_mtl, which fails with
+    numpy>=2 when converting the data release of the TARGETIDs to an int.
+    """
+    mtl = make_mtl(targets, 'DARK', trimcols=True)
+    nside = desitarget.mtl._get_mtl_nside()
+    mtlpix = hp.ang2pix(nside, np.radians(90-mtl['DEC']), np.radians(mtl['RA']), nest=True)
+    for pix in np.unique(mtlpix):
+        fn = find_target_files(outdir, dr='dr9', flavor='mtl', survey='main', obscon='DARK', hp=pix, ender='ecsv')
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        data = mtl[mtlpix == pix].as_array()
+        hdr = {'SURVEY': 'main', 'OBSCON': 'DARK', 'SCND': False, 'OVERRIDE': False,
+               'FILENSID': nside, 'FILENEST': True, 'FILEHPX': int(pix), 'DR': 9}
+        write_with_units(fn, data[np.argsort(data['TARGETID'])], extname='MTL', header=hdr, ecsv=True)
+
+
+@unittest.skipIf(missing is not None, 'missing dependency: {0}'.format(missing))
+class TestMockAltMTLBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(3)
+        n = 2000
+        targ = np.zeros(n, dtype=mtldatamodel.dtype.descr[:15])
+        targ['RA'] = rng.uniform(150, 156, n)
+        targ['DEC'] = rng.uniform(0, 6, n)
+        targ['TARGETID'] = encode_targetid(objid=np.arange(n), brickid=np.arange(n)//100+1, release=9010)
+        targ['DESI_TARGET'] = rng.choice([desi_mask.LRG, desi_mask.ELG, desi_mask.QSO], n)
+        targ['SUBPRIORITY'] = rng.random(n)
+        targ['OBSCONDITIONS'] = 1
+        targ['PRIORITY_INIT'], targ['NUMOBS_INIT'] = initial_priority_numobs(targ, obscon='DARK')
+        write_ledgers(targ, os.path.join(self.testdir, 'seq'))
+        shutil.copytree(os.path.join(self.testdir, 'seq'), os.path.join(self.testdir, 'bat'))
+        self.targets = targ
+
+        # ADM overlapping tiles, so that some targets are observed more than once in a batch.
+        self.actions = Table({'TILEID': [11, 12, 13], 'ACTIONTYPE': ['update']*3, 'ARCHIVEDATE': [20230101]*3})
+        zdm = survey_data_model(zcatdatamodel, survey='main')
+        self.zcats = {}
+        for tileid in self.actions['TILEID']:
+            ii = np.sort(rng.choice(n, 500, replace=False))
+            zcat = Table(np.zeros(len(ii), dtype=zdm.dtype))
+            for col in ['RA', 'DEC', 'TARGETID']:
+                zcat[col] = targ[col][ii]
+            zcat['Z'] = rng.uniform(0.1, 3, len(ii))
+            zcat['ZWARN'] = np.where(rng.random(len(ii)) < 0.1, 4, 0)
+            zcat['ZTILEID'] = tileid
+            zcat['NUMOBS'] = 1
+            zcat['Z_QN'] = zcat['Z']
+            zcat['DELTACHI2'] = rng.uniform(0, 100, len(ii))
+            self.zcats[tileid] = zcat
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def make_alt_zcat_for_tile(self, altmtldir, t, **kwargs):
+        zcat = Table(self.zcats[t['TILEID']], copy=True)
+        return zcat, zcat
+
+    def test_batch_matches_sequential(self):
+        """Test update_alt_ledger_batch writes the same ledgers as update_alt_ledger on each tile."""
+        seqdir = os.path.join(self.testdir, 'seq', 'main', 'dark')
+        batdir = os.path.join(self.testdir, 'bat', 'main', 'dark')
+        with mock.patch.object(amt, 'make_alt_zcat_for_tile', self.make_alt_zcat_for_tile), \
+             mock.patch.object(amt, 'write_amtl_tile_tracker', return_value='done'):
+            for t in self.actions:
+                amt.update_alt_ledger(self.testdir, seqdir, None, t, survey='main', obscon='dark',
+                                      zcatdir=self.testdir, mock=True, targets=self.targets)
+            amt.update_alt_ledger_batch(self.testdir, batdir, None, self.actions, survey='main', obscon='dark',
+                                        zcatdir=self.testdir, mock=True, targets=self.targets)
+        self.assertTrue(amt.checkLedgersMatch(seqdir, batdir))
+
+        # ADM a batch missing a tile should not match.
+        shutil.rmtree(os.path.join(self.testdir, 'bat'))
+        write_ledgers(self.targets, os.path.join(self.testdir, 'bat'))
+        with mock.patch.object(amt, 'make_alt_zcat_for_tile', self.make_alt_zcat_for_tile), \
+             mock.patch.object(amt, 'write_amtl_tile_tracker', return_value='done'):
+            amt.update_alt_ledger_batch(self.testdir, batdir, None, self.actions[:2], survey='main', obscon='dark',
+                                        zcatdir=self.testdir, mock=True, targets=self.targets)
+        self.assertFalse(amt.checkLedgersMatch(seqdir, batdir))
+
+    def test_batch_mock_needs_targets(self):
+        """Test update_alt_ledger_batch insists on a target file for mocks."""
+        with self.assertRaises(ValueError):
+            amt.update_alt_ledger_batch(self.testdir, self.testdir, None, self.actions, survey='main', obscon='dark',
+                                        zcatdir=self.testdir, mock=True, targets=None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -307,15 +307,9 @@ if args.rsdblind == 'y':
         cl = regl
     if reg_md == 'GC':
         cl = gcl
-    for reg in cl:
-        fnd = dirout+type+notqso+reg+'_clustering.dat.fits'
-        fndr = dirout+type+notqso+reg+'_clustering.MGrsd.dat.fits'
-        data = Table(fitsio.read(fnd))
-        data_real = Table(fitsio.read(fndr))
-
-        out_file = fnd
-        blind.apply_zshift_RSD(data,data_real,out_file,
-                               fgrowth_fid=args.fiducial_f,
-                               fgrowth_blind=fgrowth_blind,
-                               comments=f"f_blind: {fgrowth_blind}, w0_blind: {w0_blind}, wa_blind: {wa_blind}")
+    #blind all regions in a worker pool, sharing the distance-redshift relations
+    fnds = [dirout+type+notqso+reg+'_clustering.dat.fits' for reg in cl]
+    fndrs = [dirout+type+notqso+reg+'_clustering.MGrsd.dat.fits' for reg in cl]
+    blind.get_blinding_shift(fgrowth_fid=args.fiducial_f, fgrowth_blind=fgrowth_blind).apply_RSD_files(fnds, fndrs, fnds,
+        comments=f"f_blind: {fgrowth_blind}, w0_blind: {w0_blind}, wa_blind: {wa_blind}")
 
@@ -0,0 +1,99 @@
+#benchmark of the serial and parallel reading of the per-tile, per-petal spectroscopic files in LSS.main.cattools.combtile_spec,
+#on a mock redux tree (same layout as spectro/redux/daily/tiles/archive) generated locally
+#e.g., python bench_combtile_spec.py --ntiles 50 --nproc 8 --nthreads 4
+#to mimic the latency of a network file system, point --outdir to e.g. $SCRATCH
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import numpy as np
+import fitsio
+from astropy.table import Table
+
+import LSS.main.cattools as ct
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--outdir", help="directory for the mock redux tree and the outputs; default is a temporary directory that is removed at the end",default=None)
+parser.add_argument("--ntiles", help="number of tiles",default=20,type=int)
+parser.add_argument("--ntarg", help="number of targets per petal",default=500,type=int)
+parser.add_argument("--nproc", help="number of processes reading tiles in parallel",default=None,type=int)
+parser.add_argument("--nthreads", help="number of threads reading the petals of each tile",default=4,type=int)
+args = parser.parse_args()
+print(args)
+
+outdir = args.outdir
+if outdir is None:
+    outdir = tempfile.mkdtemp()
+coaddir = outdir+'/tiles/archive/'
+zdate = '20220101'
+tdate = '20211231'
+
+def mkpetal(tile,si,rng):
+    fend = '-'+str(si)+'-'+str(tile)+'-thru'+tdate+'.fits'
+    fdir = coaddir+str(tile)+'/'+zdate+'/'
+    n = args.ntarg
+    tids = 1000000*tile+1000*si+np.arange(n)
+    zs = np.zeros(n,dtype=[('TARGETID','>i8'),('Z','>f8'),('ZERR','>f8'),('ZWARN','>i8'),('SPECTYPE','S6'),('DELTACHI2','>f8')])
+    zs['TARGETID'] = tids
+    zs['Z'] = rng.random(n)*3
+    zs['ZERR'] = rng.random(n)*1e-4
+    zs['ZWARN'] = rng.integers(0,8,n)
+    zs['SPECTYPE'] = 'GALAXY'
+    zs['DELTACHI2'] = rng.random(n)*100
+    fm = np.zeros(n,dtype=[('TARGETID','>i8'),('LOCATION','>i8'),('FIBER','>i4'),('COADD_FIBERSTATUS','>i4'),('PRIORITY','>i8'),('TARGET_RA','>f8'),('TARGET_DEC','>f8'),('DESI_TARGET','>i8')])
+    fm['TARGETID'] = tids
+    fm['LOCATION'] = 1000*si+np.arange(n)
+    fm['FIBER'] = 500*si+np.arange(n)
+    fm['PRIORITY'] = rng.integers(1000,4000,n)
+    fm['TARGET_RA'] = rng.random(n)*360
+    fm['TARGET_DEC'] = rng.random(n)*180-90
+    fm['DESI_TARGET'] = rng.integers(0,2**10,n)
+    fitsio.write(fdir+'redrock'+fend,zs,extname='REDSHIFTS',clobber=True)
+    fitsio.write(fdir+'redrock'+fend,fm,extname='FIBERMAP')
+    zm = np.zeros(n,dtype=[('TARGETID','>i8'),('Z_QN','>f8'),('Z_QN_CONF','>f8'),('IS_QSO_QN','>i2'),('ZWARN','>i8')])
+    zm['TARGETID'] = tids
+    zm['Z_QN'] = rng.random(n)*3
+    zm['Z_QN_CONF'] = rng.random(n)
+    zm['ZWARN'] = zs['ZWARN']
+    fitsio.write(fdir+'zmtl'+fend,zm,extname='ZMTL',clobber=True)
+    sc = np.zeros(n,dtype=[('TARGETID','>i8')]+[('TSNR2_'+tp,'>f4') for tp in ['ELG','LYA','BGS','QSO','LRG']])
+    sc['TARGETID'] = tids
+    for tp in ['ELG','LYA','BGS','QSO','LRG']:
+        sc['TSNR2_'+tp] = rng.random(n)
+    fitsio.write(fdir+'coadd'+fend,np.zeros(1,dtype=[('X','>f4')]),extname='FLUX',clobber=True)
+    fitsio.write(fdir+'coadd'+fend,sc,extname='SCORES')
+
+rng = np.random.default_rng(12345)
+tiles = Table()
+tiles['TILEID'] = np.arange(1000,1000+args.ntiles)
+tiles['ZDATE'] = int(zdate)
+tiles['THRUDATE'] = int(tdate)
+t0 = time.time()
+for tile in tiles['TILEID']:
+    os.makedirs(coaddir+str(tile)+'/'+zdate,exist_ok=True)
+    for si in range(10):
+        mkpetal(tile,si,rng)
+print('made mock redux tree with '+str(args.ntiles)+' tiles in '+coaddir+' in '+str(round(time.time()-t0,2))+' s')
+
+timings = {}
+outfs = {}
+for name,par,nthreads in [('serial','n',1),('parallel','y',args.nthreads)]:
+    outfs[name] = outdir+'/datcomb_spec_'+name+'.fits'
+    if os.path.isfile(outfs[name]):
+        os.remove(outfs[name])
+    t0 = time.time()
+    ct.combtile_spec(tiles,outfs[name],par=par,nproc=args.nproc,nthreads=nthreads,coaddir=coaddir)
+    timings[name] = time.time()-t0
+
+ds = fitsio.read(outfs['serial'])
+dp = fitsio.read(outfs['parallel'])
+same = ds.dtype == dp.dtype and np.array_equal(ds,dp)
+print('outputs identical: '+str(same))
+for name in timings:
+    print(name+' took '+str(round(timings[name],2))+' s')
+print('speed-up: '+str(round(timings['serial']/timings['parallel'],2)))
+if args.outdir is None:
+    shutil.rmtree(outdir)
+if not same:
+    raise ValueError('serial and parallel outputs differ')
@@ -0,0 +1,68 @@
+#benchmark of LSS.common_tools.comp_tileloc (FRACZ_TILELOCID from unique counts) against the per-location loop it replaced,
+#on synthetic inputs with several targets per TILELOCID
+#e.g., python bench_comp_tileloc.py --nlocs 100000 1000000 10000000 --maxloop 100000
+#the loop compares every location with all of the assigned ones, so its time grows as the square of the number of locations
+#and it is only run up to --maxloop locations
+#with the defaults, on one core, comp_tileloc took 0.02 s, 0.19 s and 2.2 s for 1e5, 1e6 and 1e7 locations (3e5, 3e6 and 2.9e7 targets);
+#the loop took 5.0 s for 1e5 locations, with identical outputs (so about 500 s for 1e6 and 14 h for 1e7)
+import time
+import argparse
+import numpy as np
+
+import LSS.common_tools as common
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--nlocs", help="numbers of TILELOCID to benchmark",default=[100000,1000000,10000000],type=int,nargs='+')
+parser.add_argument("--maxloop", help="only run the original loop up to this number of TILELOCID",default=100000,type=int)
+parser.add_argument("--fassigned", help="fraction of targets that are assigned",default=0.3,type=float)
+parser.add_argument("--seed", help="random seed",default=6,type=int)
+args = parser.parse_args()
+print(args)
+
+def mk_input(nloc,rng):
+    #1 to 5 targets per TILELOCID, in random order
+    tilelocid = 10000*rng.integers(1000,30000,nloc)+rng.integers(0,5000,nloc)
+    tilelocid = np.unique(tilelocid)
+    ntar = rng.integers(1,6,len(tilelocid))
+    dz = {}
+    dz['TILELOCID'] = rng.permutation(np.repeat(tilelocid,ntar))
+    dz['LOCATION_ASSIGNED'] = (rng.random(len(dz['TILELOCID'])) < args.fassigned).astype(int)
+    return dz
+
+def comp_tileloc_loop(dz):
+    #the per-location loop of comp_tileloc before it used unique counts
+    locl,nlocl = np.unique(dz['TILELOCID'],return_counts=True)
+    wz = dz['LOCATION_ASSIGNED'] == 1
+    loclz,nloclz = np.unique(dz['TILELOCID'][wz],return_counts=True)
+    loco = []
+    fzo = []
+    for i in range(0,len(locl)):
+        nt = nlocl[i]
+        loc = locl[i]
+        w = loclz == loc
+        nz = 0
+        if len(loclz[w]) == 1:
+            nz = nloclz[w][0]
+        loco.append(loc)
+        fzo.append(nz/nt)
+    return loco,fzo
+
+rng = np.random.default_rng(args.seed)
+nfail = 0
+for nloc in args.nlocs:
+    dz = mk_input(nloc,rng)
+    t0 = time.time()
+    loco,fzo = common.comp_tileloc(dz)
+    tnew = time.time()-t0
+    print(str(len(loco))+' locations, '+str(len(dz['TILELOCID']))+' targets: comp_tileloc took '+str(round(tnew,2))+' s')
+    if nloc <= args.maxloop:
+        t0 = time.time()
+        locref,fzref = comp_tileloc_loop(dz)
+        told = time.time()-t0
+        same = np.array_equal(loco,locref) and np.array_equal(fzo,fzref)
+        print('    loop took '+str(round(told,2))+' s, outputs identical: '+str(same)+', speed-up: '+str(round(told/tnew,1)))
+        if not same:
+            nfail += 1
+    del dz
+if nfail > 0:
+    raise ValueError('loop and comp_tileloc outputs differ')
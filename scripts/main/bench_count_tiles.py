@@ -0,0 +1,84 @@
+#benchmark of the TARGETID grouping of LSS.main.cattools.count_tiles_better (LSS.common_tools.count_tiles_arrays)
+#against the per-row loop it replaced, on a synthetic datcomb_*_tarspecwdup_zdone table
+#e.g., python bench_count_tiles.py --ntarg 400000
+#with the defaults (400000 targets, 1.3M rows with the duplicates), on one core: loop 20.0 s, count_tiles_arrays 3.9 s, identical outputs
+import time
+import argparse
+import numpy as np
+from astropy.table import Table
+
+import LSS.common_tools as common
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--ntarg", help="number of unique targets",default=400000,type=int)
+parser.add_argument("--ntiles", help="number of tiles",default=2000,type=int)
+parser.add_argument("--maxtiles", help="maximum number of tiles per target",default=5,type=int)
+parser.add_argument("--fdup", help="fraction of the rows that are repeated",default=0.1,type=float)
+parser.add_argument("--seed", help="random seed",default=1,type=int)
+args = parser.parse_args()
+print(args)
+
+def mk_tarspecwdup(ntarg,ntiles,maxtiles,fdup,seed):
+    #one row per target/tile combination, a fraction fdup of them repeated, in random order
+    rng = np.random.default_rng(seed)
+    tids = rng.choice(2**40,ntarg,replace=False)
+    ntile = rng.integers(1,maxtiles+1,ntarg)
+    ff = Table()
+    ff['TARGETID'] = np.repeat(tids,ntile)
+    ff['TILEID'] = rng.integers(1000,1000+ntiles,len(ff))
+    ff['LOCATION'] = rng.integers(0,5000,len(ff))
+    ff['TILELOCID'] = 10000*ff['TILEID']+ff['LOCATION']
+    dup = rng.random(len(ff)) < fdup
+    ff = ff[np.concatenate([np.arange(len(ff)),np.flatnonzero(dup)])]
+    return ff[rng.permutation(len(ff))]
+
+def count_tiles_loop(fjg):
+    #the per-row loop of count_tiles_better before it used count_tiles_arrays
+    fjg = np.array(fjg)
+    fjg = fjg[np.argsort(fjg['TARGETID'])]
+    tids = np.unique(fjg['TARGETID'])
+    nt = []
+    tl = []
+    tli = []
+    ti = 0
+    i = 0
+    while i < len(fjg):
+        tls  = []
+        tlis = []
+        while fjg[i]['TARGETID'] == tids[ti]:
+            tls.append(fjg[i]['TILEID'])
+            tlis.append(fjg[i]['TILELOCID'])
+            i += 1
+            if i == len(fjg):
+                break
+        tlsu = np.unique(tls)
+        tlisu = np.unique(tlis)
+        nt.append(len(tlsu))
+        tl.append("-".join(tlsu.astype(str)))
+        tli.append("-".join(tlisu.astype(str)))
+        ti += 1
+    tc = Table()
+    tc['TARGETID'] = tids
+    tc['NTILE'] = nt
+    tc['TILES'] = tl
+    tc['TILELOCIDS'] = tli
+    return tc
+
+ff = mk_tarspecwdup(args.ntarg,args.ntiles,args.maxtiles,args.fdup,args.seed)
+print('made synthetic tarspecwdup table with '+str(len(ff))+' rows')
+
+timings = {}
+t0 = time.time()
+tcl = count_tiles_loop(ff)
+timings['loop'] = time.time()-t0
+t0 = time.time()
+tca = common.count_tiles_arrays(ff['TARGETID'],ff['TILEID'],ff['TILELOCID'])
+timings['arrays'] = time.time()-t0
+
+same = all(np.array_equal(tcl[col],tca[col]) for col in ['TARGETID','NTILE','TILES','TILELOCIDS'])
+print('outputs identical: '+str(same))
+for name in timings:
+    print(name+' took '+str(round(timings[name],2))+' s')
+print('speed-up: '+str(round(timings['loop']/timings['arrays'],2)))
+if not same:
+    raise ValueError('loop and count_tiles_arrays outputs differ')
@@ -58,6 +58,10 @@ parser.add_argument("--combpix",help="if n, just skip to next stage",default='y'
 parser.add_argument("--get_petalsky",help="if y, combine info across tiles to get dispersion in sky fibers",default='n')
 parser.add_argument("--comb_petalqa",help="if y, combine petal qa info across tiles ",default='n')
 parser.add_argument("--par",help="if y, using multiprocessing ",default='n')
+parser.add_argument("--nproc",help="number of processes when using multiprocessing to combine the spec data or the healpix target files; default is the number of CPUs",default=None,type=int)
+parser.add_argument("--nthreads",help="number of threads reading the petals of each tile when combining the spec data",default=1,type=int)
+parser.add_argument("--partitioned",help="if y, new tiles are added to per-tile stores next to the combined files instead of rewriting them; use compact_tilestore.py to write the full files",default='n')
+parser.add_argument("--compact",help="if y (and partitioned is y), the combined files are rewritten from their stores at the end of each step; this rewrites the full files, so for the daily runs leave it at n and run compact_tilestore.py separately before scripts that read the combined files directly",default='n')
 
 parser.add_argument("--redotardup",help="re-run the potential assignments concatenation",default='n')
 parser.add_argument("--redotarspec",help="re-join target and spec data even if no updates",default='n')
@@ -71,6 +75,14 @@ parser.add_argument("--notqso", help="tracer type",default='')
 args = parser.parse_args()
 print(args)
 
+def compact_store(outf,sort=None):
+    #write out the tiles added to the store of outf (if any) into outf itself, since other scripts read outf directly
+    if args.partitioned != 'y' or args.compact != 'y':
+        return
+    manifest = ct.read_tile_manifest(outf)
+    if len(manifest['fragments']) > 0 or manifest['base'] != outf or manifest['base_columns'] is not None:
+        ct.compact_tile_store(outf,sort=sort)
+
 import logging
 # create logger
 logname = 'comb_inputs'
@@ -194,7 +206,10 @@ if specrel == 'daily':
     #specfo = ldirspec+'datcomb_'+prog+'_spec_zdone.fits'
     specfo = basedir+'main/LSS/daily/datcomb_'+prog+'_spec_zdone.fits'
     #if not os.path.isfile(specfo) and args.subguad != 'y':
-    if os.path.isfile(specfo) and args.subguad == 'n' and args.redospec == 'n':
+    if args.partitioned == 'y' and args.subguad == 'n' and args.redospec == 'n' and ct.tile_store_dtype(specfo) is not None:
+        #only the columns are needed
+        specf = np.empty(0,dtype=ct.tile_store_dtype(specfo))
+    elif os.path.isfile(specfo) and args.subguad == 'n' and args.redospec == 'n':
         specf = fitsio.read(specfo)    
     else:
         specf = fitsio.read('/global/cfs/cdirs/desi/survey/catalogs/DA02/LSS/guadalupe/datcomb_'+prog+'_spec_zdone.fits')
@@ -207,7 +222,10 @@ if specrel == 'daily':
     spec_cols_4tar = ['TARGETID','ZWARN','ZWARN_MTL','LOCATION','FIBER','TILEID','TILELOCID','TSNR2_ELG','TSNR2_LYA','TSNR2_BGS','TSNR2_QSO','TSNR2_LRG','PRIORITY']
     logger.info(str(spec_cols_4tar))
     if args.subguad == 'y':
-        dz = Table(fitsio.read(specfo))
+        if args.partitioned == 'y':
+            dz = Table(ct.read_tile_store(specfo))
+        else:
+            dz = Table(fitsio.read(specfo))
         dz.keep_columns(speccols)
         specf = Table(specf)
         gr = np.isin(dz['TILEID'],specf['TILEID'])
@@ -291,16 +309,26 @@ if specrel == 'daily' and args.survey == 'main':
     
         print('will combine pixels for '+str(len(tiles4hp))+' new tiles')
         if len(tiles4hp) > 0:
-            for px in hpxs:
-                print('combining target data for pixel '+str(px)+' '+str(npx)+' out of '+str(len(hpxs)))
-                tarfo = ldirspec+'healpix/datcomb_'+prog+'_'+str(px)+'_tarwdup_zdone.fits'
-                ct.combtiles_wdup_hp(px,tiles4hp,tarfo)
-                npx += 1
+            if args.par == 'y':
+                print('combining target data for '+str(len(hpxs))+' pixels in parallel')
+                tarfos = [ldirspec+'healpix/datcomb_'+prog+'_'+str(px)+'_tarwdup_zdone.fits' for px in hpxs]
+                ct.combtiles_wdup_hps(hpxs,tiles4hp,tarfos,nproc=args.nproc)
+            else:
+                for px in hpxs:
+                    print('combining target data for pixel '+str(px)+' '+str(npx)+' out of '+str(len(hpxs)))
+                    tarfo = ldirspec+'healpix/datcomb_'+prog+'_'+str(px)+'_tarwdup_zdone.fits'
+                    ct.combtiles_wdup_hp(px,tiles4hp,tarfo)
+                    npx += 1
             tiles4comb.write(processed_tiles_file,format='fits',overwrite=True)
 
 if specrel == 'daily' and args.survey == 'DA2':
     tarfo = ldirspec+'/datcomb_'+prog+'_tarwdup_zdone.fits'
-    if os.path.isfile(tarfo) == False or args.redotardup == 'y':
+    if args.partitioned == 'y':
+        #only the new tiles are combined, so this is always run
+        logger.info('adding new tiles to the store of '+tarfo)
+        ct.combtiles_wdup(tiles4comb,fout=tarfo,partitioned='y',redo=args.redotardup)
+        compact_store(tarfo,sort='TARGETID')
+    elif os.path.isfile(tarfo) == False or args.redotardup == 'y':
         logger.info('creating '+tarfo)
         if args.par == 'y':
             
@@ -354,7 +382,8 @@ if specrel == 'daily' and args.survey == 'DA2':
 if  args.doqso == 'y':
     outf = ldirspec+'QSO_catalog.fits'
     if specrel == 'daily':# and args.survey == 'main':
-        ct.combtile_qso(tiles4comb,outf,restart=redoqso)
+        ct.combtile_qso(tiles4comb,outf,restart=redoqso,partitioned=args.partitioned)
+        compact_store(outf)
     else:
         ct.combtile_qso_alt(tiles4comb,outf,coaddir=coaddir)
 
@@ -375,7 +404,8 @@ if  args.mkemlin == 'y':
                 print('wrote '+outf)
                 ndone += 1
                 print('completed '+str(ndone)+' tiles')
-        ct.combtile_em(tiles4comb,outf)
+        ct.combtile_em(tiles4comb,outf,partitioned=args.partitioned)
+        compact_store(outf)
     elif specrel != 'daily':
         ct.combtile_em_alt(tiles4comb,outf,prog='dark',coaddir=coaddir)
     else:
@@ -444,14 +474,14 @@ if args.survey == 'Y1' and args.counts_only == 'y':
 
 if specrel == 'daily' and args.dospec == 'y' and args.survey != 'main':
     specfo = ldirspec+'datcomb_'+prog+'_spec_zdone.fits'
-    if os.path.isfile(specfo) and args.redospec == 'n':
+    if os.path.isfile(specfo) and args.redospec == 'n' and args.partitioned == 'n':
         specf = Table.read(specfo)
         if list(specf.dtype.names) != speccols:
             logger.info('writing original file back out with subselection of columns')
             specf.keep_columns(speccols)
             common.write_LSS(specf,specfo)
         del specf
-    if args.par == 'y':
+    if args.par == 'y' and args.partitioned == 'n':
         tl = []
         if os.path.isfile(specfo) :
             specd = fitsio.read(specfo)
@@ -472,7 +502,7 @@ if specrel == 'daily' and args.dospec == 'y' and args.survey != 'main':
                 trow = tiles_2comb[ind]
                 tile,zdate,tdate = trow['TILEID'],trow['ZDATE'],trow['THRUDATE']
                 logger.info('combining spec data for TILEID '+str(tile))
-                tspec = ct.combspecdata(str(tile),str(zdate),str(tdate))
+                tspec = ct.combspecdata(str(tile),str(zdate),str(tdate),nthreads=args.nthreads)
                 if tspec:
                     tspec['TILEID'] = tile
                     tspec = np.array(tspec)
@@ -497,8 +527,12 @@ if specrel == 'daily' and args.dospec == 'y' and args.survey != 'main':
         del specd
         del tl
     else:
-        newspec = ct.combtile_spec(tiles4comb,specfo,redo=args.redospec,prog=prog,par=args.par)
-    specf = Table.read(specfo)
+        newspec = ct.combtile_spec(tiles4comb,specfo,redo=args.redospec,prog=prog,par=args.par,partitioned=args.partitioned,nproc=args.nproc,nthreads=args.nthreads)
+    compact_store(specfo)
+    if args.partitioned == 'y':
+        specf = Table(ct.read_tile_store(specfo))
+    else:
+        specf = Table.read(specfo)
     if newspec:
         logger.info('new tiles were found for spec dataso there were updates to '+specfo)
     else:
@@ -531,7 +565,10 @@ if specrel == 'daily' and args.dospec == 'y' and args.survey != 'main':
             #dotarspec = True
     
             tarfo = ldirspec+'/datcomb_'+prog+'_tarwdup_zdone.fits'
-            tarf = fitsio.read(tarfo)#,columns=cols)
+            if args.partitioned == 'y':
+                tarf = ct.read_tile_store(tarfo,sort='TARGETID')
+            else:
+                tarf = fitsio.read(tarfo)#,columns=cols)
             logger.info('loaded tarspecwdup file')
             #tarf['TILELOCID'] = 10000*tarf['TILEID'] +tarf['LOCATION']
             if tp == 'BGS_BRIGHT':
@@ -576,7 +613,8 @@ if specrel == 'daily' and args.dospec == 'y' and args.survey != 'main':
         
 if specrel == 'daily' and args.dospec == 'y' and args.survey == 'main':
     specfo = ldirspec+'datcomb_'+prog+'_spec_zdone.fits'
-    if os.path.isfile(specfo) and args.redospec == 'n':
+    #the fixes below rewrite the whole file, so they are not applied to partitioned stores
+    if os.path.isfile(specfo) and args.redospec == 'n' and args.partitioned == 'n':
         specf = Table.read(specfo)
         if args.fixspecf == 'y':
             ii = 0
@@ -615,8 +653,12 @@ if specrel == 'daily' and args.dospec == 'y' and args.survey == 'main':
         if wo == 1:
             specf.write(specfo,overwrite=True,format='fits')
 
-    newspec = ct.combtile_spec(tiles4comb,specfo,redo=args.redospec,prog=prog)
-    specf = Table.read(specfo)
+    newspec = ct.combtile_spec(tiles4comb,specfo,redo=args.redospec,prog=prog,partitioned=args.partitioned,par=args.par,nproc=args.nproc,nthreads=args.nthreads)
+    compact_store(specfo)
+    if args.partitioned == 'y':
+        specf = Table(ct.read_tile_store(specfo))
+    else:
+        specf = Table.read(specfo)
     if newspec:
         print('new tiles were found for spec dataso there were updates to '+specfo)
     else:
@@ -0,0 +1,28 @@
+#compact the per-tile stores written by the combine stage with --partitioned y (see LSS.main.cattools.read_tile_store),
+#i.e. rewrite each combined file with the full concatenation and remove its fragments
+#e.g., python compact_tilestore.py $SCRATCH/main/LSS/daily/datcomb_dark_spec_zdone.fits
+#      python compact_tilestore.py --sort TARGETID $SCRATCH/DA2/LSS/daily/datcomb_dark_tarwdup_zdone.fits
+import sys
+import argparse
+
+import LSS.main.cattools as ct
+
+parser = argparse.ArgumentParser()
+parser.add_argument("files", help="combined files whose stores should be compacted",nargs='+')
+parser.add_argument("--sort", help="column to sort the rows by (e.g., TARGETID for the potential assignment files); default is to keep the order of the tiles",default=None)
+parser.add_argument("--list_only", help="if y, only print the content of the manifests",default='n')
+args = parser.parse_args()
+print(args)
+
+nfail = 0
+for fn in args.files:
+    manifest = ct.read_tile_manifest(fn)
+    nfrag = len(manifest['fragments'])
+    print(fn+': base '+str(manifest['base'])+' with '+str(len(manifest['base_tiles']))+' tiles and '+str(manifest['base_nrows'])+' rows, '+str(nfrag)+' fragments with '+str(sum(frag['NROWS'] for frag in manifest['fragments']))+' rows')
+    if args.list_only == 'y':
+        continue
+    if not ct.compact_tile_store(fn,sort=args.sort):
+        print('compaction of '+fn+' failed')
+        nfail += 1
+if nfail > 0:
+    sys.exit('compaction failed for '+str(nfail)+' files')
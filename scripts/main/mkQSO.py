@@ -45,6 +45,7 @@ parser.add_argument("--version", help="catalog version; use 'test' unless you kn
 parser.add_argument("--survey", help="e.g., main (for all), DA02, any future DA",default='Y1')
 parser.add_argument("--verspec",help="version for redshifts",default='himalayas')
 parser.add_argument("--mkqso",help="whether to perform the 1st stage",default='y')
+parser.add_argument("--incremental",help="only rebuild the tiles that changed since the last run (per-tile QSO catalogs are kept next to the output)",default='n')
 
 
 
@@ -180,6 +181,6 @@ common.write_LSS(qf,qsofn,extname=extname)
 #common.write_LSS(qf,qsofn,extname=extname)
 
 #make the per tile version; only used for LSS
-build_qso_catalog_from_tiles( release=args.verspec, dir_output=qsodir, npool=20, tiles_to_use=None, qsoversion=args.version)
+build_qso_catalog_from_tiles( release=args.verspec, dir_output=qsodir, npool=20, tiles_to_use=None, qsoversion=args.version, incremental=args.incremental == 'y')
 
 